@@ -0,0 +1,95 @@
+"""
+bench_import.py
+
+Mide el tiempo de importación del paquete en un intérprete limpio y
+verifica que ninguna dependencia pesada se cargue al importar.
+
+Uso:
+    python benchmarks/bench_import.py [--repeat 5] [--max-time 2.0]
+                                     [--output import.json]
+
+Termina con código 1 si la mediana supera max-time o si alguno de los
+módulos de HEAVY aparece en sys.modules.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Módulos que deben importarse recién al usar la funcionalidad que los
+# requiere
+HEAVY = ['geopandas', 'matplotlib', 'seaborn', 'shapely', 'sklearn',
+         'statsmodels', 'scipy', 'sodapy', 'joblib']
+
+TARGETS = ['predictivehp', 'predictivehp.models', 'predictivehp.utils',
+           'predictivehp.visualization']
+
+SNIPPET = """
+import json, sys, time
+t0 = time.perf_counter()
+import {target}
+t = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{'time': t, 'heavy': heavy}}))
+"""
+
+
+def time_import(target, repeat=5):
+    """Importa target en repeat intérpretes nuevos.
+
+    Parameters
+    ----------
+    target : str
+    repeat : int
+
+    Returns
+    -------
+    dict
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(
+                   filter(None, [root, os.environ.get('PYTHONPATH')])))
+    times, heavy = [], set()
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, '-c', SNIPPET.format(target=target, heavy=HEAVY)],
+            capture_output=True, text=True, check=True, env=env
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        times.append(r['time'])
+        heavy.update(r['heavy'])
+    times.sort()
+    return {'target': target, 'median': times[len(times) // 2],
+            'min': times[0], 'max': times[-1], 'heavy': sorted(heavy)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-time', type=float, default=2.0,
+                        help='Tiempo máximo (mediana) por import [s]')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    results = [time_import(t, args.repeat) for t in TARGETS]
+    failed = False
+    for r in results:
+        ok = r['median'] <= args.max_time and not r['heavy']
+        failed |= not ok
+        print(f"{r['target']:<30}{r['median']:8.3f} s  "
+              f"{'OK' if ok else 'FAIL'}"
+              f"{'  heavy: ' + ', '.join(r['heavy']) if r['heavy'] else ''}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'max_time': args.max_time, 'results': results},
+                      f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
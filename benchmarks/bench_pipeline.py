@@ -0,0 +1,203 @@
+"""
+bench_pipeline.py
+
+Mide el tiempo de cada etapa del pipeline (parsing de los registros de
+Socrata, shps_processing, Model.prepare_*, fit, predict, calculate_pai y
+heatmap) para los tres modelos, con incidentes sintéticos de distintos
+tamaños (ver utils.make_incidents). No requiere conexión ni
+credenciales.
+
+Uso:
+    python benchmarks/bench_pipeline.py [--sizes 1000 10000]
+                                        [--models STKDE ProMap RForestRegressor]
+                                        [--regressors rf hgb]
+                                        [--repeat 1] [--output bench.json]
+
+Los resultados se guardan como JSON, con una fila por (tamaño, modelo,
+etapa), para comparar entre versiones. La etapa validate incluye el PAI
+obtenido. Con varios --regressors, RForestRegressor se ajusta con cada
+backend sobre la misma salida de prepare_rfr (e.g. 'RForestRegressor[hgb]'),
+para comparar PAI por segundo de entrenamiento.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA = os.path.join(ROOT, 'predictivehp', 'data')
+FIXTURE = os.path.join(ROOT, 'benchmarks', 'fixtures', 'socrata_1k.json')
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+MODELS = ['STKDE', 'ProMap', 'RForestRegressor']
+REGRESSORS = ['rf']
+
+
+def socrata_records(df, offense='BURGLARY OF HABITATION - FORCED ENTRY'):
+    """Registros con el formato que entrega la Socrata API para la
+    consulta de af.get_data.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+      Incidentes con el formato de af.get_data
+    offense : str
+
+    Returns
+    -------
+    list
+    """
+    return [{'incidentnum': f'{i:06d}-{d.year}', 'year1': str(d.year),
+             'date1': f'{d:%Y-%m-%d} 00:00:00.000', 'month1': m,
+             'x_coordinate': f'{x:.4f}', 'y_cordinate': f'{y:.4f}',
+             'offincident': offense}
+            for i, (d, m, x, y) in enumerate(zip(df['date'], df['month1'],
+                                                 df['x'], df['y']))]
+
+
+def stage(results, size, model, name, fn, *args, **kwargs):
+    """Ejecuta fn, registra su tiempo en results y retorna su
+    resultado.
+
+    Returns
+    -------
+    object
+    """
+    st = time.perf_counter()
+    ans = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - st
+    results.append({'size': size, 'model': model, 'stage': name,
+                    'time': elapsed})
+    print(f"{str(size):>9}  {model or '-':<22}{name:<16}{elapsed:10.3f} s")
+    return ans
+
+
+def bench_size(n, shps, models, regressors=REGRESSORS, seed=0):
+    """Etapas del pipeline para n incidentes sintéticos.
+
+    Returns
+    -------
+    list
+    """
+    import predictivehp.utils._aux_functions as af
+    from predictivehp.models import create_model
+    from predictivehp.utils import make_incidents
+
+    results = []
+    df = make_incidents(n, seed=seed)
+    stage(results, n, None, 'parse', af.parse_socrata, socrata_records(df))
+
+    m = create_model(df, shps, start_prediction=date(2017, 11, 1),
+                     use_stkde='STKDE' in models,
+                     use_promap='ProMap' in models,
+                     use_rfr='RForestRegressor' in models)
+    m.set_parameters()
+
+    prepare = {'STKDE': m.prepare_stkde, 'ProMap': m.prepare_promap,
+               'RForestRegressor': m.prepare_rfr}
+    for mm in m.models:
+        data = stage(results, n, mm.name, 'prepare', prepare[mm.name])
+        if mm.name != 'RForestRegressor':
+            bench_fitted(results, n, mm, mm.name, data)
+            continue
+        X_test = m.prepare_rfr(mode='test', label='default')[0]
+        for r in regressors:
+            mm.set_parameters(mm.t_history, mm.xc_size, mm.yc_size,
+                              mm.n_layers, label_weights=mm.l_weights,
+                              use_cache=mm.use_cache, sparse=mm.sparse,
+                              out_of_core=mm.out_of_core,
+                              batch_size=mm.batch_size, regressor=r)
+            name = mm.name if len(regressors) == 1 else f'{mm.name}[{r}]'
+            bench_fitted(results, n, mm, name, data, X_test)
+    return results
+
+
+def bench_fitted(results, n, mm, name, data, X_test=None):
+    """fit, predict, validate, calculate_pai y heatmap de un modelo."""
+    import matplotlib.pyplot as plt
+
+    stage(results, n, name, 'fit', mm.fit, *data)
+    if X_test is not None:
+        stage(results, n, name, 'predict', mm.predict, X_test)
+    else:
+        stage(results, n, name, 'predict', mm.predict)
+    stage(results, n, name, 'validate', mm.validate, ap=0.05)
+    results[-1]['pai'] = float(mm.pai_validated)
+    stage(results, n, name, 'calculate_pai', mm.calculate_pai,
+          np.linspace(0, 1, 100))
+    with tempfile.TemporaryDirectory() as tmp:
+        stage(results, n, name, 'heatmap', mm.heatmap, c=None,
+              savefig=True, fname=os.path.join(tmp, 'heatmap.png'))
+    plt.close('all')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES[:2],
+                        help=f'Nº de incidentes, e.g. {SIZES}')
+    parser.add_argument('--models', nargs='+', default=MODELS,
+                        choices=MODELS)
+    parser.add_argument('--regressors', nargs='+', default=REGRESSORS,
+                        choices=['rf', 'hgb'],
+                        help='Backends de RForestRegressor')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--councils', default=os.path.join(DATA,
+                                                           'councils.shp'))
+    parser.add_argument('--streets', default=None,
+                        help='Por defecto se usan los councils')
+    parser.add_argument('--fixture', default=FIXTURE,
+                        help='JSON con registros de Socrata cuyo parsing '
+                             'se mide una vez')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    import predictivehp as p
+    import predictivehp.utils._aux_functions as af
+
+    results = []
+    if args.fixture:
+        with open(args.fixture) as f:
+            records = json.load(f)
+        stage(results, len(records), None, 'parse_fixture',
+              af.parse_socrata, records)
+
+    shps = stage(results, None, None, 'shps_processing',
+                 af.shps_processing, s_shp=args.streets or args.councils,
+                 c_shp=args.councils)
+    for n in args.sizes:
+        for _ in range(args.repeat):
+            # Cache vacío en cada corrida: se mide el pipeline completo,
+            # no las lecturas del ArtifactCache
+            with tempfile.TemporaryDirectory() as cache_dir, \
+                    p.config_context(cache_dir=cache_dir):
+                results += bench_size(n, shps, args.models,
+                                      regressors=args.regressors,
+                                      seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'platform': platform.platform(),
+                       'numpy': np.__version__, 'pandas': pd.__version__,
+                       'config': p.get_config(),
+                       'date': str(date.today()),
+                       'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
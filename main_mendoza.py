@@ -20,8 +20,7 @@ m = create_model(
 )
 m.set_parameters(m_name='RForestRegressor', t_history=4,
                  xc_size=100, yc_size=100, n_layers=7, label_weights=None,
-                 read_data=False, read_X=True, w_data=False, w_X=True,
-                 verbose=True)
+                 use_cache=True)
 data_p = m.prepare_data()
 m.fit(data_p)
 m.predict()
@@ -1,10 +1,10 @@
-import matplotlib as mpl
-
 from .utils._seed import set_seed
-from ._config import rc, d_colors
+from ._config import rc, d_colors, apply_rc
+from ._config import get_config, set_config, config_context
 
 # Para reproducibilidad seteamos una semilla
 set_seed(seed=0)
 
-# Actualizamos parámetros de runtime context de Matplotlib
-mpl.rcParams.update(rc)
+# Los parámetros de runtime context de Matplotlib (rc) se aplican
+# recién al primer uso de matplotlib dentro del paquete, ver
+# utils/_lazy.py
@@ -1,15 +1,13 @@
 """
 _config.py
 
-Seteamos parámetros de ploteo, etc.
+Seteamos parámetros de ploteo, ejecución, etc.
 """
 
-import numpy as np
-import pandas as pd
+import os
+from contextlib import contextmanager
 
-pd.set_option('display.max_columns', None)
-pd.set_option('display.max_rows', None)
-pd.set_option('display.width', 1000)
+import numpy as np
 
 rc = {
     'figure.facecolor': 'black',
@@ -42,6 +40,21 @@ rc = {
     'grid.linewidth': 0.4,
 }
 
+_rc_applied = False
+
+
+def apply_rc(*args):
+    """Actualiza el runtime context de Matplotlib con rc. Se ejecuta
+    una sola vez, al primer uso de matplotlib dentro del paquete.
+    """
+    global _rc_applied
+    if not _rc_applied:
+        import matplotlib as mpl
+
+        mpl.rcParams.update(rc)
+        _rc_applied = True
+
+
 d_colors = {
     "1": "darksalmon",
     "2": "royalblue",
@@ -67,8 +80,130 @@ bw_stkde = np.array([
     24.38113667
 ])
 
+
+def check_n_jobs(n_jobs):
+    """Normaliza n_jobs como joblib: los valores negativos cuentan desde
+    el total de núcleos (-1 usa todos, -2 todos menos uno, ...).
+
+    Parameters
+    ----------
+    n_jobs : {int, str}
+
+    Returns
+    -------
+    int
+      Cantidad de workers, >= 1
+    """
+    n_jobs = int(n_jobs)
+    if n_jobs == 0:
+        raise ValueError("n_jobs must be != 0")
+    if n_jobs < 0:
+        n_cpu = os.cpu_count() or 1
+        if n_cpu + 1 + n_jobs < 1:
+            raise ValueError(f"n_jobs={n_jobs} leaves no workers with "
+                             f"{n_cpu} cpus")
+        n_jobs = n_cpu + 1 + n_jobs
+    return n_jobs
+
+
+def check_backend(backend):
+    """
+    Parameters
+    ----------
+    backend : str
+      Backend de joblib
+
+    Returns
+    -------
+    str
+    """
+    if backend not in {'loky', 'multiprocessing', 'threading'}:
+        raise ValueError(f"Unknown backend '{backend}'")
+    return backend
+
+
+# Parámetros de ejecución (workers, backend, chunks, memoria)
+_exec_config = {
+    'n_jobs': check_n_jobs(os.environ.get('PREDICTIVEHP_N_JOBS', -1)),
+    'backend': check_backend(os.environ.get('PREDICTIVEHP_BACKEND',
+                                            'loky')),
+    'chunk_size': int(os.environ.get('PREDICTIVEHP_CHUNK_SIZE', 10_000)),
+    'memory_limit': int(os.environ.get('PREDICTIVEHP_MEMORY_LIMIT',
+                                       2 * 1024 ** 3)),
+    'cache_dir': os.environ.get(
+        'PREDICTIVEHP_CACHE_DIR',
+        os.path.join(os.path.dirname(__file__), 'data', 'cache')
+    ),
+}
+
+
+def get_config():
+    """Retorna una copia de la configuración de ejecución vigente.
+
+    Returns
+    -------
+    dict
+      n_jobs : int
+        Número de workers usados por los estimadores y los paths
+        paralelos del paquete
+      backend : str
+        Backend de joblib ('loky', 'multiprocessing', 'threading')
+      chunk_size : int
+        Nº de elementos procesados por bloque en las evaluaciones por
+        chunks
+      memory_limit : int
+        Presupuesto de memoria en bytes para los arreglos intermedios
+      cache_dir : str
+        Directorio del cache de artefactos
+    """
+    return dict(_exec_config)
+
+
+def set_config(n_jobs=None, backend=None, chunk_size=None,
+               memory_limit=None, cache_dir=None):
+    """Actualiza la configuración de ejecución de todo el paquete.
+
+    Parameters
+    ----------
+    n_jobs : int
+      Número de workers. Los negativos cuentan desde el total de núcleos
+      (-1 usa todos), ver check_n_jobs
+    backend : str
+      Backend de joblib
+    chunk_size : int
+    memory_limit : int
+      En bytes
+    cache_dir : str
+    """
+    if n_jobs is not None:
+        _exec_config['n_jobs'] = check_n_jobs(n_jobs)
+    if backend is not None:
+        _exec_config['backend'] = check_backend(backend)
+    if chunk_size is not None:
+        _exec_config['chunk_size'] = int(chunk_size)
+    if memory_limit is not None:
+        _exec_config['memory_limit'] = int(memory_limit)
+    if cache_dir is not None:
+        _exec_config['cache_dir'] = cache_dir
+
+
+@contextmanager
+def config_context(**kwargs):
+    """Setea temporalmente la configuración de ejecución.
+
+    >>> with config_context(n_jobs=2):
+    ...     m.fit()
+    """
+    old = get_config()
+    set_config(**kwargs)
+    try:
+        yield
+    finally:
+        _exec_config.update(old)
+
+
 if __name__ == '__main__':
     import matplotlib as mpl
 
-    mpl.rcParams.update(rc)
+    apply_rc()
     print(mpl.rc_params())
@@ -3,13 +3,25 @@ from ._models import RForestRegressor
 from ._models import ProMap
 
 from ._models import Model
+from ._features import FeatureStore
+from ._features import FeatureView
+from ._hotspots import HotspotIndex
+from ._hotspots import hotspot_index
+from ._hotspots import export_hotspots
 
 from ._models import create_model
+from ._batch import fit_batch
 
 __all__ = [
     'STKDE',
     'RForestRegressor',
     'ProMap',
     'Model',
+    'FeatureStore',
+    'FeatureView',
+    'HotspotIndex',
+    'hotspot_index',
+    'export_hotspots',
     'create_model',
+    'fit_batch',
 ]
@@ -0,0 +1,207 @@
+"""
+_batch.py
+
+Ajuste de los modelos para varios pares (región, tipo de incidente) en
+paralelo. Los incidentes se descargan una sola vez para todos los tipos
+y cada región se carga y proyecta una sola vez; las máscaras de las
+mallas quedan en el ArtifactCache y se reutilizan entre tipos de
+incidente y entre ejecuciones.
+"""
+
+import os
+import re
+import time
+from datetime import date
+
+import pandas as pd
+
+import predictivehp.utils._aux_functions as af
+from predictivehp._config import check_n_jobs, get_config
+from predictivehp.utils._lazy import lazy_import
+from ._models import create_model
+
+gpd = lazy_import('geopandas')
+
+MODELS = ('STKDE', 'ProMap', 'RForestRegressor')
+
+
+def load_region(region, crs=2276):
+    """Shapefiles de una región en EPSG:3857, en el formato de
+    af.shps_processing.
+
+    Parameters
+    ----------
+    region : {str, gpd.GeoDataFrame, dict}
+      Path a un shapefile, GeoDataFrame con los polígonos de la región o
+      un dict de shps ya procesado (se retorna sin cambios)
+    crs
+      crs a asumir cuando el shapefile no lo trae
+
+    Returns
+    -------
+    dict
+      'streets' y 'councils' corresponden a los polígonos de la región
+    """
+    if isinstance(region, dict):
+        return region
+    shp = gpd.read_file(region) if isinstance(region, str) else region
+    if shp.crs is None:
+        shp = shp.set_crs(crs)
+    shp = shp.to_crs(epsg=3857)
+    return {'streets': shp, 'councils': shp, 'c_limits': None}
+
+
+def slug(name):
+    return re.sub(r'[^0-9A-Za-z]+', '_', str(name)).strip('_')
+
+
+def fit_pair(task):
+    """Ajusta y valida los modelos para un par (región, tipo de
+    incidente). Se ejecuta en los procesos worker.
+
+    Parameters
+    ----------
+    task : dict
+      Ver fit_batch
+
+    Returns
+    -------
+    list
+      Una fila de métricas por modelo
+    """
+    base = {'region': task['region'], 'offense': task['offense'],
+            'n_incidents': len(task['data'])}
+    st = time.perf_counter()
+    try:
+        m = create_model(task['data'], task['shps'],
+                         start_prediction=task['start_prediction'],
+                         length_prediction=task['length_prediction'],
+                         use_stkde='STKDE' in task['models'],
+                         use_promap='ProMap' in task['models'],
+                         use_rfr='RForestRegressor' in task['models'],
+                         crs=task['crs'])
+        m.set_parameters()
+        for name, kwargs in task['parameters'].items():
+            m.set_parameters(name, **kwargs)
+        m.fit()
+        m.predict()
+        m.validate(ap=task['ap'])
+        if task['store_dir'] is not None:
+            m.store(os.path.join(
+                task['store_dir'],
+                f"{slug(task['region'])}-{slug(task['offense'])}"))
+    except Exception as e:
+        return [dict(base, model=name, error=repr(e),
+                     time=time.perf_counter() - st)
+                for name in task['models']]
+
+    elapsed = time.perf_counter() - st
+    return [dict(base, model=mm.name, hr=mm.hr_validated,
+                 pai=mm.pai_validated, d_incidents=mm.d_incidents,
+                 h_area=mm.h_area, time=elapsed, error=None)
+            for mm in m.models]
+
+
+def fit_batch(pairs, data=None, year=2017, n=150000, crs=2276,
+              models=MODELS, start_prediction=date(2017, 11, 1),
+              length_prediction=7, ap=0.05, parameters=None,
+              store_dir=None, n_jobs=None, verbose=False):
+    """Ajusta los modelos para cada par (región, tipo de incidente) en un
+    pool de procesos y retorna una tabla con las métricas de cada par.
+
+    Parameters
+    ----------
+    pairs : list
+      Tuplas (región, offense) o (nombre, región, offense). La región es
+      un path a un shapefile, un GeoDataFrame o un dict de shps. offense
+      es un valor de la columna offincident, None para todos los tipos
+    data : pd.DataFrame
+      Incidentes en el formato de af.get_data, con la columna
+      'offincident'. None para descargarlos una sola vez desde Socrata
+      para todos los tipos pedidos
+    year : int
+    n : int
+    crs
+      crs de las coordenadas x, y de data y de los shapefiles sin crs
+    models : tuple
+      Modelos a ajustar
+    start_prediction : date
+    length_prediction : int
+    ap : float
+      Area percentage con que se validan los modelos
+    parameters : dict
+      {nombre del modelo: kwargs de set_parameters}, se aplican sobre
+      los parámetros por defecto de Model.set_parameters
+    store_dir : str
+      Directorio donde se guarda cada Model (ver Model.store). None para
+      no guardarlos
+    n_jobs : int
+      Pares ajustados en paralelo. None usa get_config()['n_jobs']. Los
+      modelos de cada par usan n_jobs // (nº de workers) núcleos
+    verbose : bool
+
+    Returns
+    -------
+    pd.DataFrame
+      Una fila por (región, offense, modelo) con hr, pai, d_incidents,
+      h_area, el tiempo de ajuste y el error, si lo hubo
+    """
+    pairs = [tuple(p) if len(p) == 3 else (None,) + tuple(p) for p in pairs]
+    offenses = {o for _, _, o in pairs}
+
+    if data is None:
+        print("\tRequesting data...") if verbose else None
+        data = af.get_data(year=year, n=n,
+                           offense=None if None in offenses
+                           else sorted(offenses))
+    if offenses != {None} and 'offincident' not in data.columns:
+        raise ValueError("data must have an 'offincident' column to "
+                         "filter by offense")
+
+    # Coordenadas proyectadas de todos los incidentes, una sola vez
+    pts = gpd.GeoSeries(gpd.points_from_xy(data['x'], data['y']),
+                        crs=crs).to_crs(epsg=3857)
+    x, y = pts.x.to_numpy(), pts.y.to_numpy()
+
+    # Cada región se carga, proyecta y filtra una sola vez
+    regions, tasks = {}, []
+    for name, region, offense in pairs:
+        r_key = region if isinstance(region, str) else id(region)
+        if r_key not in regions:
+            shps = load_region(region, crs=crs)
+            if name is None:
+                name = os.path.splitext(os.path.basename(region))[0] \
+                    if isinstance(region, str) else f'region_{len(regions)}'
+            print(f"\tLoading region {name}...") if verbose else None
+            regions[r_key] = (name, shps,
+                              af.in_shp(x, y, shps['councils']))
+        r_name, shps, in_region = regions[r_key]
+        name = r_name if name is None else name
+
+        mask = in_region if offense is None else \
+            in_region & (data['offincident'] == offense).to_numpy()
+        tasks.append({
+            'region': name, 'offense': offense, 'shps': shps,
+            'data': data[mask].reset_index(drop=True),
+            'models': tuple(models), 'crs': crs,
+            'start_prediction': start_prediction,
+            'length_prediction': length_prediction, 'ap': ap,
+            'parameters': parameters or {}, 'store_dir': store_dir,
+        })
+
+    # Los modelos de cada par se reparten los núcleos del batch, para no
+    # lanzar n_jobs workers dentro de cada uno de los n_jobs procesos
+    n_jobs = check_n_jobs(get_config()['n_jobs'] if n_jobs is None
+                          else n_jobs)
+    n_workers = max(min(n_jobs, len(tasks)), 1)
+    print(f"\tFitting {len(tasks)} pairs...") if verbose else None
+    rows = af.parallel_map(fit_pair, tasks, n_jobs=n_jobs,
+                           config={'n_jobs': max(1, n_jobs // n_workers)})
+    metrics = pd.DataFrame([r for pair in rows for r in pair])
+    columns = ['region', 'offense', 'model', 'n_incidents', 'hr', 'pai',
+               'd_incidents', 'h_area', 'time', 'error']
+    return metrics.reindex(columns=columns)
+
+
+if __name__ == '__main__':
+    pass
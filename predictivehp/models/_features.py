@@ -0,0 +1,319 @@
+"""
+_features.py
+
+Almacenamiento compacto de las features por celda usadas por
+RForestRegressor.
+"""
+
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from predictivehp.utils._lazy import lazy_import
+
+sp = lazy_import('scipy.sparse')
+
+
+class FeatureStore:
+    def __init__(self, values, cells, columns, grid):
+        """Matriz de features indexada por celda.
+
+        Las filas corresponden a las celdas de la malla que se encuentran
+        dentro de la ciudad y las columnas a los pares (capa, semana). La
+        geometría de cada celda no se almacena, se reconstruye a partir
+        de su id y de los parámetros de la malla.
+
+        Parameters
+        ----------
+        values : {np.ndarray, sp.csr_matrix}
+          Matriz (n_cells, n_cols) de conteos enteros
+        cells : np.ndarray
+          Id de cada fila, n = i * ny + j
+        columns : pd.MultiIndex
+          Metadata de las columnas: (f'Incidents_{i}', week)
+        grid : dict
+          x_min, y_min, hx, hy, nx, ny de la malla
+        """
+        self.values = values
+        self.cells = np.asarray(cells, dtype=np.int64)
+        self.columns = columns
+        self.grid = grid
+        self._col_pos = {col: pos for pos, col in enumerate(columns)}
+
+    @classmethod
+    def from_counts(cls, counts, n_layers, grid, mask=None, sparse=False,
+                    path=None):
+        """Construye el store desde las matrices de conteo semanales.
+
+        Parameters
+        ----------
+        counts : dict
+          {week: D}, con D un np.ndarray (nx, ny) con la cantidad de
+          incidentes por celda en la semana
+        n_layers : int
+          Se generan las capas 0, ..., n_layers
+        grid : dict
+        mask : np.ndarray
+          Arreglo booleano (nx * ny, ) con las celdas a conservar. None
+          conserva todas las celdas
+        sparse : bool
+          True para almacenar los valores en un sp.csr_matrix
+        path : str
+          Directorio donde escribir los valores (values.npy) y los ids
+          (cells.npy). Los valores quedan en un np.memmap y cada columna
+          se escribe apenas se calcula, por lo que la matriz completa
+          nunca reside en memoria. Solo para matrices densas
+
+        Returns
+        -------
+        FeatureStore
+        """
+        from predictivehp.utils._aux_functions import il_neighbors
+
+        weeks = list(counts)
+        columns = pd.MultiIndex.from_product(
+            [[f"Incidents_{i}" for i in range(n_layers + 1)], weeks]
+        )
+        n_cells = grid['nx'] * grid['ny']
+        cells = np.flatnonzero(mask) if mask is not None \
+            else np.arange(n_cells)
+
+        if path is not None:
+            if sparse:
+                raise ValueError("Memory-mapped features must be dense")
+            # Cota del máximo: cada capa suma celdas distintas de la
+            # semana, por lo que no supera el total semanal
+            c_max = max((int(D.sum()) for D in counts.values()), default=0)
+            dtype = np.int16 if c_max <= np.iinfo(np.int16).max \
+                else np.int32
+            values = np.lib.format.open_memmap(
+                os.path.join(path, 'values.npy'), mode='w+', dtype=dtype,
+                shape=(cells.size, len(columns))
+            )
+            col_pos = {col: pos for pos, col in enumerate(columns)}
+            for week, D in counts.items():
+                for i in range(n_layers + 1):
+                    layer = D if i == 0 else il_neighbors(D, i)
+                    values[:, col_pos[(f"Incidents_{i}", week)]] = \
+                        layer.ravel()[cells]
+            values.flush()
+            np.save(os.path.join(path, 'cells.npy'), cells)
+            return cls(values, cells, columns, grid)
+
+        layers = {}
+        for week, D in counts.items():
+            for i in range(n_layers + 1):
+                layer = D if i == 0 else il_neighbors(D, i)
+                layers[(f"Incidents_{i}", week)] = layer.ravel()[cells]
+
+        c_max = max((int(l.max()) for l in layers.values() if l.size),
+                    default=0)
+        dtype = np.int16 if c_max <= np.iinfo(np.int16).max else np.int32
+
+        if sparse:
+            rows, cols, data = [], [], []
+            for pos, col in enumerate(columns):
+                nz = np.flatnonzero(layers[col])
+                rows.append(nz)
+                cols.append(np.full(nz.size, pos))
+                data.append(layers[col][nz])
+            values = sp.csr_matrix(
+                (np.concatenate(data).astype(dtype),
+                 (np.concatenate(rows), np.concatenate(cols))),
+                shape=(cells.size, len(columns))
+            )
+        else:
+            values = np.empty((cells.size, len(columns)), dtype=dtype)
+            for pos, col in enumerate(columns):
+                values[:, pos] = layers[col]
+        return cls(values, cells, columns, grid)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        """Memoria usada por los valores y los ids de celda [bytes]"""
+        if sp.issparse(self.values):
+            v = self.values.data.nbytes + self.values.indices.nbytes + \
+                self.values.indptr.nbytes
+        else:
+            v = self.values.nbytes
+        return v + self.cells.nbytes
+
+    def col_idx(self, keys):
+        """Posición de cada una de las columnas (capa, semana) dadas.
+
+        Parameters
+        ----------
+        keys : list
+          Lista de tuplas (f'Incidents_{i}', week)
+
+        Returns
+        -------
+        np.ndarray
+        """
+        return np.array([self._col_pos[k] for k in keys], dtype=np.int64)
+
+    def select(self, keys, lazy=False):
+        """Sub-matriz con las columnas dadas, lista para entregar a un
+        regressor de sklearn.
+
+        Parameters
+        ----------
+        keys : list
+          Lista de tuplas (f'Incidents_{i}', week)
+        lazy : bool
+          True para retornar un FeatureView, que lee las filas recién
+          cuando se piden (ver fit_batches)
+
+        Returns
+        -------
+        {np.ndarray, sp.csr_matrix, FeatureView}
+        """
+        if lazy:
+            return FeatureView(self.values, self.col_idx(keys))
+        return self.values[:, self.col_idx(keys)]
+
+    def xy(self):
+        """Coordenadas de la esquina inferior izquierda de cada celda.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray)
+        """
+        g = self.grid
+        i, j = np.divmod(self.cells, g['ny'])
+        return g['x_min'] + i * g['hx'], g['y_min'] + j * g['hy']
+
+    def geometry(self, crs=None):
+        """Genera la geometría de las celdas a partir de sus ids.
+
+        Parameters
+        ----------
+        crs
+
+        Returns
+        -------
+        gpd.GeoSeries
+        """
+        import geopandas as gpd
+
+        x, y = self.xy()
+        return gpd.GeoSeries(gpd.points_from_xy(x, y), crs=crs,
+                             index=pd.Index(self.cells, name='Cell'))
+
+    def to_arrays(self):
+        """Representación serializable del store.
+
+        Returns
+        -------
+        (dict, dict)
+          Arreglos y metadata (columnas y malla)
+        """
+        if sp.issparse(self.values):
+            arrays = {'data': self.values.data,
+                      'indices': self.values.indices,
+                      'indptr': self.values.indptr}
+        else:
+            arrays = {'values': self.values}
+        arrays['cells'] = self.cells
+        meta = {
+            'shape': list(self.values.shape),
+            'sparse': sp.issparse(self.values),
+            'columns': [[l, str(w)] for l, w in self.columns],
+            'grid': {k: float(v) if k in {'x_min', 'y_min', 'hx', 'hy'}
+                     else int(v) for k, v in self.grid.items()},
+        }
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        """Inversa de FeatureStore.to_arrays
+
+        Parameters
+        ----------
+        arrays : dict
+        meta : dict
+
+        Returns
+        -------
+        FeatureStore
+        """
+        if meta['sparse']:
+            values = sp.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']),
+                shape=tuple(meta['shape'])
+            )
+        else:
+            values = arrays['values']
+        columns = pd.MultiIndex.from_tuples(
+            [(l, date.fromisoformat(w)) for l, w in meta['columns']]
+        )
+        return cls(values, arrays['cells'], columns, meta['grid'])
+
+    def to_frame(self):
+        """Representación como pd.DataFrame, útil para inspección.
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        values = self.values.toarray() if sp.issparse(self.values) \
+            else self.values
+        return pd.DataFrame(values, columns=self.columns,
+                            index=pd.Index(self.cells, name='Cell'))
+
+
+class FeatureView:
+    def __init__(self, values, idx):
+        """Columnas idx de una matriz densa (típicamente un np.memmap),
+        sin copiarlas. Indexar por filas retorna un np.ndarray con solo
+        esas filas y columnas, de modo que nunca reside en memoria más
+        que el bloque pedido.
+
+        Parameters
+        ----------
+        values : np.ndarray
+        idx : np.ndarray
+          Posición de las columnas seleccionadas
+        """
+        self.values = values
+        self.idx = np.asarray(idx, dtype=np.int64)
+
+    @property
+    def shape(self):
+        return self.values.shape[0], self.idx.size
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, rows):
+        """
+        Parameters
+        ----------
+        rows : {slice, np.ndarray}
+          Slice o índices de las filas. Conviene que los índices vengan
+          ordenados, para leer el memmap secuencialmente
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if isinstance(rows, slice):
+            return self.values[rows][:, self.idx]
+        return self.values[np.ix_(np.asarray(rows), self.idx)]
+
+    def toarray(self):
+        return self[:]
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,256 @@
+"""
+_hotspots.py
+
+Hotspots de cualquier modelo como celdas o como polígonos.
+
+Las celdas de la ciudad se ordenan por score una sola vez por predicción
+(HotspotIndex): el hotspot de un area percentage ap son las
+ceil(ap * celdas de la ciudad) primeras y el de un umbral c las que
+tienen score >= c, que se encuentran con una búsqueda binaria. Cada
+consulta lee solo sus k celdas, por lo que barrer varios ap no vuelve a
+umbralizar la malla.
+
+    >>> index = hotspot_index(m)
+    >>> index.cells(ap=0.01)           # pd.DataFrame, una fila por celda
+    >>> index.polygons(ap=0.01)        # gpd.GeoDataFrame, un hotspot por fila
+    >>> export_hotspots(m, 'hotspots.geojson', ap=0.01)
+"""
+
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from predictivehp.utils._lazy import lazy_import
+
+gpd = lazy_import('geopandas')
+shapely = lazy_import('shapely')
+sp = lazy_import('scipy.sparse')
+csgraph = lazy_import('scipy.sparse.csgraph')
+
+# {modelo: (matriz de scores, HotspotIndex)}
+_INDEXES = weakref.WeakKeyDictionary()
+
+
+def _same_array(a, b):
+    """True si a y b ven la misma memoria con la misma forma. Como el
+    cache mantiene viva la matriz anterior, una predicción nueva no
+    puede reutilizar su dirección."""
+    return a.shape == b.shape and \
+        a.__array_interface__['data'][0] == b.__array_interface__['data'][0]
+
+
+class HotspotIndex:
+    def __init__(self, z, grid, n_area=None, crs=None):
+        """Celdas de una malla de scores ordenadas de mayor a menor score.
+
+        Parameters
+        ----------
+        z : np.ndarray
+          Matriz (nx, ny) de scores, nan fuera de la ciudad
+        grid : dict
+          x_0, y_0, hx, hy, nx, ny de las celdas, ver af.cell_index
+        n_area : int
+          Celdas de la ciudad, el total sobre el que se mide ap. None
+          usa las celdas con score
+        crs
+          crs de las coordenadas de la malla
+        """
+        flat = np.asarray(z, dtype=float).ravel()
+        ids = np.flatnonzero(np.isfinite(flat))
+        self.order = ids[np.argsort(-flat[ids], kind='stable')]
+        self.scores = flat[self.order]
+        self.grid, self.crs = grid, crs
+        self.n_area = ids.size if n_area is None else int(n_area)
+
+    @classmethod
+    def from_model(cls, m):
+        """
+        Parameters
+        ----------
+        m : {STKDE, ProMap, RForestRegressor, StoredModel}
+
+        Returns
+        -------
+        HotspotIndex
+        """
+        z, _ = m.score_grid()
+        crs = m.shps['streets'].crs if m.shps is not None else None
+        # ProMap mide el área sobre las celdas de la ciudad, pero su
+        # matriz no tiene nan fuera de ella
+        return cls(z, m.cell_grid(), n_area=getattr(m, 'cells_in_map', None),
+                   crs=crs)
+
+    def size(self, ap=None, c=None):
+        """Cantidad k de celdas del hotspot.
+
+        Parameters
+        ----------
+        ap : float
+          Area percentage, en [0, 1]
+        c : float
+          Umbral de score, se usa si ap es None
+
+        Returns
+        -------
+        int
+        """
+        if ap is not None:
+            if not 0 <= ap <= 1:
+                raise ValueError("ap must be in [0, 1]")
+            return int(min(np.ceil(ap * self.n_area), self.order.size))
+        if c is None:
+            raise ValueError("Either ap or c must be given")
+        return int(np.searchsorted(-self.scores, -c, side='right'))
+
+    def threshold(self, ap=None, c=None):
+        """Score de la última celda del hotspot, None si está vacío."""
+        k = self.size(ap, c)
+        return float(self.scores[k - 1]) if k > 0 else None
+
+    def cells(self, ap=None, c=None):
+        """Celdas del hotspot, de mayor a menor score.
+
+        Parameters
+        ----------
+        ap : float
+        c : float
+          Ver size
+
+        Returns
+        -------
+        pd.DataFrame
+          cell (índice en la matriz de scores aplanada), i, j, x, y
+          (centro de la celda) y score
+        """
+        k = self.size(ap, c)
+        cell = self.order[:k]
+        g = self.grid
+        i, j = np.divmod(cell, g['ny'])
+        return pd.DataFrame({'cell': cell, 'i': i, 'j': j,
+                             'x': g['x_0'] + (i + 0.5) * g['hx'],
+                             'y': g['y_0'] + (j + 0.5) * g['hy'],
+                             'score': self.scores[:k]})
+
+    def polygons(self, ap=None, c=None):
+        """Celdas del hotspot unidas en polígonos, uno por cada grupo de
+        celdas vecinas (que comparten un lado).
+
+        Parameters
+        ----------
+        ap : float
+        c : float
+          Ver size
+
+        Returns
+        -------
+        gpd.GeoDataFrame
+          rank (1 para el polígono con mayor score total), n_cells,
+          score (suma del score de sus celdas), max_score, area y
+          geometry, ordenado por rank
+        """
+        cells = self.cells(ap, c)
+        g = self.grid
+        cells['hotspot'] = components(cells['cell'].to_numpy(), g['nx'],
+                                      g['ny'])
+        i, j = cells['i'].to_numpy(), cells['j'].to_numpy()
+        # Los bordes se calculan igual para celdas vecinas, para que la
+        # unión no deje rendijas por redondeo
+        geometry = shapely.box(g['x_0'] + i * g['hx'], g['y_0'] + j * g['hy'],
+                               g['x_0'] + (i + 1) * g['hx'],
+                               g['y_0'] + (j + 1) * g['hy'])
+
+        hotspots = gpd.GeoDataFrame(cells[['hotspot']], geometry=geometry,
+                                    crs=self.crs).dissolve(by='hotspot')
+        hotspots = hotspots.join(cells.groupby('hotspot')['score'].agg(
+            n_cells='count', score='sum', max_score='max'))
+        hotspots['area'] = hotspots['n_cells'] * g['hx'] * g['hy']
+        hotspots = hotspots.sort_values('score', ascending=False,
+                                        kind='stable').reset_index(drop=True)
+        hotspots.insert(0, 'rank', np.arange(1, len(hotspots) + 1))
+        return hotspots[['rank', 'n_cells', 'score', 'max_score', 'area',
+                         'geometry']]
+
+
+def components(cells, nx, ny):
+    """Componentes conexas (vecindad de 4) de un conjunto de celdas.
+
+    Parameters
+    ----------
+    cells : np.ndarray
+      Índices i * ny + j de las celdas, distintos
+    nx : int
+    ny : int
+
+    Returns
+    -------
+    np.ndarray
+      Etiqueta de la componente de cada celda
+    """
+    n = cells.size
+    if n == 0:
+        return np.empty(0, dtype=np.int32)
+    order = np.argsort(cells)
+    s_cells = cells[order]
+    rows, cols = [], []
+    # Vecinos en (i + 1, j) y en (i, j + 1) dentro de la malla
+    for step, valid in ((ny, cells // ny < nx - 1),
+                        (1, cells % ny < ny - 1)):
+        pos = np.minimum(np.searchsorted(s_cells, cells + step), n - 1)
+        found = valid & (s_cells[pos] == cells + step)
+        rows.append(np.flatnonzero(found))
+        cols.append(order[pos[found]])
+    graph = sp.coo_matrix((np.ones(sum(r.size for r in rows)),
+                           (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(n, n))
+    return csgraph.connected_components(graph, directed=False)[1]
+
+
+def hotspot_index(m):
+    """HotspotIndex de la predicción actual del modelo m. Se calcula una
+    sola vez y se recalcula cuando el modelo reemplaza su matriz de
+    scores (al volver a predecir).
+
+    Parameters
+    ----------
+    m : {STKDE, ProMap, RForestRegressor, StoredModel}
+
+    Returns
+    -------
+    HotspotIndex
+    """
+    z, _ = m.score_grid()
+    cached = _INDEXES.get(m)
+    if cached is None or not _same_array(cached[0], np.asarray(z)):
+        cached = (np.asarray(z), HotspotIndex.from_model(m))
+        _INDEXES[m] = cached
+    return cached[1]
+
+
+def export_hotspots(m, file_name, ap=None, c=None):
+    """Guarda los polígonos del hotspot del modelo m (ver
+    HotspotIndex.polygons). El formato se elige por la extensión:
+    GeoParquet para .parquet, GeoJSON para el resto.
+
+    Parameters
+    ----------
+    m : {STKDE, ProMap, RForestRegressor, StoredModel}
+    file_name : str
+    ap : float
+    c : float
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+      Los polígonos guardados
+    """
+    hotspots = hotspot_index(m).polygons(ap, c)
+    if file_name.endswith('.parquet'):
+        hotspots.to_parquet(file_name)
+    else:
+        hotspots.to_file(file_name, driver='GeoJSON')
+    return hotspots
+
+
+if __name__ == '__main__':
+    pass
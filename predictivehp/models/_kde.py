@@ -0,0 +1,248 @@
+"""
+_kde.py
+
+Estimador KDE multivariado de statsmodels con remuestreo restringido a
+la ciudad y evaluación por bloques. Se importa recién al ajustar STKDE,
+ya que statsmodels es una dependencia pesada.
+"""
+
+import numpy as np
+from statsmodels.nonparametric.kernel_density import KDEMultivariate
+
+import predictivehp.utils._aux_functions as af
+from predictivehp._config import get_config
+
+# Arreglos (n_bloque, n_train) que mantiene vivos cada worker
+N_BUFFERS = 2
+
+
+def gaussian_product(data, bw, points, dims):
+    """Producto de los kernels gaussianos de las dimensiones dims entre
+    cada punto y cada dato de entrenamiento, con las mismas operaciones
+    que statsmodels (gpke). Usa N_BUFFERS arreglos (n_puntos, n_train).
+
+    Parameters
+    ----------
+    data : np.ndarray
+      Datos de entrenamiento (n_train, k_vars)
+    bw : np.ndarray
+    points : np.ndarray
+      Puntos (n_puntos, k_vars)
+    dims : iterable
+      Dimensiones a considerar
+
+    Returns
+    -------
+    np.ndarray
+      Arreglo (n_puntos, n_train)
+    """
+    k = np.empty((points.shape[0], data.shape[0]))
+    buf = np.empty_like(k)
+    for n, d in enumerate(dims):
+        np.subtract(data[:, d], points[:, d, None], out=buf)
+        np.square(buf, out=buf)
+        np.negative(buf, out=buf)
+        np.divide(buf, bw[d] ** 2 * 2., out=buf)
+        np.exp(buf, out=buf)
+        np.multiply(1. / np.sqrt(2 * np.pi), buf, out=buf)
+        if n == 0:
+            k, buf = buf, k
+        else:
+            np.multiply(k, buf, out=k)
+    return k
+
+
+def kde_block(task):
+    """Densidad del kde en un bloque de puntos, escrita en
+    task['out'][task['rows']].
+
+    Parameters
+    ----------
+    task : dict
+      data, bw, points, out y rows, ver MyKDEMultivariate.pdf_chunked
+    """
+    data, bw, rows = task['data'], task['bw'], task['rows']
+    k = gaussian_product(data, bw, task['points'][rows],
+                         range(data.shape[1]))
+    np.divide(k, np.prod(bw), out=k)
+    task['out'][rows] = k.sum(axis=1) / data.shape[0]
+
+
+def cube_block(task):
+    """Densidad del kde en un bloque de puntos del espacio para todos
+    los tiempos, escrita en task['out'][task['rows']]. El producto de
+    los kernels espaciales se calcula una vez y se combina con el
+    kernel temporal de cada tiempo con un producto matricial.
+
+    Parameters
+    ----------
+    task : dict
+      data, bw, points, k_t, out y rows, ver
+      MyKDEMultivariate.pdf_cube
+    """
+    data, bw, rows = task['data'], task['bw'], task['rows']
+    k = gaussian_product(data, bw, task['points'][rows],
+                         range(data.shape[1] - 1))
+    np.divide(k, np.prod(bw), out=k)
+    task['out'][rows] = k @ task['k_t'] / data.shape[0]
+
+
+class MyKDEMultivariate(KDEMultivariate):
+    def pdf_chunked(self, data_predict, out=None, chunk_size=None,
+                    memory_limit=None, n_jobs=None):
+        """Equivalente a pdf, evaluando los puntos por bloques en un
+        pool de threads. Cada bloque usa N_BUFFERS arreglos de
+        (n_bloque, n_train), por lo que la memoria intermedia queda
+        acotada por memory_limit sin importar la cantidad de puntos.
+
+        Parameters
+        ----------
+        data_predict : np.ndarray
+          Arreglo (k_vars, n) con los puntos a evaluar, como en pdf
+        out : {None, str, np.ndarray}
+          Arreglo de n elementos donde escribir el resultado. Con un
+          str se crea un .npy mapeado en memoria en ese path
+        chunk_size : int
+          Máximo de puntos por bloque. None usa
+          get_config()['chunk_size']
+        memory_limit : int
+          Bytes para los arreglos intermedios de todos los workers.
+          None usa get_config()['memory_limit']
+        n_jobs : int
+          None usa get_config()['n_jobs']
+
+        Returns
+        -------
+        np.ndarray
+        """
+        config = get_config()
+        chunk_size = config['chunk_size'] if chunk_size is None \
+            else chunk_size
+        memory_limit = config['memory_limit'] if memory_limit is None \
+            else memory_limit
+        n_jobs = config['n_jobs'] if n_jobs is None else n_jobs
+
+        points = np.asarray(data_predict, dtype=float)
+        if points.ndim == 1:
+            points = points.reshape(self.k_vars, -1)
+        points = np.ascontiguousarray(points.T)
+        n = points.shape[0]
+
+        if out is None:
+            out = np.empty(n)
+        elif isinstance(out, str):
+            out = np.lib.format.open_memmap(out, mode='w+', dtype=float,
+                                            shape=(n,))
+
+        per_point = N_BUFFERS * self.data.shape[0] * 8
+        size = memory_limit // (max(n_jobs, 1) * per_point)
+        size = int(max(min(size, chunk_size), 1))
+        tasks = [{'data': self.data, 'bw': np.asarray(self.bw), 'points':
+                  points, 'out': out, 'rows': slice(i, min(i + size, n))}
+                 for i in range(0, n, size)]
+        # numpy libera el GIL en las operaciones sobre los bloques, y con
+        # threads todos los workers escriben directamente en out
+        af.parallel_map(kde_block, tasks, n_jobs=n_jobs, backend='threading')
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+    def pdf_cube(self, data_predict, times, out=None, chunk_size=None,
+                 memory_limit=None, n_jobs=None):
+        """Densidad en los puntos espaciales data_predict para cada uno de
+        los tiempos times. La última variable del kde es el tiempo, por
+        lo que la densidad es una suma de productos kernel espacial x
+        kernel temporal: los kernels espaciales de cada bloque se
+        calculan una sola vez para todos los tiempos.
+
+        Parameters
+        ----------
+        data_predict : np.ndarray
+          Arreglo (k_vars - 1, n) con los puntos a evaluar
+        times : np.ndarray
+          Tiempos (n_t,)
+        out : {None, str, np.ndarray}
+          Arreglo (n, n_t) donde escribir el resultado, ver pdf_chunked
+        chunk_size : int
+        memory_limit : int
+        n_jobs : int
+
+        Returns
+        -------
+        np.ndarray
+          Arreglo (n, n_t)
+        """
+        config = get_config()
+        chunk_size = config['chunk_size'] if chunk_size is None \
+            else chunk_size
+        memory_limit = config['memory_limit'] if memory_limit is None \
+            else memory_limit
+        n_jobs = config['n_jobs'] if n_jobs is None else n_jobs
+
+        points = np.ascontiguousarray(
+            np.asarray(data_predict, dtype=float).reshape(self.k_vars - 1,
+                                                          -1).T)
+        times = np.asarray(times, dtype=float).ravel()
+        n = points.shape[0]
+
+        if out is None:
+            out = np.empty((n, times.size))
+        elif isinstance(out, str):
+            out = np.lib.format.open_memmap(out, mode='w+', dtype=float,
+                                            shape=(n, times.size))
+
+        bw = np.asarray(self.bw)
+        # Kernel temporal (n_train, n_t), compartido por todos los bloques
+        k_t = (1. / np.sqrt(2 * np.pi)) * np.exp(
+            -((self.data[:, -1, None] - times) ** 2) / (bw[-1] ** 2 * 2.))
+
+        per_point = (N_BUFFERS * self.data.shape[0] + times.size) * 8
+        size = max(memory_limit - k_t.nbytes, 0) // \
+            (max(n_jobs, 1) * per_point)
+        size = int(max(min(size, chunk_size), 1))
+        tasks = [{'data': self.data, 'bw': bw, 'points': points, 'k_t': k_t,
+                  'out': out, 'rows': slice(i, min(i + size, n))}
+                 for i in range(0, n, size)]
+        af.parallel_map(cube_block, tasks, n_jobs=n_jobs, backend='threading')
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+    def resample(self, size, shp):
+        """
+
+        Parameters
+        ----------
+        size : int
+
+        Returns
+        -------
+        np.hstack
+
+        """
+        # print("\nResampling...", end=" ")
+
+        n, d = self.data.shape
+        indices = np.random.randint(0, n, size)
+
+        cov = np.diag(self.bw) ** 2
+        means = self.data[indices, :]
+        norm = np.random.multivariate_normal(np.zeros(d), cov, size)
+
+        # simulated and checked points
+        s_points = np.transpose(means + norm)
+        c_points = af.checked_points(s_points, shp)
+
+        # print(f"\n{size - c_points.shape[1]} invalid points found")
+
+        if size == c_points.shape[1]:
+            # print("\nfinished!")
+            return s_points
+
+        a_points = self.resample(size - c_points.shape[1], shp)
+
+        return np.hstack((c_points, a_points))
+
+
+if __name__ == '__main__':
+    pass
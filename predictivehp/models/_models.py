@@ -1,72 +1,44 @@
+import json
+import os
 from calendar import month_name
 from datetime import date, timedelta, datetime
-from functools import reduce
 
-import geopandas as gpd
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import seaborn as sns
-import statsmodels.nonparametric.kernel_density as kd
-from matplotlib.lines import Line2D
-from shapely.geometry import Point
-from sklearn.ensemble import RandomForestRegressor
 
 import predictivehp.utils._aux_functions as af
-from predictivehp import d_colors
-
-settings = kd.EstimatorSettings(efficient=True, n_jobs=8)
-pd.set_option('mode.chained_assignment', None)
-
-
-class MyKDEMultivariate(kd.KDEMultivariate):
-    def resample(self, size, shp):
-        """
-
-        Parameters
-        ----------
-        size : int
-
-        Returns
-        -------
-        np.hstack
-
-        """
-        # print("\nResampling...", end=" ")
-
-        n, d = self.data.shape
-        indices = np.random.randint(0, n, size)
-
-        cov = np.diag(self.bw) ** 2
-        means = self.data[indices, :]
-        norm = np.random.multivariate_normal(np.zeros(d), cov, size)
-
-        # simulated and checked points
-        s_points = np.transpose(means + norm)
-        c_points = af.checked_points(s_points, shp)
-
-        # print(f"\n{size - c_points.shape[1]} invalid points found")
-
-        if size == c_points.shape[1]:
-            # print("\nfinished!")
-            return s_points
-
-        a_points = self.resample(size - c_points.shape[1], shp)
-
-        return np.hstack((c_points, a_points))
-
-
-class STKDE:
+from predictivehp.utils._index import IncidentIndex
+from predictivehp.utils._lazy import lazy_import, mpl, plt
+from predictivehp.utils._profiling import profiled
+from predictivehp import d_colors, get_config
+from ._features import FeatureStore
+from ._hotspots import hotspot_index
+from ._shard import promap_predict, rfr_predict, stkde_pdf
+from ._regressors import accepts_sparse, accepts_weights, \
+    make_regressor
+from ._sampling import empty_rows, negative_sample
+from ._store import STORE_VERSION, LazyAttributes, StoredModel, \
+    store_model
+from ._streaming import fit_batches, predict_batches
+
+gpd = lazy_import('geopandas')
+sp = lazy_import('scipy.sparse')
+sns = lazy_import('seaborn')
+kd = lazy_import('statsmodels.nonparametric.kernel_density')
+
+
+class STKDE(LazyAttributes):
     def __init__(self, data=None,
                  shps=None, bw=None, sample_number=3600,
                  start_prediction=date(2017, 11, 1),
-                 length_prediction=7, name="STKDE"):
+                 length_prediction=7, n_nodes=100, name="STKDE"):
         """
         Parameters
         ----------
         bw: np.array
           bandwidth for x, y, t
+        n_nodes : int
+          Nodos por lado de la malla donde se evalúa la densidad
         sample_number: int
           Número de muestras de la base de datos
         start_prediction : date
@@ -84,11 +56,15 @@ class STKDE:
         self.shps = shps
         self.start_prediction = start_prediction
         self.lp = length_prediction
+        self.n_nodes = n_nodes
 
         self.hr, self.ap, self.pai = None, None, None
         self.f_delitos, self.f_nodos = None, None
         self.df = None
         self.f_max = None
+        self.days = None  # y_day de la ventana de predicción
+        self.f_cube = None  # (días, n_nodes, n_nodes)
+        self.z_grid = None  # Mapa integrado en la ventana
         self.data = data
         if self.shps is not None:
             self.x_min, self.y_min, self.x_max, self.y_max = self.shps[
@@ -108,19 +84,25 @@ class STKDE:
 
         # print('-' * 30)
 
-    def set_parameters(self, bw):
+    def set_parameters(self, bw, n_nodes=None):
         """
 
         Parameters
         ----------
         bw: np.array
             Bandwith for x,y,t
+        n_nodes: int
+            Nodos por lado de la malla de evaluación
 
         Returns
         -------
 
         """
         self.bw = bw
+        if n_nodes is not None:
+            self.n_nodes = n_nodes
+            self.f_delitos, self.f_nodos, self.f_max = None, None, None
+            self.f_cube, self.z_grid = None, None
         # Reentrenamos el modelo con nuevo bw
         if self.df is not None:
             self.fit(self.X_train, self.X_test)
@@ -142,6 +124,7 @@ class STKDE:
                 "No bandwith set. The model will automatically calculate bandwith after fit.\n")
         print()
 
+    @profiled()
     def fit(self, X, X_t, verbose=False):
         """
         Parameters
@@ -153,25 +136,43 @@ class STKDE:
         """
         print("\tFitting Model...") if verbose else None
         self.X_train, self.X_test = X, X_t
+        self.f_delitos, self.f_nodos, self.f_max = None, None, None
+        self.f_cube, self.z_grid = None, None
+
+        from ._kde import MyKDEMultivariate
 
+        # efficient=False: con bw=None statsmodels estimaría el bandwidth
+        # por submuestras y cambiaría los scores
+        settings = kd.EstimatorSettings(efficient=False,
+                                        n_jobs=get_config()['n_jobs'])
         self.kde = MyKDEMultivariate(
             [np.array(self.X_train[['x']]),
              np.array(self.X_train[['y']]),
              np.array(self.X_train[['y_day']])],
-            'ccc', bw=self.bw)
+            'ccc', bw=self.bw, defaults=settings)
 
         self.bw = self.kde.bw
 
-    def predict(self, verbose=False):
+    @profiled()
+    def predict(self, verbose=False, sharded=False, n_jobs=None):
         """
+        Parameters
+        ----------
+        sharded : bool
+          True para evaluar el kde por distrito en procesos paralelos
+          (ver _shard.py). El resultado es el mismo
+        n_jobs : int
+          None usa get_config()['n_jobs']
+
         Returns
         -------
-        f_delitos_by_group : dict
-          Diccionario con los valores de la función densidad evaluada en
-          los puntos a predecir con llave el grupo
-        f_nodos_by_group : dict
-          Diccionario con los valores de la función densidad evaluada en
-          la malla original con llave el grupo
+        f_delitos : np.ndarray
+          Densidad normalizada en cada incidente de testeo, evaluada en
+          su día (y_day)
+        f_nodos : np.ndarray
+          Densidad normalizada en los nodos de la ciudad para cada día
+          de la ventana de predicción (self.f_cube sin los nodos fuera
+          de la ciudad)
         """
 
         print("\tMaking predictions...") if verbose else None
@@ -179,36 +180,35 @@ class STKDE:
             return self.f_delitos, self.f_nodos
 
         stkde = self.kde
-        t_training = pd.Series(self.X_train["y_day"]).to_numpy()
         if self.shps is not None:
             self.predicted_sim = stkde.resample(len(pd.Series(
                 self.X_test["x"]).tolist()), self.shps["councils"])
         # noinspection PyArgumentList
-        x, y, t = np.mgrid[
-                  self.x_min:
-                  self.x_max:100 * 1j,
-                  self.y_min:
-                  self.y_max:100 * 1j,
-                  t_training.max():
-                  t_training.max():1 * 1j
-                  ]
-
-        # pdf para nodos. checked_points filtra que los puntos estén dentro del área de dallas
+        x, y = np.mgrid[self.x_min:self.x_max:self.n_nodes * 1j,
+                        self.y_min:self.y_max:self.n_nodes * 1j]
+
+        # Solo se consideran los nodos dentro del área de la ciudad; la
+        # máscara de la malla se guarda en el cache
+        inside = np.ones(x.size, dtype=bool)
         if self.shps is not None:
-            f_nodos = stkde.pdf(af.checked_points(
-                np.array([x.flatten(), y.flatten(), t.flatten()]),
-                self.shps['councils']))
+            inside = af.in_shp(x.ravel(), y.ravel(), self.shps['councils'],
+                               use_cache=True)
+        nodes = np.array([x.ravel()[inside], y.ravel()[inside]])
+        self.days = self.forecast_days()
+
+        # Cada incidente de testeo se evalúa en su propio día
+        points = np.array([np.asarray(self.X_test['x'], dtype=float),
+                           np.asarray(self.X_test['y'], dtype=float),
+                           np.asarray(self.X_test['y_day'], dtype=float)])
+
+        if sharded:
+            f_nodos = stkde_pdf(self, nodes, times=self.days, n_jobs=n_jobs,
+                                verbose=verbose)
+            f_delitos = stkde_pdf(self, points, n_jobs=n_jobs,
+                                  verbose=verbose)
         else:
-            f_nodos = stkde.pdf(
-                np.array([x.flatten(), y.flatten(), t.flatten()]))
-
-        x, y, t = \
-            np.array(self.X_test['x']), \
-            np.array(self.X_test['y']), \
-            np.array(self.X_test['y_day'])
-        ti = np.repeat(max(t_training), x.size)
-        f_delitos = stkde.pdf(
-            np.array([x.flatten(), y.flatten(), ti.flatten()]))
+            f_nodos = stkde.pdf_cube(nodes, self.days)
+            f_delitos = stkde.pdf_chunked(points)
 
         f_max = max([f_nodos.max(), f_delitos.max()])
 
@@ -218,9 +218,29 @@ class STKDE:
 
         self.f_max = f_max
 
+        # Cubo (días, n_nodes, n_nodes) y mapa integrado en la ventana
+        self.f_cube = np.full((self.days.size, x.size), np.nan)
+        self.f_cube[:, inside] = f_nodos.T
+        self.f_cube = self.f_cube.reshape((self.days.size,) + x.shape)
+        self.z_grid = np.full(x.size, np.nan)
+        self.z_grid[inside] = f_nodos.mean(axis=1)
+        self.z_grid = self.z_grid.reshape(x.shape)
+
+        # Nodos de la ciudad para cada día de la ventana
+        f_nodos = f_nodos.T.ravel()
         self.f_delitos, self.f_nodos = f_delitos, f_nodos
         return self.f_delitos, self.f_nodos
 
+    def forecast_days(self):
+        """Días (y_day) de la ventana de predicción.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        return self.start_prediction.timetuple().tm_yday + \
+            np.arange(self.lp)
+
     def score(self, x, y, t):
         """
 
@@ -241,10 +261,102 @@ class STKDE:
         score_pdf = self.kde.pdf(np.array([x, y, t])) / self.f_max
         return score_pdf
 
+    def score_grid(self):
+        """Mapa de hotspots integrado en la ventana de predicción: el
+        promedio en los días de la ventana del score de cada nodo.
+
+        Returns
+        -------
+        (np.ndarray, list)
+          Matriz (n_nodes, n_nodes) de scores normalizados, nan fuera de
+          la ciudad, y su extent [x_min, x_max, y_min, y_max]
+        """
+        if self.z_grid is None:
+            self.predict()
+        return self.z_grid, [self.x_min, self.x_max, self.y_min, self.y_max]
+
+    def cell_grid(self):
+        """Celdas centradas en los nodos de self.z_grid.
+
+        Returns
+        -------
+        dict
+          x_0, y_0 (esquina inferior izquierda), hx, hy, nx, ny, ver
+          af.cell_index
+        """
+        dx = (self.x_max - self.x_min) / (self.n_nodes - 1)
+        dy = (self.y_max - self.y_min) / (self.n_nodes - 1)
+        return {'x_0': self.x_min - dx / 2, 'y_0': self.y_min - dy / 2,
+                'hx': dx, 'hy': dy, 'nx': self.n_nodes, 'ny': self.n_nodes}
+
+    def cell_ids(self, x, y):
+        """Nodo más cercano de cada punto, como índice en
+        self.z_grid.ravel().
+
+        Returns
+        -------
+        np.ndarray
+          -1 para los puntos fuera de la malla
+        """
+        return af.cell_index(x, y, **self.cell_grid())
+
+    def score_points(self, x, y, t=None, exact=False):
+        """Score normalizado de los puntos (x, y) en el día t.
+
+        Parameters
+        ----------
+        x : np.ndarray
+        y : np.ndarray
+        t : {None, np.ndarray}
+          Día del año de cada punto. None usa el mapa integrado en la
+          ventana de predicción (score_grid)
+        exact : bool
+          False lee el score del nodo más cercano en self.f_cube (nan
+          fuera de la malla, de la ciudad o de la ventana). True evalúa
+          el kde en los puntos
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if self.f_cube is None:
+            self.predict()
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        if exact:
+            if t is None:
+                f = self.kde.pdf_cube(np.array([x, y]), self.days, n_jobs=1)
+                return f.mean(axis=1) / self.f_max
+            t = np.broadcast_to(np.asarray(t, dtype=float).ravel(), x.shape)
+            return self.kde.pdf_chunked(np.array([x, y, t]),
+                                        n_jobs=1) / self.f_max
+
+        ids = self.cell_ids(x, y)
+        if t is None:
+            return af.gather(self.z_grid.ravel(), ids)
+        d = np.rint(np.asarray(t, dtype=float)).astype(np.int64) - \
+            self.days[0]
+        d = np.broadcast_to(d.ravel(), ids.shape)
+        ids = np.where((0 <= d) & (d < self.days.size) & (ids >= 0),
+                       d * self.n_nodes ** 2 + ids, -1)
+        return af.gather(self.f_cube.ravel(), ids)
+
+    def test_scores(self):
+        """Coordenadas y score de los incidentes de testeo.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray, np.ndarray)
+        """
+        if self.f_delitos is None:
+            self.predict()
+        return np.asarray(self.X_test['x'], dtype=float), \
+            np.asarray(self.X_test['y'], dtype=float), self.f_delitos
+
     def plot_geopdf(self, x_t, y_t, X_filtered, dallas, ax, color, label):
         if X_filtered.size > 0:
 
-            geometry = [Point(xy) for xy in zip(x_t, y_t)]
+            geometry = gpd.points_from_xy(np.ravel(x_t), np.ravel(y_t))
             if dallas is not None:
                 geo_df = gpd.GeoDataFrame(X_filtered,
                                           crs=dallas.crs,
@@ -263,7 +375,7 @@ class STKDE:
 
     def heatmap(self, c=None, show_score=True, incidences=False,
                 savefig=False, fname='STKDE_heatmap.png', ap=None,
-                verbose=False, **kwargs):
+                verbose=False, show=True, **kwargs):
         """
         Parameters
         ----------
@@ -271,53 +383,28 @@ class STKDE:
           Número de bins para heatmap
         ti : int
           Tiempo fijo para evaluar densidad en la predicción
+        show : bool
+          False para no llamar a plt.show; la figura queda abierta
         """
 
         print('\tPlotting Heatmap...') if verbose else None
+        colors = kwargs.pop('colors', {1: "blue", 2: "lime", 3: "red",
+                                       4: "green"})
+        show_axis = kwargs.pop('show_axis', True)
         if self.shps is not None:
             dallas = self.shps['streets']
         else:
             dallas = None
         fig, ax = plt.subplots(figsize=[6.75] * 2)  # Sacar de _config.py
-        t_training = pd.Series(self.X_train["y_day"]).to_numpy()
-
-        x, y, t = np.mgrid[
-                  self.x_min:
-                  self.x_max:100 * 1j,
-                  self.y_min:
-                  self.y_max:100 * 1j,
-                  t_training.max():
-                  t_training.max():1 * 1j
-                  ]
-        x = x.reshape(100, 100)
-        y = y.reshape(100, 100)
-        t = t.reshape(100, 100)
-
-        z = self.kde.pdf(
-            np.array([x.flatten(), y.flatten(), t.flatten()]))
-        if self.shps is not None:
-            z_filtered = self.kde.pdf(af.checked_points(
-                np.array([x.flatten(), y.flatten(), t.flatten()]),
-                self.shps['councils']))
-        else:
-            z_filtered = self.kde.pdf(
-                np.array([x.flatten(), y.flatten(), t.flatten()]))
-
-        x_t, y_t, t_t = \
-            np.array(self.X_test['x']), \
-            np.array(self.X_test['y']), \
-            np.array(self.X_test['y_day'])
-
-        ti = np.repeat(max(t_training), x_t.size)
-
-        f_delitos = self.kde.pdf(
-            np.array([x_t.flatten(), y_t.flatten(), ti.flatten()]))
-        max_pdf = max([f_delitos.max(), z.max()])
+        # noinspection PyArgumentList
+        x, y = np.mgrid[self.x_min:self.x_max:self.n_nodes * 1j,
+                        self.y_min:self.y_max:self.n_nodes * 1j]
 
-        # Normalize
-        f_delitos = f_delitos / max_pdf
-        z = z / max_pdf
-        z_filtered = z_filtered / max_pdf
+        # Mapa integrado en la ventana de predicción y score de cada
+        # incidente en su día
+        z = self.score_grid()[0].ravel()
+        z_filtered = z[~np.isnan(z)]
+        f_delitos = self.f_delitos
 
         if type(ap) == float or type(ap) == np.float64:
             c_array = self.c_vector
@@ -414,14 +501,14 @@ class STKDE:
                         self.plot_geopdf(np.array(self.X_test[['x']])[lvl],
                                          np.array(self.X_test[['y']])[lvl],
                                          self.X_test[lvl],
-                                         dallas, ax, kwargs['colors'][i],
+                                         dallas, ax, colors[i],
                                          f"Level {i}")
                         lvl = f_delitos > c_i
                     i += 1
                     self.plot_geopdf(np.array(self.X_test[['x']])[lvl],
                                      np.array(self.X_test[['y']])[lvl],
                                      self.X_test[lvl],
-                                     dallas, ax, kwargs['colors'][i],
+                                     dallas, ax, colors[i],
                                      f"Level {i}")
 
         else:
@@ -436,12 +523,13 @@ class STKDE:
 
         plt.title('STKDE')
 
-        # ax.set_axis_off()
+        ax.set_axis_off() if not show_axis else None
         plt.tight_layout()
         if savefig:
             plt.savefig(fname, **kwargs)
-        plt.show()
+        plt.show() if show else None
 
+    @profiled()
     def calculate_hr(self, c=None):
         """
         Parameters
@@ -470,6 +558,7 @@ class STKDE:
         area_percentaje = [i / len(f_nodos) for i in area_h]
         self.hr, self.ap = HR, area_percentaje
 
+    @profiled()
     def calculate_pai(self, c=None):
         """
         Parameters
@@ -501,6 +590,7 @@ class STKDE:
                self.ap[i] else 0 for i in range(len(self.hr))]
         self.pai = PAI
 
+    @profiled()
     def validate(self, c=None, ap=None, verbose=False, area=1000):
         """
         Si inrego asp, solo calcula PAI y HR, si ingreso c, calculo
@@ -542,10 +632,12 @@ class STKDE:
         #     self.h_area = (self.hr_validated / self.pai_validated) * area
 
         # elif ap is None:
-        dx = (self.x_max - self.x_min) / 100
-        dy = (self.y_max - self.y_min) / 100
-        v = self.f_nodos > c
-        self.h_area = np.sum(v) * dx * dy / (10 ** 6)
+        # Celdas centradas en los nodos, las mismas de los hotspots
+        g = self.cell_grid()
+        # Área promedio de los hotspots de cada día de la ventana
+        v = self.f_nodos >= c
+        self.h_area = np.sum(v) / self.days.size * g['hx'] * g['hy'] / \
+            (10 ** 6)
         self.d_incidents = np.sum(hits)
         print("Total: ", len(self.f_delitos)) if verbose else None
         print("Hotspot area area:", self.h_area) if verbose else None
@@ -554,14 +646,14 @@ class STKDE:
         print("PAI validated:", self.pai_validated) if verbose else None
 
 
-class RForestRegressor(object):
+class RForestRegressor(LazyAttributes):
     def __init__(self, data_0=None, shps=None,
                  xc_size=100, yc_size=100, n_layers=7,
                  t_history=4, start_prediction=date(2017, 11, 1),
                  length_prediction=7,
-                 read_data=False, w_data=False, read_X=False, w_X=False,
-                 verbose=False,
-                 name='RForestRegressor'):
+                 use_cache=True, sparse=False, out_of_core=False,
+                 batch_size=None, regressor='rf', neg_rate=None, crs=2276,
+                 verbose=False, name='RForestRegressor'):
         """ Regressor modificado de Scipy usado para predecir delitos.
 
         Parameters
@@ -583,12 +675,35 @@ class RForestRegressor(object):
           regressor
         start_prediction : date
           Fecha de comienzo en la ventana temporal a predecir
-        read_data : bool
-          True para leer el DataFrame con los incidentes de la Socrata
-          de un archivo .pkl previamente guardado.
-        read_X : bool
-          True para leer el DataFrame con la información de las celdas
-          en Dallas de un archivo .pkl previamente guardado.
+        use_cache : bool
+          True para leer/escribir los incidentes procesados y las
+          features de las celdas desde el cache de artefactos. Las
+          llaves dependen de los datos y de los parámetros, por lo que
+          nunca se reutilizan resultados de otra configuración.
+        sparse : bool
+          True para almacenar las features de self.X en una matriz
+          sparse. Por defecto se usa una matriz densa de enteros.
+        out_of_core : bool
+          True para escribir las features en disco (np.memmap en el
+          cache de artefactos) y entrenar/predecir por bloques de
+          celdas, ver _streaming.py. Para historias largas o celdas
+          pequeñas, cuando la matriz de features no cabe en memoria.
+          Requiere un forest como regressor, con al menos un árbol por
+          bloque
+        batch_size : int
+          Celdas por bloque con out_of_core. None lo calcula a partir
+          de get_config()['memory_limit']
+        regressor : {'rf', 'hgb', sklearn.base.RegressorMixin}
+          Backend del regressor: RandomForestRegressor ('rf'),
+          HistGradientBoostingRegressor ('hgb') o cualquier estimador
+          de sklearn, ver _regressors.py
+        neg_rate : float
+          Fracción de las celdas vacías (features y label nulas) usada
+          para entrenar, con peso 1 / neg_rate, ver _sampling.py. None
+          entrena con todas las celdas
+        crs
+          crs de las coordenadas x, y de data_0. Con shps se
+          transforman a EPSG:3857, igual que los shapefiles
         name : str
           Nombre especial para el regressor que aparece en los plots,
           estadísticas, etc.
@@ -611,7 +726,15 @@ class RForestRegressor(object):
         self.weeks = []
         self.l_weights = None
 
-        self.rfr = RandomForestRegressor(n_jobs=8)
+        self.regressor = regressor
+        self.rfr = make_regressor(regressor)
+        self.neg_rate = neg_rate
+        # Predicción de cada fila de features ya evaluada, por sus bytes.
+        # Se vacía al ajustar
+        self.row_cache = {}
+        # Label media de las celdas vacías, para recalibrar regressors
+        # sin sample_weight entrenados con neg_rate
+        self.empty_label = None
         self.ap, self.hr, self.pai = [None] * 3
 
         start_prediction = self.start_prediction
@@ -626,22 +749,27 @@ class RForestRegressor(object):
         self.weeks.append(start_prediction)
 
         self.data = data_0
-        self.X = None
-        self.read_data, self.read_X = read_data, read_X
-        self.w_data, self.w_X = w_data, w_X
+        self.incidents = None  # IncidentIndex de self.data
+        self.X = None  # FeatureStore
+        self.sparse = sparse
+        self.out_of_core = out_of_core
+        self.batch_size = batch_size
+        if sparse and out_of_core:
+            raise ValueError("out_of_core features must be dense")
+        self.grid = None
+        self.dangerous, self.dangerous_pred = None, None
+        self.use_cache = use_cache
+        self.data_key = None
+        self.crs = crs
 
         self.d_incidents = 0  # Detected incidents
         self.h_area = 0  # Hotspot area
-        if self.read_X:
-            self.X = pd.read_pickle('predictivehp/data/X.pkl')
-        if self.read_data:
-            self.data = pd.read_pickle('predictivehp/data/data.pkl')
 
     def set_parameters(self, t_history,
                        xc_size, yc_size, n_layers,
                        label_weights=None,
-                       read_data=False, w_data=False,
-                       read_X=False, w_X=False):
+                       use_cache=True, sparse=False, out_of_core=False,
+                       batch_size=None, regressor=None, neg_rate=None):
         """
         Setea los hiperparámetros del modelo
 
@@ -658,20 +786,33 @@ class RForestRegressor(object):
           Número de capas para considerar en el conteo de delitos de
           celdas vecinas
         label_weights : np.ndarray
-        read_data : bool
-        read_X : bool
-        w_data : bool
-        w_X : bool
-        """
+        use_cache : bool
+        sparse : bool
+          True para almacenar las features en una matriz sparse
+        out_of_core : bool
+          True para entrenar por bloques desde un np.memmap
+        batch_size : int
+        regressor : {'rf', 'hgb', sklearn.base.RegressorMixin}
+          None mantiene el backend actual
+        neg_rate : float
+          Fracción de las celdas vacías usada para entrenar
+        """
+        if sparse and out_of_core:
+            raise ValueError("out_of_core features must be dense")
         self.t_history = t_history
         self.xc_size = xc_size
         self.yc_size = yc_size
         self.n_layers = n_layers
         self.l_weights = label_weights
-        self.read_data = read_data
-        self.read_X = read_X
-        self.w_data = w_data
-        self.w_X = w_X
+        self.use_cache = use_cache
+        self.sparse = sparse
+        self.out_of_core = out_of_core
+        self.batch_size = batch_size
+        self.neg_rate = neg_rate
+        if regressor is not None:
+            self.regressor = regressor
+            self.rfr = make_regressor(regressor)
+            self.row_cache = {}
 
     def print_parameters(self):
         print('RFR Hyperparameters')
@@ -680,8 +821,13 @@ class RForestRegressor(object):
         print(f'{"yc_size:":<20s}{self.yc_size} m')
         print(f'{"n_layers:":<20s}{self.n_layers}')
         print(f'{"l_weights:":<20s}{self.l_weights}')
+        print(f'{"use_cache:":<20s}{self.use_cache}')
+        print(f'{"out_of_core:":<20s}{self.out_of_core}')
+        print(f'{"regressor:":<20s}{type(self.rfr).__name__}')
+        print(f'{"neg_rate:":<20s}{self.neg_rate}')
         print()
 
+    @profiled()
     def generate_data(self, verbose=False):
         """Prepara self.data a una estructura más propicia para el estudio
 
@@ -691,17 +837,67 @@ class RForestRegressor(object):
           Indica si se printean las diferentes acciones del método.
           default False
         """
-        geometry = [Point(xy) for xy in zip(np.array(self.data[['x']]),
-                                            np.array(self.data[['y']]))]
+        self.data_key = af.make_key(
+            data=af.hash_frame(self.data, ['x', 'y', 'date']),
+            bounds=None if self.shps is None
+            else list(self.shps['streets'].total_bounds),
+            xc_size=self.xc_size, yc_size=self.yc_size, crs=self.crs,
+        )
+        if self.use_cache:
+            data = af.ArtifactCache().load_frame('rfr_data', self.data_key,
+                                                 geo=True)
+            if data is not None:
+                print("\tIncidents loaded from cache") if verbose else None
+                self.data = data
+                self.set_grid()
+                self.incidents = IncidentIndex.from_frame(self.data,
+                                                          geometry=True)
+                return
+
+        geometry = gpd.points_from_xy(self.data['x'], self.data['y'])
         if self.shps is not None:
-            self.data = gpd.GeoDataFrame(self.data, crs=2276,
+            self.data = gpd.GeoDataFrame(self.data, crs=self.crs,
                                          geometry=geometry)
             self.data.to_crs(epsg=3857, inplace=True)
         else:
             self.data = gpd.GeoDataFrame(self.data, geometry=geometry)
         self.data['Cell'] = None
         self.assign_cells()
+        self.incidents = IncidentIndex.from_frame(self.data, geometry=True)
+        if self.use_cache:
+            af.ArtifactCache().save_frame('rfr_data', self.data_key,
+                                          self.data)
+
+    def set_grid(self):
+        """Calcula los parámetros de la malla de celdas de tamaño
+        xc_size x yc_size que cubre la ciudad.
+
+        Returns
+        -------
+        dict
+          x_min, y_min, hx, hy, nx, ny
+        """
+        if self.shps is not None:
+            x_min, y_min, x_max, y_max = self.shps['streets'].total_bounds
+        else:
+            delta_x = 0.1 * self.data.x.mean()
+            delta_y = 0.1 * self.data.y.mean()
+            x_min = self.data.x.min() - delta_x
+            x_max = self.data.x.max() + delta_x
+            y_min = self.data.y.min() - delta_y
+            y_max = self.data.y.max() + delta_y
 
+        # Equivalente a los nodos de np.mgrid[x_min:x_max:x_bins * 1j]
+        self.nx = int(abs(x_max - x_min) / self.xc_size) - 1
+        self.ny = int(abs(y_max - y_min) / self.yc_size) - 1
+        self.hx = (x_max - x_min) / self.nx
+        self.hy = (y_max - y_min) / self.ny
+        self.grid = {'x_min': x_min, 'y_min': y_min,
+                     'hx': self.hx, 'hy': self.hy,
+                     'nx': self.nx, 'ny': self.ny}
+        return self.grid
+
+    @profiled()
     def generate_X(self, verbose=False):
         """
         La malla se genera de la esquina inf-izquierda a la esquina sup-derecha,
@@ -722,108 +918,77 @@ class RForestRegressor(object):
         operaciones trasposición y luego up-down del nd-array entregan las
         posiciones reales para el pandas dataframe.
 
+        Las features quedan en un FeatureStore: una matriz de enteros
+        (densa o sparse) con una fila por celda dentro de Dallas. Con
+        out_of_core la matriz se escribe columna a columna en el cache
+        de artefactos (aunque use_cache sea False) y se mapea desde
+        disco.
+
         Parameters
         ----------
         verbose : bool
           Indica si se printean las diferentes acciones del método.
           default False
         """
-        print("\nGenerating dataframe...\n") \
+        print("\nGenerating features...\n") \
             if verbose else None
 
-        # Creación de la malla
-        print("\tCreating mgrid...") if verbose else None
-        if self.shps is not None:
-            x_min, y_min, x_max, y_max = self.shps['streets'].total_bounds
-        else:
-            delta_x = 0.1 * self.data.x.mean()
-            delta_y = 0.1 * self.data.y.mean()
-            x_min = self.data.x.min() - delta_x
-            x_max = self.data.x.max() + delta_x
-            y_min = self.data.y.min() - delta_y
-            y_max = self.data.y.max() + delta_y
-
-        x_bins = abs(x_max - x_min) / self.xc_size
-        y_bins = abs(y_max - y_min) / self.yc_size
-        x, y = np.mgrid[x_min: x_max: x_bins * 1j, y_min: y_max: y_bins * 1j, ]
-
-        # Creación del esqueleto del dataframe
-        print("\tCreating dataframe columns...") if verbose else None
-
-        X_cols = pd.MultiIndex.from_product(
-            [[f"Incidents_{i}" for i in range(self.n_layers + 1)], self.weeks]
-        )
-        X = pd.DataFrame(columns=X_cols)
-
-        # Creación de los parámetros para el cálculo de los índices
+        print("\tCreating grid...") if verbose else None
+        g = self.set_grid()
+
+        cache = af.ArtifactCache()
+        key = af.make_key(data=self.data_key, n_layers=self.n_layers,
+                          weeks=self.weeks, sparse=self.sparse)
+        mmap_mode = 'r' if self.out_of_core else None
+        if self.use_cache or self.out_of_core:
+            arrays, meta = cache.load_arrays('rfr_X', key,
+                                             mmap_mode=mmap_mode)
+            if arrays is not None:
+                print("\tFeatures loaded from cache") if verbose else None
+                self.X = FeatureStore.from_arrays(arrays, meta)
+                return
+
+        # Celda de cada incidente, ordenados por fecha
         print("\tFilling data...") if verbose else None
-        self.nx = x.shape[0] - 1
-        self.ny = y.shape[1] - 1
-        self.hx = (x.max() - x.min()) / self.nx
-        self.hy = (y.max() - y.min()) / self.ny
+        cells = self.incidents.cell_ids(g)
 
-        # Nro. incidentes en la i-ésima capa de la celda (i, j)
+        # Nro. incidentes en la celda (i, j) para cada semana
+        counts = {}
         for week in self.weeks:
             print(f"\t\t{week}... ", end=' ') if verbose else None
-            wi_date = week
-            wf_date = week + timedelta(days=6)
-            fil_incidents = self.data[
-                (wi_date <= self.data.date) & (self.data.date <= wf_date)
-                ]
-            D = np.zeros((self.nx, self.ny), dtype=int)
-
-            for _, row in fil_incidents.iterrows():
-                xi, yi = row.geometry.x, row.geometry.y
-                nx_i = af.n_i(xi, x.min(), self.hx)
-                ny_i = af.n_i(yi, y.min(), self.hy)
-                D[nx_i, ny_i] += 1
-
-            # Actualización del pandas dataframe
-            for i in range(self.n_layers + 1):
-                X.loc[:, (f"Incidents_{i}", f"{week}")] = \
-                    af.to_df_col(D) if i == 0 \
-                        else af.to_df_col(af.il_neighbors(D, i))
+            w_cells = cells[self.incidents.window(week,
+                                                  week + timedelta(days=7))]
+            w_cells = w_cells[w_cells >= 0]
+            counts[week] = np.bincount(
+                w_cells, minlength=self.nx * self.ny
+            ).reshape(self.nx, self.ny)
             print('finished!') if verbose else None
 
-        # Adición de las columnas 'geometry' e 'in_dallas' al data
-        print("\tPreparing data for filtering...") if verbose else None
-        X[('geometry', '')] = [Point(i) for i in
-                               zip(x[:-1, :-1].flatten(),
-                                   y[:-1, :-1].flatten())]
-        X[('in_dallas', '')] = 0
-
-        # Filtrado de celdas (llenado de la columna 'in_dallas')
+        # Filtrado de celdas: solo se conservan las que están en Dallas
+        mask = None
         if self.shps is not None:
-            X = af.filter_cells(df=X, shp=self.shps['councils'],
-                                verbose=verbose)
-            X.drop(columns=[('in_dallas', '')], inplace=True)
-
-        self.X = X
-        self.to_pickle('X.pkl')
-
-    def to_pickle(self, file_name, verbose=False):
-        """Genera un pickle de self.data o self.data dependiendo el nombre
-        dado (data.pkl o X.pkl).
-
-        OBS.
-
-
-
-        luego, si self.read_X = True, no es necesario realizar un
-        self.fit() o self.predict()
-
-        Parameters
-        ----------
-        file_name : str
-          Nombre del pickle a generar en predictivehp/data/file_name
-        """
-        print("\nPickling dataframe...", end=" ") if verbose \
-            else None
-        if file_name == "X.pkl":
-            self.X.to_pickle(f"predictivehp/data/{file_name}")
-        if file_name == "data.pkl":
-            self.data.to_pickle(f"predictivehp/data/{file_name}")
-
+            print("\tPreparing data for filtering...") if verbose else None
+            i, j = np.divmod(np.arange(self.nx * self.ny), self.ny)
+            mask = af.in_shp(g['x_min'] + i * g['hx'],
+                             g['y_min'] + j * g['hy'],
+                             self.shps['councils'], verbose=verbose,
+                             use_cache=True)
+
+        if self.out_of_core:
+            cache.build_arrays('rfr_X', key, lambda p: FeatureStore
+                               .from_counts(counts, self.n_layers, g,
+                                            mask=mask, path=p)
+                               .to_arrays()[1])
+            self.X = FeatureStore.from_arrays(
+                *cache.load_arrays('rfr_X', key, mmap_mode='r'))
+            return
+
+        self.X = FeatureStore.from_counts(counts, self.n_layers, g,
+                                          mask=mask, sparse=self.sparse)
+        if self.use_cache:
+            cache.save_arrays('rfr_X', key, *self.X.to_arrays())
+
+    @profiled()
     def assign_cells(self, verbose=False):
         """Rellena la columna 'Cell' de self.data. Asigna el número de
         celda asociado a cada incidente.
@@ -835,45 +1000,29 @@ class RForestRegressor(object):
           default False
         """
         print("\tAssigning cells...") if verbose else None
-        if self.shps is not None:
-            x_min, y_min, x_max, y_max = self.shps['streets'].total_bounds
-        else:
-            delta_x = 0.1 * self.data.x.mean()
-            delta_y = 0.1 * self.data.y.mean()
-            x_min = self.data.x.min() - delta_x
-            x_max = self.data.x.max() + delta_x
-            y_min = self.data.y.min() - delta_y
-            y_max = self.data.y.max() + delta_y
-
-        x_bins = abs(x_max - x_min) / self.xc_size
-        y_bins = abs(y_max - y_min) / self.yc_size
-
-        x, y = np.mgrid[x_min:x_max:x_bins * 1j, y_min:y_max:y_bins * 1j, ]
+        g = self.set_grid()
 
-        nx = x.shape[0] - 1
-        ny = y.shape[1] - 1
-        hx = (x.max() - x.min()) / nx
-        hy = (y.max() - y.min()) / ny
-        for idx, inc in self.data.iterrows():
-            xi, yi = inc.geometry.x, inc.geometry.y
-            nx_i = af.n_i(xi, x.min(), hx)
-            ny_i = af.n_i(yi, y.min(), hy)
-            cell_idx = ny_i + ny * nx_i
-
-            self.data.loc[idx, 'Cell'] = cell_idx
+        nx_i = np.floor(
+            (self.data.geometry.x.to_numpy() - g['x_min']) / g['hx']
+        ).astype(int)
+        ny_i = np.floor(
+            (self.data.geometry.y.to_numpy() - g['y_min']) / g['hy']
+        ).astype(int)
+        self.data['Cell'] = ny_i + self.ny * nx_i
 
         # Dejamos la asociación inc-cell en el index de self.data
         self.data.set_index('Cell', drop=True, inplace=True)
-        # self.data.to_pickle("predictivehp/data/data.pkl")
 
+    @profiled()
     def fit(self, X, y, verbose=False):
         """Entrena el modelo
 
         Parameters
         ----------
-        X : pd.DataFrame
-          X_train
-        y : pd.DataFrame
+        X : {np.ndarray, sp.csr_matrix, FeatureView}
+          X_train. Con out_of_core se entrena por bloques de celdas y
+          con neg_rate solo con una fracción de las celdas vacías
+        y : np.ndarray
           y_train
         verbose : bool
           Indica si se printean las diferentes acciones del método.
@@ -884,18 +1033,56 @@ class RForestRegressor(object):
         self : object
         """
         print("\tFitting Model...") if verbose else None
-        self.rfr.fit(X, y.to_numpy().ravel())
-        self.X[('Dangerous', '')] = y  # Sirven para determinar celdas con TP/FN
+        # El n_jobs global no pisa el de un estimador entregado por el
+        # usuario en regressor, salvo que lo haya dejado en None
+        params = self.rfr.get_params()
+        if 'n_jobs' in params and (isinstance(self.regressor, str) or
+                                   params['n_jobs'] is None):
+            self.rfr.set_params(n_jobs=get_config()['n_jobs'])
+        if sp.issparse(X) and not accepts_sparse(self.rfr):
+            X = X.toarray()
+
+        rows, weights = None, None
+        self.empty_label = None
+        self.row_cache = {}
+        if self.neg_rate is not None and self.neg_rate < 1:
+            rows, weights = negative_sample(X, y, self.neg_rate)
+            print(f"\tTraining on {rows.size} of {X.shape[0]} cells") \
+                if verbose else None
+            if not accepts_weights(self.rfr):
+                # Sin pesos, el score de las celdas vacías se fija a la
+                # label media de todas ellas al predecir
+                empty = empty_rows(X)
+                if empty.any():
+                    self.empty_label = float(
+                        np.asarray(y).ravel()[empty].mean())
+                weights = None
+
+        if self.out_of_core:
+            fit_batches(self.rfr, X, y, rows=rows, sample_weight=weights,
+                        batch_size=self.batch_size, verbose=verbose)
+        elif rows is not None:
+            self.rfr.fit(X[rows], np.asarray(y).ravel()[rows],
+                         **({} if weights is None
+                            else {'sample_weight': weights}))
+        else:
+            self.rfr.fit(X, np.asarray(y).ravel())
+        self.dangerous = np.asarray(y)  # Celdas con TP/FN
         return self
 
-    def predict(self, X, verbose=False):
+    @profiled()
+    def predict(self, X, verbose=False, sharded=False, n_jobs=None):
         """Predice el score de peligrosidad en cada una de las celdas
         en la malla de Dallas.
 
         Parameters
         ----------
-        X : pd.DataFrame
+        X : {np.ndarray, sp.csr_matrix, FeatureView}
           X_test for prediction
+        sharded : bool
+          True para predecir por distrito en paralelo (ver _shard.py)
+        n_jobs : int
+          None usa get_config()['n_jobs']
         verbose : bool
           Indica si se printean las diferentes acciones del método.
           default False
@@ -907,23 +1094,125 @@ class RForestRegressor(object):
           una celda de la malla de Dallas
         """
         print("\tMaking predictions...") if verbose else None
-        y_pred = self.rfr.predict(X)
-        self.X[('Dangerous_pred', '')] = y_pred / y_pred.max()
-        self.X.index.name = 'Cell'
+        if sp.issparse(X) and not accepts_sparse(self.rfr):
+            X = X.toarray()
+        if sharded:
+            y_pred = rfr_predict(self, X, n_jobs=n_jobs, verbose=verbose)
+        else:
+            # Cada fila distinta se evalúa una vez; las ya vistas en
+            # predicciones anteriores se leen de self.row_cache
+            y_pred = predict_batches(self.rfr, X, batch_size=self.batch_size,
+                                     n_jobs=n_jobs, cache=self.row_cache)
+        if self.empty_label is not None:
+            y_pred[empty_rows(X)] = self.empty_label
+        self.dangerous_pred = y_pred / y_pred.max()
+
+        # Score de cada celda de la malla completa, nan fuera de Dallas
+        self.s_grid = np.full(self.nx * self.ny, np.nan)
+        self.s_grid[self.X.cells] = self.dangerous_pred
         return y_pred
 
     def score(self):
-        return self.X[('Dangerous_pred', '')]
-        # y_pred = self.predict(X_test)
-        #
-        # score = self.rfr.score(X_test, y_test)
-        # precision = precision_score(y_test, y_pred)
-        # recall = recall_score(y_test, y_pred)
-        #
-        # print(f"{'Score:':<10s}{score:1.5f}")
-        # print(f"{'Precision:':<10s}{precision:1.5f}")
-        # print(f"{'Recall:':<10s}{recall:1.5f}")
+        """
+        Returns
+        -------
+        pd.Series
+          Score de peligrosidad de cada celda, indexado por 'Cell'
+        """
+        return pd.Series(self.dangerous_pred,
+                         index=pd.Index(self.X.cells, name='Cell'),
+                         name='Dangerous_pred')
+
+    def cell_scores(self, cells):
+        """Score de las celdas dadas, nan para las que están fuera de
+        Dallas.
+
+        Parameters
+        ----------
+        cells : np.ndarray
+          Ids de las celdas
+
+        Returns
+        -------
+        np.ndarray
+        """
+        cells = np.asarray(cells, dtype=np.int64)
+        ans = np.full(cells.size, np.nan)
+        valid = (0 <= cells) & (cells < self.s_grid.size)
+        ans[valid] = self.s_grid[cells[valid]]
+        return ans
 
+    def score_grid(self):
+        """Score de cada celda ordenado según la malla.
+
+        Returns
+        -------
+        (np.ndarray, list)
+          Matriz (nx, ny) de scores, nan fuera de la ciudad, y su extent
+          [x_min, x_max, y_min, y_max]
+        """
+        g = self.grid
+        return self.s_grid.reshape(g['nx'], g['ny']), \
+            [g['x_min'], g['x_min'] + g['nx'] * g['hx'],
+             g['y_min'], g['y_min'] + g['ny'] * g['hy']]
+
+    def cell_grid(self):
+        """
+        Returns
+        -------
+        dict
+          x_0, y_0 (esquina inferior izquierda), hx, hy, nx, ny de la
+          malla, ver af.cell_index
+        """
+        g = self.grid
+        return {'x_0': g['x_min'], 'y_0': g['y_min'], 'hx': g['hx'],
+                'hy': g['hy'], 'nx': g['nx'], 'ny': g['ny']}
+
+    def cell_ids(self, x, y):
+        """Id de la celda de cada punto (índice en self.s_grid).
+
+        Returns
+        -------
+        np.ndarray
+          -1 para los puntos fuera de la malla
+        """
+        return af.cell_index(x, y, **self.cell_grid())
+
+    def score_points(self, x, y, t=None, exact=False):
+        """Score de la celda de cada punto (x, y), nan fuera de la
+        ciudad. Las features son por celda, por lo que no hay una
+        evaluación más exacta que la de la celda: t y exact se ignoran.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        return af.gather(self.s_grid, self.cell_ids(x, y))
+
+    def test_scores(self):
+        """Coordenadas y score de los incidentes de la ventana de
+        predicción.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray, np.ndarray)
+        """
+        f_data = self.test_data()
+        return f_data.geometry.x.to_numpy(), f_data.geometry.y.to_numpy(), \
+            self.cell_scores(f_data.index)
+
+    def test_data(self):
+        """Incidentes de la ventana temporal de predicción.
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        return self.incidents.take(
+            self.data, self.start_prediction,
+            self.start_prediction + timedelta(days=self.length_pred + 1))
+
+    @profiled()
     def validate(self, c=0, ap=None, verbose=False):
         """
 
@@ -932,9 +1221,6 @@ class RForestRegressor(object):
         c: {int, float, np.ndarray, list}
         ap: {int, float, np.ndarray, list}
         """
-        cells = self.X[[('geometry', ''), ('Dangerous_pred', '')]]
-        cells = gpd.GeoDataFrame(cells)
-
         if ap is not None:
             if self.ap is None:
                 self.calculate_pai(np.linspace(0, 1, 1000))
@@ -949,43 +1235,26 @@ class RForestRegressor(object):
             if len(c) == 1:
                 c = c[0]
 
-        if type(c) in {list, np.ndarray}:
-            d_cells = cells[
-                (c <= cells[('Dangerous_pred', '')]) &
-                (cells[('Dangerous_pred', '')] <= c)
-                ]
-            cells['Hit'] = np.where(
-                (c[0] <= cells[('Dangerous_pred', '')])
-                & (cells[('Dangerous_pred', '')] <= c[1]),
-                1, 0)
+        f_data = self.test_data()
+        scores = self.cell_scores(f_data.index)
 
+        pred = self.dangerous_pred
+        if type(c) in {list, np.ndarray}:
+            c_min, c_max = min(c), max(c)
+            d_cells = (c_min <= pred) & (pred <= c_max)
+            hits = (c_min <= scores) & (scores <= c_max)
         else:
-            d_cells = cells[c <= cells[('Dangerous_pred', '')]]
-            cells['Hit'] = np.where(
-                cells[('Dangerous_pred', '')] >= c, 1, 0
-            )
-        if self.read_data:
-            self.data = pd.read_pickle('predictivehp/data/data.pkl')
-        f_data = pd.DataFrame(
-            self.data[(self.start_prediction <= self.data.date) &
-                      (self.data.date <= self.start_prediction + timedelta(
-                          self.length_pred))])
-        f_data.columns = pd.MultiIndex.from_product([f_data.columns, ['']])
-        cells.drop(columns='geometry', inplace=True)
-        join_ = f_data.join(cells)
+            d_cells = pred >= c
+            hits = scores >= c
 
-        hits = gpd.GeoDataFrame(join_[join_['Hit'] == 1])
+        a, A = np.count_nonzero(d_cells), pred.size
 
-        d_incidents = hits.shape[0]
-        h_area = d_cells.shape[0] * self.xc_size * self.yc_size * (10 ** -6)
-
-        a, A = d_cells.shape[0], cells.shape[0]
-
-        self.d_incidents = d_incidents
-        self.h_area = h_area
+        self.d_incidents = int(np.count_nonzero(hits))
+        self.h_area = a * self.xc_size * self.yc_size * (10 ** -6)
         self.hr_validated = self.d_incidents / f_data.shape[0]
         self.pai_validated = self.hr_validated / (a / A)
 
+    @profiled()
     def calculate_hr(self, c=None, verbose=False):
         """
         Parameters
@@ -995,44 +1264,26 @@ class RForestRegressor(object):
         ap : {int, float, list, np.ndarray}
           Area percentage
         """
-        # TODO
-        #   .calculate_hr_onelvl(c : {float, np.ndarray, np.float64})
-        if c is not None:
-            if type(c) in {float, np.float64} or \
-                    (type(c) == np.ndarray and c.size == 1):
-                # hr = self.calculate_hr_onelvl(c)
-                f_data = pd.DataFrame(
-                    self.data[(self.start_prediction <= self.data.date) &
-                              (
-                                      self.data.date <= self.start_prediction + timedelta(
-                                  self.length_pred))]
-                )  # 62 Incidentes
-                if 'geometry' in set(f_data.columns):
-                    f_data.drop(columns='geometry', inplace=True)
-                f_data.columns = pd.MultiIndex.from_product(
-                    [f_data.columns, ['']]
-                )
-                ans = f_data.join(self.X)
-                incidentsh = ans[ans[('Dangerous_pred', '')] >= c[0]]
-                hr = incidentsh.shape[0] / f_data.shape[0]
-                return hr
-            else:
-                A = self.X.shape[0]
-
-                def a(X, c):
-                    return X[X[('Dangerous_pred', '')] >= c].shape[0]
-
-                c_arr = c
-                self.c_vector = c_arr
-                hr_l = []
-                ap_l = []
-                for c in c_arr:
-                    hr_l.append(self.calculate_hr(c=np.array([c])))
-                    # hr_l.append(self.calculate_hr_onelvl(c)
-                    ap_l.append(a(self.X, c) / A)
-                self.hr = np.array(hr_l)
-                self.ap = np.array(ap_l)
+        if c is None:
+            return
+        c = np.asarray(c, dtype=float).ravel()
+
+        # Nº de elementos >= c mediante búsqueda binaria sobre los
+        # scores ordenados
+        scores = self.cell_scores(self.test_data().index)
+        s_inc = np.sort(scores[~np.isnan(scores)])
+        hr = (s_inc.size - np.searchsorted(s_inc, c)) / scores.size
 
+        if c.size == 1:
+            return float(hr[0])
+
+        s_cells = np.sort(self.dangerous_pred)
+        ap = (s_cells.size - np.searchsorted(s_cells, c)) / s_cells.size
+
+        self.c_vector = c
+        self.hr, self.ap = hr, ap
+
+    @profiled()
     def calculate_pai(self, c=None, verbose=False):
         """
         Calcula el Predictive Accuracy Index (PAI)
@@ -1044,52 +1295,46 @@ class RForestRegressor(object):
         ap : {int, float, list, np.ndarray}
           Area percentage
         """
-
-        def a(x, c):
-            return x[x[('Dangerous_pred', '')] >= c].shape[0]
-
-        A = self.X.shape[0]  # Celdas en Dallas
+        c = np.asarray(c, dtype=float).ravel()
         if c.size == 1:
             hr = self.calculate_hr(c=c)
-            ap = a(self.X, c) / A
+            ap = np.count_nonzero(self.dangerous_pred >= c[0]) / \
+                 self.dangerous_pred.size
             return hr / ap
         else:
-            c_arr = c
-            self.c_vector = c_arr
-            hr_l = []
-            ap_l = []
-            pai_l = []
-            for c in c_arr:
-                hr = self.calculate_hr(c=np.array([c]))
-                ap = a(self.X, c) / A
-                hr_l.append(hr), ap_l.append(ap)
-                if ap == 0:
-                    pai_l.append(0)
-                    continue
-                pai_l.append(hr / ap)
-            self.hr = np.array(hr_l)
-            self.ap = np.array(ap_l)
-            self.pai = np.array(pai_l)
-
-    def heatmap(self, c=None, ap=None, incidences=False,
+            self.calculate_hr(c=c)
+            self.pai = np.divide(self.hr, self.ap,
+                                 out=np.zeros_like(self.hr),
+                                 where=self.ap != 0)
+
+    def heatmap(self, c=None, ap=None, show_score=True, incidences=False,
                 savefig=False, fname='RFR_heatmap.png',
-                verbose=False, **kwargs):
-        """
+                verbose=False, show=True, **kwargs):
+        """Dibuja el score de las celdas reordenado en la malla (nx, ny)
+        con un único imshow, igual que ProMap.heatmap.
 
         Parameters
         ----------
         c : {float, list, tuple}
-        incidences
-        savefig
-        fname
+        ap : {float, list, np.ndarray}
+        show_score : bool
+          Muestra la colorbar cuando c es None
+        incidences : bool
+          True para dibujar los incidentes de la ventana de predicción
+        savefig : bool
+        fname : str
+          Se le agrega '.png' si no tiene extensión
+        show : bool
+          False para no llamar a plt.show; la figura queda abierta
         kwargs
-
-        Returns
-        -------
-
+          colors : dict {nivel: color} para el caso multinivel.
+          show_axis : bool, False para ocultar los ejes. El resto se
+          entrega a plt.savefig
         """
         print('\tPlotting Heatmap...') if verbose else None
-        fname = f'{fname}.png'
+        colors = kwargs.pop('colors', {1: "blue", 2: "lime", 3: "red",
+                                       4: "green"})
+        show_axis = kwargs.pop('show_axis', True)
         if self.ap is None:
             self.calculate_pai(np.linspace(0, 1, 1000))
         if type(ap) == float or type(ap) == np.float64:
@@ -1098,25 +1343,19 @@ class RForestRegressor(object):
         elif type(ap) == list or type(ap) == np.ndarray:
             c = sorted([af.find_c(self.ap, self.c_vector, i) for i in ap])
 
-        cells = self.X[[('geometry', ''), ('Dangerous_pred', '')]]
-        cells = gpd.GeoDataFrame(cells)
+        if type(c) in {list, tuple, np.ndarray}:
+            c = np.array(c).flatten()
+            c = c[c > 0]
+            c = c[c < 1]
+            c = np.unique(c)
+            c = np.sort(c)
 
-        if self.shps is not None:
-            d_streets = self.shps['streets']
+        z, extent = self.score_grid()
+        matriz = af.score_levels(z, c)
 
         fig, ax = plt.subplots(figsize=[6.75] * 2)
-        if self.shps is not None:
-            d_streets.plot(ax=ax, alpha=0.1, lw=0.3, color="w")
 
-        if c is None:
-            d_cells = cells[cells[('Dangerous_pred', '')] >= 0.0]
-            d_cells.plot(ax=ax, column=('Dangerous_pred', ''), cmap='jet',
-                         marker=',', markersize=0.2)  # Heatmap con rango
-            cells['Hit'] = np.where(
-                cells[('Dangerous_pred', '')] >= 0.0, 1, 0
-            )
-
-            # La colorbar se muestra solo cuando es necesario
+        if show_score and c is None:
             # noinspection PyUnresolvedReferences
             norm = mpl.colors.Normalize(vmin=0, vmax=1)
             # noinspection PyUnresolvedReferences
@@ -1128,123 +1367,33 @@ class RForestRegressor(object):
                                  shrink=0.5,
                                  aspect=21.5)
             c_bar.ax.set_ylabel('Danger Score')
-        elif type(c) in {float, int, np.float64}:
-            d_cells = cells[cells[('Dangerous_pred', '')] >= c]
-            d_cells.plot(ax=ax, marker='o', markersize=10, color='darkred',
-                         alpha=0.1)  # Heatmap binario
-            cells['Hit'] = np.where(
-                cells[('Dangerous_pred', '')] >= c, 1, 0
-            )
-        else:  # c es una Iterable de c's: Asumo [c0, c1]
-            c = np.array(c).flatten()
-            c = c[c > 0]
-            c = c[c < 1]
-            c = np.unique(c)
-            c = np.sort(c)
 
-            for idx, i in enumerate(c):
-                if idx == 0:
-                    lvl = cells[('Dangerous_pred', '')] <= c[idx]
-                else:
-                    lvl = (c[idx - 1] < cells[('Dangerous_pred', '')]) & \
-                          (cells[('Dangerous_pred', '')] <= c[idx])
-
-                d_cells = cells[lvl]
-                d_cells.plot(ax=ax, marker='o', markersize=3,
-                             color=kwargs['colors'][idx + 1],
-                             alpha=0.1)
-                cells[f'D{idx + 1}'] = np.where(lvl, 1, 0)
-
-            lvl = c[-1] < cells[('Dangerous_pred', '')]
-
-            d_cells = cells[lvl]
-            d_cells.plot(ax=ax, marker='o', markersize=3,
-                         color=kwargs['colors'][c.size + 1],
-                         alpha=0.1)
-            cells[f'D{c.size + 1}'] = np.where(lvl, 1, 0)
-
-            # d1_cells = cells[
-            #     (0.0 <= cells[('Dangerous_pred', '')]) &
-            #     (cells[('Dangerous_pred', '')] <= c[0])
-            #     ]
-            # d2_cells = cells[
-            #     (c[0] <= cells[('Dangerous_pred', '')]) &
-            #     (cells[('Dangerous_pred', '')] <= c[1])
-            #     ]
-            # d3_cells = cells[
-            #     (c[1] <= cells[('Dangerous_pred', '')]) &
-            #     (cells[('Dangerous_pred', '')] <= 1.0)
-            #     ]
-            # d1_cells.plot(ax=ax, marker='.', markersize=1, color='darkblue',
-            #               alpha=0.1)
-            # d2_cells.plot(ax=ax, marker='.', markersize=1, color='lime',
-            #               alpha=0.1)
-            # d3_cells.plot(ax=ax, marker='.', markersize=1, color='red',
-            #               alpha=0.1)
-            # cells['D1'] = np.where(
-            #     (0.0 <= cells[('Dangerous_pred', '')]) &
-            #     (cells[('Dangerous_pred', '')] <= c[0]), 1, 0
-            # )
-            # cells['D2'] = np.where(
-            #     (c[0] <= cells[('Dangerous_pred', '')]) &
-            #     (cells[('Dangerous_pred', '')] <= c[1]), 1, 0
-            # )
-            # cells['D3'] = np.where(
-            #     (c[1] <= cells[('Dangerous_pred', '')]) &
-            #     (cells[('Dangerous_pred', '')] <= 1.0), 1, 0
-            # )
+        plt.imshow(np.flipud(matriz.T),
+                   extent=extent,
+                   cmap='jet',
+                   alpha=0.3 if incidences else 1,
+                   interpolation=None,
+                   vmin=0, vmax=1)
+        if self.shps is not None:
+            self.shps['streets'].plot(ax=ax, alpha=0.2, lw=0.3, color="w")
 
         if incidences:  # Se plotean los incidentes
-            f_data = pd.DataFrame(
-                self.data[(self.start_prediction <= self.data.date) &
-                          (self.data.date <= self.start_prediction + timedelta(
-                              self.length_pred))])
-            f_data.columns = pd.MultiIndex.from_product(
-                [f_data.columns, ['']]
-            )
-            cells.drop(columns='geometry', inplace=True)
-            join_ = f_data.join(cells)
-
-            if c is None or type(c) in {float, int, np.float64}:
-                hits = gpd.GeoDataFrame(join_[join_['Hit'] == 1])
-                misses = gpd.GeoDataFrame(join_[join_['Hit'] == 0])
-                if not hits.empty:
-                    hits.plot(ax=ax, marker='x', markersize=1,
-                              color='lime',
-                              label="Hits")
-                if not misses.empty:
-                    misses.plot(ax=ax, marker='x', markersize=1,
-                                color='red',
-                                label="Misses")
-            else:
-                for i in range(1, c.size + 2):
-                    d = gpd.GeoDataFrame(join_[join_[f'D{i}'] == 1])
-                    if not d.empty:
-                        d.plot(
-                            ax=ax, marker='x', markersize=1,
-                            color=kwargs['colors'][i], label=f'Level {i}'
-                        )
-
-                # d1 = gpd.GeoDataFrame(join_[join_['D1'] == 1])
-                # d2 = gpd.GeoDataFrame(join_[join_['D2'] == 1])
-                # d3 = gpd.GeoDataFrame(join_[join_['D3'] == 1])
-                # if not d1.empty:
-                #     d1.plot(ax=ax, marker='x', markersize=0.25,
-                #             color='blue', label="Level 1")
-                # if not d2.empty:
-                #     d2.plot(ax=ax, marker='x', markersize=0.25, color='lime',
-                #             label="Level 2")
-                # if not d3.empty:
-                #     d3.plot(ax=ax, marker='x', markersize=0.25, color='red',
-                #             label="Level 3")
+            x, y, scores = self.test_scores()
+            for mask, color, label in af.incident_groups(scores, c, colors):
+                if mask.any():
+                    ax.scatter(x[mask], y[mask], s=3, color=color,
+                               marker='o', zorder=3, label=label)
             plt.legend()
 
         plt.title('RForestRegressor')
 
+        ax.set_axis_off() if not show_axis else None
         plt.tight_layout()
         if savefig:
+            if not os.path.splitext(fname)[1]:
+                fname = f'{fname}.png'
             plt.savefig(fname, dpi=200, **kwargs)
-        plt.show()
+        plt.show() if show else None
 
     def plot_statistics(self, n=500):
         """
@@ -1674,6 +1823,8 @@ class RForestRegressor(object):
                       linewidth=2.5,
                       edgecolor="black")
 
+        from matplotlib.lines import Line2D
+
         handles = [Line2D([], [], marker='o', color='red',
                           label='Dangerous Cell',
                           linestyle='None'),
@@ -1782,7 +1933,7 @@ class RForestRegressor(object):
     #     plt.close()
 
 
-class ProMap:
+class ProMap(LazyAttributes):
     def __init__(self, data=None, read_density=False,
                  bw_x=400, bw_y=400, bw_t=7, length_prediction=7,
                  tiempo_entrenamiento=None,
@@ -1796,7 +1947,9 @@ class ProMap:
         n_datos: int
             indica el nº de datos que se usarán para entrenar el modelo
         read_density: bool
-            True si se va a leer una matriz de densidades
+            True para usar el cache de artefactos: la matriz de
+            densidades se lee si ya fue calculada con los mismos datos
+            y parámetros, y se guarda en otro caso
         hx: int
             Ancho en x de las celdas en metros
         hy: int
@@ -1843,6 +1996,8 @@ class ProMap:
         # MODEL
         self.name = name
         self.lp = length_prediction
+        self.m_cache = {}
+        self.d_max = None  # Máximo de la densidad sin normalizar
 
         self.hr, self.pai, self.ap = None, None, None
 
@@ -1858,6 +2013,8 @@ class ProMap:
             ancho de la celda en metros, en x
         hy: int
             ancho de la celda en metros, en y
+        read_density: bool
+            True para leer/guardar la matriz de densidades en el cache
         -------
         """
 
@@ -1882,6 +2039,7 @@ class ProMap:
         print(f'hy: {self.hy} mts')
         print()
 
+    @profiled()
     def create_grid(self, verbose=False):
 
         """
@@ -1902,6 +2060,7 @@ class ProMap:
                            self.y_min + delta_y:self.y_max - delta_y:self.bins_y * 1j
                            ]
 
+    @profiled()
     def fit(self, X, y, verbose=False):
 
         """
@@ -1928,7 +2087,7 @@ class ProMap:
 
         if self.shps is not None:
             self.cells_in_map = af.checked_points_pm(points, self.shps[
-            'councils'])  #
+            'councils'])
             #self.cells_in_map = 141337
         else:
             cells_x = abs(self.x_min - self.x_max) // self.hx
@@ -1937,66 +2096,105 @@ class ProMap:
 
         self.load_test_matrix()
 
-    def predict(self, verbose=False):
+    @profiled()
+    def predict(self, verbose=False, sharded=False, n_jobs=None):
 
         """
         Calula el score en cada celda de la malla de densidades.
         Parameters
         ----------
-
+        sharded: bool
+            True para calcular la densidad por franjas de la malla en
+            procesos paralelos (ver _shard.py). El resultado es el mismo
+        n_jobs: int
+            None usa get_config()['n_jobs']
         """
 
+        # Con read_density la matriz se lee o se guarda en el cache
         if self.read_density:
-            self.prediction = np.load(
-                'predictivehp/data/prediction.npy')
+            cache = af.ArtifactCache()
+            key = self.prediction_key()
+            arrays, meta = cache.load_arrays('promap', key, mmap_mode='r')
+            if arrays is not None:
+                print("\tDensities loaded from cache\n") \
+                    if verbose else None
+                self.prediction = arrays['prediction']
+                self.d_max = meta.get('d_max')
+                return
+
+        print("\tPredicting...\n") \
+            if verbose else None
+        if sharded:
+            self.prediction = promap_predict(self, n_jobs=n_jobs,
+                                             verbose=verbose)
+        else:
+            self.prediction = af.promap_density(
+                self.xx, self.yy,
+                self.X['x_point'].to_numpy(dtype=float),
+                self.X['y_point'].to_numpy(dtype=float),
+                self.X['y_day'].to_numpy(), self.dias_train,
+                self.hx, self.hy, self.bw_x, self.bw_y)
 
+        self.d_max = float(self.prediction.max())
+        self.prediction = self.prediction / self.d_max
 
-        else:
-            print("\tPredicting...\n") \
-                if verbose else None
-            self.prediction = np.zeros((self.bins_x, self.bins_y))
-            # print('\nEstimando densidades...')
-            # print(
-            #     f'\n\tNº de datos para entrenar el modelo: {len(self.X)}')
-            # print(
-            #     f'\tNº de días usados para entrenar el modelo: {self.dias_train}')
-            # print(
-            #     f'\tNº de datos para testear el modelo: {len(self.y)}')
-
-            ancho_x = af.radio_pintar(self.hx, self.bw_x)
-            ancho_y = af.radio_pintar(self.hy, self.bw_y)
-
-            for k in range(len(self.X)):
-                x, y, t = self.X['x_point'][k], self.X['y_point'][k], \
-                          self.X['y_day'][k]
-                x_in_matrix, y_in_matrix = af.find_position(self.xx, self.yy,
-                                                            x, y,
-                                                            self.hx, self.hy)
-                x_left, x_right = af.limites_x(ancho_x, x_in_matrix, self.xx)
-                y_abajo, y_up = af.limites_y(ancho_y, y_in_matrix, self.yy)
-
-                for i in range(x_left, x_right):
-                    for j in range(y_abajo, y_up):
-                        elem_x = self.xx[i][0]
-                        elem_y = self.yy[0][j]
-                        time_weight = 1 / af.n_semanas(self.dias_train, t)
-
-                        if af.linear_distance(elem_x, x) > self.bw_x or \
-                                af.linear_distance(elem_y, y) > self.bw_y:
-                            cell_weight = 0
-
-                        else:
-                            cell_weight = 1 / af.cells_distance(x, y, elem_x,
-                                                                elem_y,
-                                                                self.hx,
-                                                                self.hy)
-
-                        self.prediction[i][j] += time_weight * cell_weight
-
-            self.prediction = self.prediction / self.prediction.max()
-
-            # print('\nGuardando datos...')
-            np.save('predictivehp/data/prediction.npy', self.prediction)
+        if self.read_density:
+            cache.save_arrays(
+                'promap', key, {'prediction': self.prediction},
+                meta={'d_max': self.d_max,
+                      'bw': [self.bw_x, self.bw_y, self.bw_t],
+                      'hx': self.hx, 'hy': self.hy,
+                      'start_prediction': self.start_prediction})
+
+    def prediction_key(self):
+        """Llave de la matriz de densidades en el cache. Depende de los
+        incidentes de entrenamiento y de todos los parámetros que
+        afectan la predicción.
+
+        Returns
+        -------
+        str
+        """
+        return af.make_key(
+            data=af.hash_frame(self.X, ['x_point', 'y_point', 'y_day']),
+            bw=[self.bw_x, self.bw_y, self.bw_t],
+            hx=self.hx, hy=self.hy,
+            bins=[self.bins_x, self.bins_y],
+            bounds=[self.x_min, self.y_min, self.x_max, self.y_max],
+            dias_train=self.dias_train,
+        )
+
+    def incidents_matrix(self, name, df, window):
+        """Cantidad de incidentes de df por celda con
+        t_0 <= y_day <= t_1. La matriz se guarda en self.m_cache y se
+        recalcula solo si cambian los datos, la malla o la ventana.
+
+        Parameters
+        ----------
+        name : str
+          'train' o 'test'
+        df : pd.DataFrame
+        window : tuple
+          Límites (t_0, t_1) de y_day
+
+        Returns
+        -------
+        np.ndarray
+        """
+        key = (len(df), window, self.bins_x, self.bins_y, self.hx, self.hy,
+               self.x_min, self.y_min)
+        cached = self.m_cache.get(name)
+        if cached is not None and cached[0] is df and cached[1] == key:
+            return cached[2]
+
+        t = df['y_day'].to_numpy()
+        mask = (window[0] <= t) & (t <= window[1])
+        matrix = af.grid_counts(self.xx, self.yy,
+                                df['x_point'].to_numpy()[mask],
+                                df['y_point'].to_numpy()[mask],
+                                self.hx, self.hy)
+        self.m_cache[name] = (df, key, matrix)
+        return matrix
 
     def load_train_matrix(self):
 
@@ -2004,41 +2202,22 @@ class ProMap:
         Ubica los delitos en la matriz de entrenamiento.
         """
 
-        self.training_matrix = np.zeros((self.bins_x, self.bins_y))
-        for index, row in self.X.iterrows():
-            x, y, t = row['x_point'], row['y_point'], row['y_day']
-
-            if t >= (self.dias_train - self.bw_t):
-                x_pos, y_pos = af.find_position(self.xx, self.yy, x, y,
-                                                self.hx,
-                                                self.hy)
-                self.training_matrix[x_pos][y_pos] += 1
+        self.training_matrix = self.incidents_matrix(
+            'train', self.X, (self.dias_train - self.bw_t, self.dias_train))
+        return self.training_matrix
 
     def load_test_matrix(self):
 
         """
-        Ubica los delitos en la matriz de testeo
-
-        Parameters
-        ----------
-        ventana_dias: int
-            Cantidad de días que se quieren predecir.
+        Ubica los delitos en la matriz de testeo, considerando los
+        lp días siguientes al entrenamiento.
         """
 
-        self.testing_matrix = np.zeros((self.bins_x, self.bins_y))
-
-        for index, row in self.y.iterrows():
-            x, y, t = row['x_point'], row['y_point'], row['y_day']
-
-            if t <= (self.dias_train + self.lp):
-                x_pos, y_pos = af.find_position(self.xx, self.yy, x, y,
-                                                self.hx,
-                                                self.hy)
-                self.testing_matrix[x_pos][y_pos] += 1
-
-            else:
-                break
+        self.testing_matrix = self.incidents_matrix(
+            'test', self.y, (-np.inf, self.dias_train + self.lp))
+        return self.testing_matrix
 
+    @profiled()
     def calculate_hr(self, c=None, verbose=False):
         """
         Calcula el hr (n/N)
@@ -2096,6 +2275,7 @@ class ProMap:
         self.ap = [1 if j > 1 else j for j in [i / self.cells_in_map for
                                                i in area_hits]]
 
+    @profiled()
     def calculate_pai(self, c=None, verbose=False):
 
         """
@@ -2132,10 +2312,9 @@ class ProMap:
 
     def plot_geopdf(self, dallas, ax, color, label, level):
 
-        geometry = [Point(xy) for xy in zip(
-            np.array(self.y[self.y['captured'] == level][['x_point']]),
-            np.array(self.y[self.y['captured'] == level][['y_point']]))
-                    ]
+        captured = self.y[self.y['captured'] == level]
+        geometry = gpd.points_from_xy(captured['x_point'],
+                                      captured['y_point'])
 
         if self.shps is not None:
             geo_df = gpd.GeoDataFrame(self.y[self.y['captured'] ==
@@ -2157,7 +2336,8 @@ class ProMap:
         plt.legend()
 
     def heatmap(self, c=None, show_score=True, incidences=False,
-                savefig=False, fname=f'Promap_heatmap.png', ap=None, **kwargs):
+                savefig=False, fname=f'Promap_heatmap.png', ap=None,
+                verbose=False, show=True, **kwargs):
         """
         Mostrar un heatmap de una matriz de riesgo.
 
@@ -2169,9 +2349,15 @@ class ProMap:
             nombre del gráfico
         incidentes: bool
             True para mostrar cuntos incidentes se han capturado
+        show: bool
+            False para no llamar a plt.show; la figura queda abierta
         -------
 
         """
+        print('\tPlotting Heatmap...') if verbose else None
+        colors = kwargs.pop('colors', {1: "blue", 2: "lime", 3: "red",
+                                       4: "green"})
+        show_axis = kwargs.pop('show_axis', True)
         if self.shps is not None:
             dallas = self.shps['streets']
         else:
@@ -2191,24 +2377,14 @@ class ProMap:
             if len(c) == 1:
                 c = c[0]
 
-        matriz = None
-
-        if c is None:
-            matriz = self.prediction
-
-        elif type(c) == float or type(c) == np.float64:
-            matriz = np.where(self.prediction >= c, 1, 0)
-        elif type(c) == list or type(c) == np.ndarray:
-
+        if type(c) == list or type(c) == np.ndarray:
             c = np.array(c).flatten()
             c = c[c > 0]
             c = c[c < 1]
             c = np.unique(c)
             c = np.sort(c)
-            matriz = np.zeros((self.bins_x, self.bins_y))
-            for i in c:
-                matriz[self.prediction > i] += 1
-            matriz = matriz / np.max(matriz)
+
+        matriz = af.score_levels(self.prediction, c)
 
         if show_score and c is None:
             # noinspection PyUnresolvedReferences
@@ -2226,8 +2402,6 @@ class ProMap:
 
         if incidences:
 
-            self.y['captured'] = 0
-
             plt.imshow(np.flipud(matriz.T),
                        extent=[self.x_min, self.x_max, self.y_min, self.y_max],
                        cmap='jet',
@@ -2238,50 +2412,40 @@ class ProMap:
             if self.shps is not None:
                 dallas.plot(ax=ax, alpha=0.2, lw=0.3, color="w")
 
+            # Score de cada incidente en una sola pasada; el nivel es el
+            # nº de thresholds superados
+            captured = np.zeros(len(self.y), dtype=int)
+            if c is None:
+                captured[:] = 1
+            else:
+                window = (self.y['y_day'] <=
+                          self.dias_train + self.lp).to_numpy()
+                x_pos, y_pos = af.find_positions(
+                    self.xx, self.yy,
+                    self.y['x_point'].to_numpy()[window],
+                    self.y['y_point'].to_numpy()[window],
+                    self.hx, self.hy)
+                scores = self.prediction[x_pos, y_pos]
+                captured[window] = np.digitize(scores, np.atleast_1d(c))
+            self.y = self.y.assign(captured=captured)
+
             if c is None:
-                self.y['captured'] = 1
                 self.plot_geopdf(dallas, ax, color='lime',
                                  label="Hits", level=1)
 
-            if type(c) == float or type(c) == np.float64:
-                for index, row in self.y.iterrows():
-                    x, y, t = row['x_point'], row['y_point'], row['y_day']
-
-                    if t <= (self.dias_train + self.lp):
-                        x_pos, y_pos = af.find_position(self.xx, self.yy, x, y,
-                                                        self.hx,
-                                                        self.hy)
-                        if self.prediction[x_pos][y_pos] >= c:
-                            self.y['captured'][index] = 1
-                    else:
-                        break
+            elif type(c) == float or type(c) == np.float64:
                 if c != 0.0:
                     self.plot_geopdf(dallas, ax, color='red',
                                      label="Misses", level=0)
                 self.plot_geopdf(dallas, ax, color='lime',
                                  label="Hits", level=1)
 
-            elif type(c) == list or type(c) == np.ndarray:
-                for index_c, c_i in enumerate(c, start=1):
-                    for index, row in self.y.iterrows():
-                        x, y, t = row['x_point'], row['y_point'], row['y_day']
-
-                        if t <= (self.dias_train + self.lp):
-                            x_pos, y_pos = af.find_position(self.xx, self.yy, x,
-                                                            y,
-                                                            self.hx,
-                                                            self.hy)
-                            if self.prediction[x_pos][y_pos] >= c_i:
-                                self.y['captured'][index] = index_c
-                        else:
-                            break
-
+            else:
                 for index in range(len(c) + 1):
-                    self.plot_geopdf(dallas, ax, kwargs['colors'][index + 1],
+                    self.plot_geopdf(dallas, ax, colors[index + 1],
                                      label=f'Level {index + 1}',
                                      level=index)
 
-
         else:
             plt.imshow(np.flipud(matriz.T),
                        extent=[self.x_min, self.x_max, self.y_min, self.y_max],
@@ -2291,10 +2455,11 @@ class ProMap:
                 dallas.plot(ax=ax, alpha=0.2, lw=0.3, color="w")
 
         plt.title('ProMap')
+        ax.set_axis_off() if not show_axis else None
         plt.tight_layout()
         if savefig:
             plt.savefig(fname, **kwargs)
-        plt.show()
+        plt.show() if show else None
 
     def score(self):
 
@@ -2306,6 +2471,89 @@ class ProMap:
         """
         return self.prediction
 
+    def score_grid(self):
+        """
+        Returns
+        -------
+        (np.ndarray, list)
+          Matriz de riesgo (bins_x, bins_y) y su extent
+          [x_min, x_max, y_min, y_max]
+        """
+        return self.prediction, [self.x_min, self.x_max,
+                                 self.y_min, self.y_max]
+
+    def cell_grid(self):
+        """Celdas de self.prediction, centradas en los nodos de la
+        malla y con el espaciado entre nodos como tamaño.
+
+        Returns
+        -------
+        dict
+          x_0, y_0 (esquina inferior izquierda), hx, hy, nx, ny, ver
+          af.cell_index
+        """
+        s_x = (self.xx[-1, 0] - self.xx[0, 0]) / max(self.bins_x - 1, 1)
+        s_y = (self.yy[0, -1] - self.yy[0, 0]) / max(self.bins_y - 1, 1)
+        return {'x_0': self.xx[0, 0] - self.hx / 2,
+                'y_0': self.yy[0, 0] - self.hy / 2,
+                'hx': s_x, 'hy': s_y, 'nx': self.bins_x, 'ny': self.bins_y}
+
+    def cell_ids(self, x, y):
+        """Celda de cada punto, como índice en self.prediction.ravel().
+        Igual que af.find_positions, pero sin asignar los puntos fuera
+        de la malla a la celda del borde.
+
+        Returns
+        -------
+        np.ndarray
+          -1 para los puntos fuera de la malla
+        """
+        return af.cell_index(x, y, **self.cell_grid())
+
+    def score_points(self, x, y, t=None, exact=False):
+        """Score normalizado de los puntos (x, y). t se ignora: la
+        densidad de ProMap es la de la ventana de predicción.
+
+        Parameters
+        ----------
+        x : np.ndarray
+        y : np.ndarray
+        t : None
+        exact : bool
+          False lee el score de la celda de cada punto (nan fuera de la
+          malla). True evalúa la densidad en el punto, con la misma
+          normalización que la malla
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if not exact:
+            return af.gather(np.asarray(self.prediction).ravel(),
+                             self.cell_ids(x, y))
+        args = (self.X['x_point'].to_numpy(dtype=float),
+                self.X['y_point'].to_numpy(dtype=float),
+                self.X['y_day'].to_numpy(), self.dias_train,
+                self.hx, self.hy, self.bw_x, self.bw_y)
+        # Los modelos guardados antes de d_max no lo tienen
+        if getattr(self, 'd_max', None) is None:
+            self.d_max = af.promap_density(self.xx, self.yy, *args).max()
+        return af.promap_points(x, y, self.xx, self.yy, *args) / self.d_max
+
+    def test_scores(self):
+        """Coordenadas y score de los incidentes de testeo.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray, np.ndarray)
+        """
+        y = self.y[self.y['y_day'] <= self.dias_train + self.lp]
+        x_p, y_p = y['x_point'].to_numpy(), y['y_point'].to_numpy()
+        x_pos, y_pos = af.find_positions(self.xx, self.yy, x_p, y_p,
+                                         self.hx, self.hy)
+        return x_p, y_p, self.prediction[x_pos, y_pos]
+
+    @profiled()
     def validate(self, c=0, ap=None, verbose=False):
 
         self.load_test_matrix()
@@ -2358,14 +2606,37 @@ class ProMap:
 
 
 class Model:
-    def __init__(self, models=None, data=None, shps=None, verbose=False):
-        """Supraclase Model"""
+    def __init__(self, models=None, data=None, shps=None, crs=2276,
+                 verbose=False):
+        """Supraclase Model
+
+        Parameters
+        ----------
+        crs
+          crs de las coordenadas x, y de data
+        """
         self.models = [] if not models else models
         self.data = data
         self.shps = shps
+        self.crs = crs
+        self.incidents = None
 
         self.set_parameters()
 
+    def incident_index(self):
+        """Índice por fecha de self.data. Se reconstruye solo si
+        self.data es reemplazado.
+
+        Returns
+        -------
+        IncidentIndex
+        """
+        if self.incidents is None or self.incidents[0] is not self.data:
+            self.incidents = (self.data,
+                              IncidentIndex.from_frame(self.data))
+        return self.incidents[1]
+
+    @profiled()
     def prepare_stkde(self):
         """
 
@@ -2376,11 +2647,10 @@ class Model:
         stkde = list(filter(lambda m: m.name == "STKDE", self.models))[0]
 
         data = self.data.copy(deep=True)
-        geometry = [Point(xy) for xy in zip(np.array(data[['x']]),
-                                            np.array(data[['y']]))]
+        geometry = gpd.points_from_xy(data['x'], data['y'])
 
         if self.shps is not None:
-            data = gpd.GeoDataFrame(data, crs=2276, geometry=geometry)
+            data = gpd.GeoDataFrame(data, crs=self.crs, geometry=geometry)
             #Paso de sistema de pies a metros
             data.to_crs(epsg=3857, inplace=True)
         else:
@@ -2397,25 +2667,22 @@ class Model:
         # data.reset_index(drop=True, inplace=True)
 
         # División en training data (X_train) y testing data (y)
-        X_train = data[data["date"] < stkde.start_prediction]
-        X_test = data[data["date"] >= stkde.start_prediction]
-        X_test = X_test[
-            X_test["date"] < stkde.start_prediction
-            + timedelta(days=stkde.lp)]
+        index = self.incident_index()
+        X_train = index.take(data, None, stkde.start_prediction)
+        X_test = index.take(data, stkde.start_prediction,
+                            stkde.start_prediction + timedelta(days=stkde.lp))
         return X_train, X_test
 
+    @profiled()
     def prepare_promap(self):
         promap = list(filter(lambda m: m.name == "ProMap", self.models))[0]
         df = self.data.copy(deep=True)
         # print("\nGenerando dataframe...")
 
-        geometry = [Point(xy) for xy in zip(
-            np.array(df[['x']]),
-            np.array(df[['y']]))
-                    ]
+        geometry = gpd.points_from_xy(df['x'], df['y'])
 
         if self.shps is not None:
-            geo_data = gpd.GeoDataFrame(df, crs=2276, geometry=geometry)
+            geo_data = gpd.GeoDataFrame(df, crs=self.crs, geometry=geometry)
             geo_data.to_crs(epsg=3857, inplace=True)
         else:
             geo_data = gpd.GeoDataFrame(df, geometry=geometry)
@@ -2429,12 +2696,14 @@ class Model:
 
         # División en training y testing data
 
-        X = df[df["date"] < promap.start_prediction]
-        y = df[df["date"] >= promap.start_prediction]
-        y = y[y["date"] < promap.start_prediction + timedelta(days=promap.lp)]
+        index = self.incident_index()
+        X = index.take(df, None, promap.start_prediction)
+        y = index.take(df, promap.start_prediction,
+                       promap.start_prediction + timedelta(days=promap.lp))
 
         return X, y
 
+    @profiled()
     def prepare_rfr(self, mode='train', label='default', verbose=False):
         """Prepara el set de datos correspondiente para entrenar RFR y
         predecir para un set dado
@@ -2450,7 +2719,7 @@ class Model:
             labels asociadas
         Returns
         -------
-        (pd.DataFrame, pd.DataFrame)
+        ({np.ndarray, sp.csr_matrix}, np.ndarray)
         """
         # y en 'label_weights' es una sola columna que corresponde a la
         # suma ponderada de las columnas (considerar division por número
@@ -2464,59 +2733,33 @@ class Model:
             rfr.generate_X(verbose)
 
         if mode == 'train':
-            # print("\nPreparing Training Data for RFR...")
             # First three weeks of October
-            X = rfr.X.loc[
-                :,
-                reduce(lambda a, b: a + b,
-                       [[(f'Incidents_{i}', week)]
-                        for i in range(rfr.n_layers)
-                        for week in rfr.weeks[:-2]]
-                       )
-                ]
-            # Last week of October
-            # y = self.model.X_train.loc[:, [('Incidents_0', self.model.weeks[-2])]]
-            y = rfr.X.loc[
-                :, [(f'Incidents_{i}', rfr.weeks[-2])
-                    for i in range(rfr.n_layers)]
-                ]
-            if label == 'default':
-                # Cualquier valor != 0 en la fila produce que la celda sea
-                # 'Dangerous' = 1
-                y[('Dangerous', '')] = y.T.any().astype(int)
-            else:
-                if rfr.l_weights is not None:
-                    w = rfr.l_weights
-                else:
-                    w = np.array([1 / (l + 1)
-                                  for l in range(rfr.n_layers)])
-                y[('Dangerous', '')] = y.dot(w)  # Ponderación con los pesos
-            y = y[('Dangerous', '')]  # Hace el .drop() del resto de las cols
-
+            f_weeks, l_week = rfr.weeks[:-2], rfr.weeks[-2]
         else:
-            # print("Preparing Testing Data for RFR...")
-            X = rfr.X.loc[  # Nos movemos una semana adelante
-                :,
-                reduce(lambda a, b: a + b,
-                       [[(f'Incidents_{i}', week)]
-                        for i in range(rfr.n_layers)
-                        for week in rfr.weeks[1:-1]]
-                       )
-                ]
-            y = rfr.X.loc[
-                :, [(f'Incidents_{i}', rfr.weeks[-1])
-                    for i in range(rfr.n_layers)]
-                ]
-            if label == 'default':
-                y[('Dangerous', '')] = y.T.any().astype(int)
+            # Nos movemos una semana adelante
+            f_weeks, l_week = rfr.weeks[1:-1], rfr.weeks[-1]
+
+        # Con out_of_core X es un FeatureView sobre el memmap: las filas
+        # se leen por bloques al entrenar/predecir
+        X = rfr.X.select([(f'Incidents_{i}', week)
+                          for i in range(rfr.n_layers)
+                          for week in f_weeks], lazy=rfr.out_of_core)
+        # Last week of October
+        y = rfr.X.select([(f'Incidents_{i}', l_week)
+                          for i in range(rfr.n_layers)])
+        if sp.issparse(y):
+            y = y.toarray()
+        if label == 'default':
+            # Cualquier valor != 0 en la fila produce que la celda sea
+            # 'Dangerous' = 1
+            y = y.any(axis=1).astype(int)
+        else:
+            if rfr.l_weights is not None:
+                w = rfr.l_weights
             else:
-                if rfr.l_weights is not None:
-                    w = rfr.l_weights
-                else:
-                    w = np.array([1 / (l + 1)
-                                  for l in range(rfr.n_layers)])
-                y[('Dangerous', '')] = y.dot(w)
-            y = y[('Dangerous', '')]
+                w = np.array([1 / (l + 1)
+                              for l in range(rfr.n_layers)])
+            y = y.dot(w)  # Ponderación con los pesos
         return X, y
 
     def prepare_data(self, verbose=False):
@@ -2528,8 +2771,6 @@ class Model:
             elif m.name == 'ProMap':
                 dict_['ProMap'] = self.prepare_promap()
             else:  # RFR
-                if m.read_X:
-                    m.X = pd.read_pickle('predictivehp/data/X.pkl')
                 dict_['RForestRegressor'] = self.prepare_rfr(verbose=verbose)
         return dict_
 
@@ -2556,8 +2797,7 @@ class Model:
                     m.set_parameters(t_history=4,
                                      xc_size=100, yc_size=100, n_layers=7,
                                      label_weights=None,
-                                     read_data=False, read_X=False,
-                                     w_data=True, w_X=True)
+                                     use_cache=True, sparse=False)
         else:
             for m in self.models:
                 if m.name == m_name:
@@ -2573,20 +2813,34 @@ class Model:
         for m in self.models:
             m.print_parameters()
 
+    @profiled()
     def fit(self, data_p=None, verbose=False, **kwargs):
         if data_p is None:
             data_p = self.prepare_data(verbose=verbose)
         for m in self.models:
             m.fit(*data_p[m.name], verbose=verbose, **kwargs)
 
-    def predict(self, verbose=False):
+    @profiled()
+    def predict(self, verbose=False, sharded=False, n_jobs=None):
+        """
+        Parameters
+        ----------
+        verbose : bool
+        sharded : bool
+          True para predecir cada modelo por distrito en paralelo y unir
+          los resultados en una sola superficie (ver _shard.py)
+        n_jobs : int
+          None usa get_config()['n_jobs']
+        """
         for m in self.models:
             if m.name == 'RForestRegressor':
                 X_test = self.prepare_rfr(mode='test', label='default')[0]
-                m.predict(X_test)
+                m.predict(X_test, verbose=verbose, sharded=sharded,
+                          n_jobs=n_jobs)
                 continue
-            m.predict(verbose=verbose)
+            m.predict(verbose=verbose, sharded=sharded, n_jobs=n_jobs)
 
+    @profiled()
     def validate(self, c=None, ap=None, verbose=False):
         """
         Calcula la cantidad de incidentes detectados para los hotspots
@@ -2624,8 +2878,59 @@ class Model:
         for m in self.models:
             print(f"{m.name}: {m.pai_validated}")
 
+    def hotspots(self, ap=None, c=None):
+        """Polígonos del hotspot de cada modelo para un area percentage
+        ap o un umbral de score c, ver HotspotIndex.polygons.
+
+        Returns
+        -------
+        dict
+          {nombre del modelo: gpd.GeoDataFrame}
+        """
+        return {m.name: hotspot_index(m).polygons(ap, c)
+                for m in self.models}
+
     def store(self, file_name='model.data'):
-        pass
+        """Guarda el estado ajustado de cada modelo (kde de STKDE, forest
+        de RFR, matriz de densidades de ProMap, mallas, etc.) en el
+        directorio file_name, para luego recuperarlo con Model.load sin
+        tener que reentrenar.
+
+        Parameters
+        ----------
+        file_name : str
+          Directorio donde se guardan los modelos
+        """
+        os.makedirs(file_name, exist_ok=True)
+        manifest = {'version': STORE_VERSION, 'models': []}
+        for m in self.models:
+            store_model(m, os.path.join(file_name, m.name))
+            manifest['models'].append({'name': m.name})
+        with open(os.path.join(file_name, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def load(cls, file_name='model.data', data=None, shps=None):
+        """Carga los modelos guardados con Model.store. Cada modelo se
+        deserializa recién cuando se accede a él.
+
+        Parameters
+        ----------
+        file_name : str
+        data : pd.DataFrame
+        shps : dict
+
+        Returns
+        -------
+        Model
+        """
+        with open(os.path.join(file_name, 'manifest.json')) as f:
+            manifest = json.load(f)
+        m = cls(data=data, shps=shps)
+        m.models = [StoredModel(d['name'], os.path.join(file_name, d['name']),
+                                shps=shps)
+                    for d in manifest['models']]
+        return m
 
     # def plot_heatmap(self, c=0, show_score=True, incidences=False,
     #                  savefig=False, fname='', **kwargs):
@@ -2652,7 +2957,8 @@ class Model:
 
 def create_model(data=None, shps=None,
                  start_prediction=date(2017, 11, 1), length_prediction=7,
-                 use_stkde=False, use_promap=False, use_rfr=False):
+                 use_stkde=False, use_promap=False, use_rfr=False,
+                 crs=2276):
     """
 
     Parameters
@@ -2664,12 +2970,14 @@ def create_model(data=None, shps=None,
     use_stkde
     use_promap
     use_rfr
+    crs
+      crs de las coordenadas x, y de data
 
     Returns
     -------
     Model
     """
-    m = Model(data=data.copy(deep=True))
+    m = Model(data=data.copy(deep=True), crs=crs)
     m.shps = shps
 
     if use_promap:
@@ -2680,8 +2988,8 @@ def create_model(data=None, shps=None,
     if use_rfr:
         rfr = RForestRegressor(data_0=data.copy(deep=True), shps=shps,
                                start_prediction=start_prediction,
-                               length_prediction=length_prediction
-                               )
+                               length_prediction=length_prediction,
+                               crs=crs)
         m.add_model(rfr)
     if use_stkde:
         stkde = STKDE(data=data.copy(deep=True), shps=shps,
@@ -0,0 +1,70 @@
+"""
+_regressors.py
+
+Backends del regressor de RForestRegressor. Las features son conteos
+enteros de incidentes, con pocos valores distintos, por lo que el
+binning de HistGradientBoostingRegressor no pierde información y su
+entrenamiento escala mejor que el del random forest en mallas grandes.
+"""
+
+REGRESSORS = ('rf', 'hgb')
+
+
+def make_regressor(regressor='rf', n_jobs=None):
+    """Regressor sin ajustar para RForestRegressor.
+
+    Parameters
+    ----------
+    regressor : {'rf', 'hgb', sklearn.base.RegressorMixin}
+      'rf' para RandomForestRegressor, 'hgb' para
+      HistGradientBoostingRegressor o un estimador de sklearn, que se
+      clona
+    n_jobs : int
+      Workers del random forest. None usa get_config()['n_jobs']
+
+    Returns
+    -------
+    sklearn.base.RegressorMixin
+    """
+    if not isinstance(regressor, str):
+        from sklearn.base import clone
+
+        return clone(regressor)
+    if regressor == 'rf':
+        from sklearn.ensemble import RandomForestRegressor
+        from predictivehp import get_config
+
+        n_jobs = get_config()['n_jobs'] if n_jobs is None else n_jobs
+        return RandomForestRegressor(n_jobs=n_jobs)
+    if regressor == 'hgb':
+        from sklearn.ensemble import HistGradientBoostingRegressor
+
+        return HistGradientBoostingRegressor(max_bins=255)
+    raise ValueError(f"Unknown regressor '{regressor}', "
+                     f"use one of {REGRESSORS} or a sklearn estimator")
+
+
+def is_forest(estimator):
+    """True si el estimador se puede entrenar por tandas de árboles
+    (ver _streaming.fit_batches)."""
+    from sklearn.ensemble._forest import BaseForest
+
+    return isinstance(estimator, BaseForest)
+
+
+def accepts_sparse(estimator):
+    """False para los estimadores que requieren features densas."""
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    return not isinstance(estimator, HistGradientBoostingRegressor)
+
+
+def accepts_weights(estimator):
+    """True si el fit del estimador recibe sample_weight."""
+    from sklearn.utils.validation import has_fit_parameter
+
+    return has_fit_parameter(estimator, 'sample_weight')
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,101 @@
+"""
+_sampling.py
+
+Submuestreo de las celdas vacías para entrenar RForestRegressor.
+
+La mayoría de las celdas de la malla no registra incidentes en ninguna
+capa ni semana: sus filas de features son todas cero y, como son
+idénticas, los árboles no pueden separarlas. Se conservan todas las
+celdas con alguna feature o label distinta de cero y solo una fracción
+rate de las celdas vacías, con peso 1 / rate, de modo que el regressor
+ajustado estima lo mismo que con todas las celdas.
+"""
+
+import numpy as np
+
+from predictivehp.utils._lazy import lazy_import
+
+sp = lazy_import('scipy.sparse')
+
+
+def make_rng(random_state=None):
+    """Generador para random_state. Con None la semilla se toma del
+    estado global de np.random, por lo que set_seed hace reproducibles
+    las corridas.
+
+    Parameters
+    ----------
+    random_state : {None, int, np.random.Generator}
+
+    Returns
+    -------
+    np.random.Generator
+    """
+    if isinstance(random_state, np.random.Generator):
+        return random_state
+    if random_state is None:
+        random_state = np.random.randint(np.iinfo(np.int32).max)
+    return np.random.default_rng(random_state)
+
+
+def empty_rows(X, batch_size=100_000):
+    """Filas de X sin ningún valor distinto de cero.
+
+    Parameters
+    ----------
+    X : {np.ndarray, sp.csr_matrix, FeatureView}
+    batch_size : int
+      Filas leídas por bloque, para los FeatureView sobre un memmap
+
+    Returns
+    -------
+    np.ndarray
+      Arreglo booleano (n_rows, )
+    """
+    if sp.issparse(X):
+        return sp.csr_matrix(X).getnnz(axis=1) == 0
+    n = X.shape[0]
+    empty = np.empty(n, dtype=bool)
+    for i in range(0, n, batch_size):
+        rows = slice(i, min(i + batch_size, n))
+        empty[rows] = ~np.asarray(X[rows]).any(axis=1)
+    return empty
+
+
+def negative_sample(X, y, rate, random_state=None):
+    """Filas de entrenamiento con las celdas vacías submuestreadas.
+
+    Parameters
+    ----------
+    X : {np.ndarray, sp.csr_matrix, FeatureView}
+    y : np.ndarray
+    rate : float
+      Fracción de las celdas vacías (features y label nulas) que se
+      conserva, en (0, 1]
+    random_state : {None, int, np.random.Generator}
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+      Índices ordenados de las filas conservadas y su peso de
+      importancia
+    """
+    if not 0 < rate <= 1:
+        raise ValueError("rate must be in (0, 1]")
+    y = np.asarray(y).reshape(X.shape[0], -1)
+    negative = empty_rows(X) & ~y.any(axis=1)
+    keep = ~negative
+    neg = np.flatnonzero(negative)
+    n_keep = int(round(rate * neg.size))
+    keep[make_rng(random_state).choice(neg, n_keep, replace=False)] = True
+
+    rows = np.flatnonzero(keep)
+    weights = np.ones(rows.size)
+    # Peso efectivo: n_neg / n_keep, exacto aunque rate * n_neg no sea
+    # entero
+    weights[negative[rows]] = neg.size / max(n_keep, 1)
+    return rows, weights
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,270 @@
+"""
+_shard.py
+
+Predicción por shards. Cada shard se predice en un proceso worker y los
+resultados se unen en una sola superficie, que se normaliza con el
+máximo global.
+
+Cada celda pertenece a un único shard y su score se calcula igual que
+en la predicción sin shards, por lo que la superficie unida coincide con
+ella, también en los bordes entre shards:
+
+- ProMap: la malla se parte en franjas contiguas de filas, que no se
+  traslapan, con una cantidad similar de incidentes cada una. Cada
+  shard recibe solo las filas de su franja y los incidentes que caen
+  en ella o en un halo de ancho bw, fuera del cual el kernel es nulo.
+- STKDE y RForestRegressor: los puntos se reparten según el distrito
+  (polígono de councils) que los contiene.
+  El kernel gaussiano de STKDE no tiene soporte acotado, por lo que
+  cada shard usa todos los incidentes de entrenamiento. Las features de
+  RForestRegressor ya incluyen las capas vecinas, por lo que solo se
+  reparten las filas de X.
+"""
+
+import numpy as np
+
+import predictivehp.utils._aux_functions as af
+from predictivehp._config import check_n_jobs, get_config
+from ._streaming import dedup_predict
+
+
+def strip_labels(i, n_i, n):
+    """Etiquetas para particionar la malla en n franjas verticales,
+    cuando no hay shapefile de distritos.
+
+    Parameters
+    ----------
+    i : np.ndarray
+      Índice en x de cada celda
+    n_i : int
+      Cantidad de celdas en x
+    n : int
+      Cantidad de franjas
+
+    Returns
+    -------
+    np.ndarray
+    """
+    n = max(min(n, n_i), 1)
+    return np.asarray(i, dtype=np.int64) * n // n_i
+
+
+def cell_labels(x, y, i, n_i, shps=None, n_jobs=None):
+    """Shard de cada celda: el distrito que la contiene (o el más
+    cercano) o, sin shapefiles, una franja de la malla por worker.
+
+    Parameters
+    ----------
+    x : np.ndarray
+    y : np.ndarray
+      Coordenadas representativas de cada celda
+    i : np.ndarray
+      Índice en x de cada celda
+    n_i : int
+    shps : dict
+    n_jobs : int
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if shps is not None:
+        return af.polygon_labels(x, y, shps['councils'], use_cache=True)
+    n_jobs = get_config()['n_jobs'] if n_jobs is None else n_jobs
+    return strip_labels(i, n_i, n_jobs if n_jobs > 0 else 1)
+
+
+def row_blocks(p_x, n_i, n):
+    """Parte las filas de la malla en n franjas contiguas con una
+    cantidad similar de incidentes cada una.
+
+    Parameters
+    ----------
+    p_x : np.ndarray
+      Fila de la malla de cada incidente
+    n_i : int
+      Cantidad de filas
+    n : int
+      Cantidad de franjas
+
+    Returns
+    -------
+    list
+      Rangos (i_0, i_1) de filas, que cubren la malla sin traslaparse
+    """
+    n = max(min(n, n_i), 1)
+    q = np.quantile(p_x, np.linspace(0, 1, n + 1)[1:-1]) if p_x.size \
+        else np.linspace(0, n_i, n + 1)[1:-1]
+    edges = np.unique(np.concatenate(
+        [[0], np.clip(np.ceil(q).astype(int), 1, n_i - 1), [n_i]]))
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def promap_shard(task):
+    """Densidad de ProMap en la franja de un shard. Se ejecuta en los
+    procesos worker.
+
+    Parameters
+    ----------
+    task : dict
+      Ver promap_predict
+
+    Returns
+    -------
+    np.ndarray
+    """
+    return af.promap_density(task['c_x'], task['c_y'], task['x'], task['y'],
+                             task['t'], task['dias_train'],
+                             task['hx'], task['hy'],
+                             task['bw_x'], task['bw_y'],
+                             positions=(task['p_x'], task['p_y']))
+
+
+def promap_predict(m, n_jobs=None, verbose=False):
+    """Densidad de ProMap (sin normalizar) calculada por franjas de
+    filas de la malla, una por worker.
+
+    Parameters
+    ----------
+    m : ProMap
+      Modelo ya ajustado
+    n_jobs : int
+      None usa get_config()['n_jobs']
+    verbose : bool
+
+    Returns
+    -------
+    np.ndarray
+      Matriz (bins_x, bins_y)
+    """
+    n_jobs = check_n_jobs(get_config()['n_jobs'] if n_jobs is None
+                          else n_jobs)
+    c_x, c_y = m.xx[:, :1], m.yy[:1, :]
+    x = m.X['x_point'].to_numpy(dtype=float)
+    y = m.X['y_point'].to_numpy(dtype=float)
+    t = m.X['y_day'].to_numpy()
+    p_x, p_y = af.find_positions(c_x, c_y, x, y, m.hx, m.hy)
+    ancho_x = af.radio_pintar(m.hx, m.bw_x)
+    blocks = row_blocks(p_x, m.bins_x, n_jobs)
+
+    tasks = []
+    for i_0, i_1 in blocks:
+        # Halo: incidentes cuyo radio de pintado alcanza la franja. Las
+        # posiciones se entregan relativas a la franja
+        near = (i_0 - ancho_x < p_x) & (p_x < i_1 + ancho_x)
+        tasks.append({'c_x': c_x[i_0:i_1], 'c_y': c_y,
+                      'x': x[near], 'y': y[near], 't': t[near],
+                      'p_x': p_x[near] - i_0, 'p_y': p_y[near],
+                      'dias_train': m.dias_train,
+                      'hx': m.hx, 'hy': m.hy, 'bw_x': m.bw_x,
+                      'bw_y': m.bw_y})
+
+    print(f"\tPredicting {len(tasks)} shards...") if verbose else None
+    parts = af.parallel_map(promap_shard, tasks, n_jobs=n_jobs)
+    return np.concatenate(parts, axis=0)
+
+
+def pdf_shard(task):
+    """Evalúa el kde en los puntos de un shard. Se ejecuta en los
+    procesos worker.
+
+    Parameters
+    ----------
+    task : dict
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if task['times'] is None:
+        return task['kde'].pdf_chunked(task['points'], n_jobs=1)
+    return task['kde'].pdf_cube(task['points'], task['times'], n_jobs=1)
+
+
+def stkde_pdf(m, points, times=None, n_jobs=None, verbose=False):
+    """Densidad del kde de STKDE en points, evaluada por shards.
+
+    Parameters
+    ----------
+    m : STKDE
+      Modelo ya ajustado
+    points : np.ndarray
+      Arreglo (3, n) con x, y, t o, con times, (2, n) con x, y
+    times : np.ndarray
+      Tiempos en que se evalúa cada punto, ver MyKDEMultivariate.pdf_cube
+    n_jobs : int
+    verbose : bool
+
+    Returns
+    -------
+    np.ndarray
+      Arreglo (n,) o, con times, (n, n_t)
+    """
+    x, y = points[0], points[1]
+    i = np.clip(((x - m.x_min) / (m.x_max - m.x_min) * m.n_nodes)
+                .astype(int), 0, m.n_nodes - 1)
+    labels = cell_labels(x, y, i, m.n_nodes, shps=m.shps, n_jobs=n_jobs)
+    shards = [np.flatnonzero(labels == label) for label in np.unique(labels)]
+    tasks = [{'kde': m.kde, 'points': points[:, idx], 'times': times}
+             for idx in shards]
+
+    print(f"\tPredicting {len(tasks)} shards...") if verbose else None
+    parts = af.parallel_map(pdf_shard, tasks, n_jobs=n_jobs)
+
+    f = np.empty(x.size if times is None else (x.size, len(times)))
+    for idx, part in zip(shards, parts):
+        f[idx] = part
+    return f
+
+
+def rfr_shard(task):
+    """Predicción del regressor en las filas de un shard.
+
+    Parameters
+    ----------
+    task : dict
+
+    Returns
+    -------
+    np.ndarray
+    """
+    return dedup_predict(task['rfr'], task['X'], cache=task['cache'])
+
+
+def rfr_predict(m, X, n_jobs=None, verbose=False):
+    """Predicción de RForestRegressor por shards. Los árboles liberan el
+    GIL al predecir, por lo que se usan threads y el regressor y el
+    cache de filas (m.row_cache) no se copian a cada worker.
+
+    Parameters
+    ----------
+    m : RForestRegressor
+    X : {np.ndarray, sp.csr_matrix}
+      Features de las celdas m.X.cells, en ese orden
+    n_jobs : int
+    verbose : bool
+
+    Returns
+    -------
+    np.ndarray
+    """
+    g = m.grid
+    i, j = np.divmod(np.asarray(m.X.cells, dtype=np.int64), g['ny'])
+    labels = cell_labels(g['x_min'] + i * g['hx'], g['y_min'] + j * g['hy'],
+                         i, g['nx'], shps=m.shps, n_jobs=n_jobs)
+    shards = [np.flatnonzero(labels == label) for label in np.unique(labels)]
+    tasks = [{'rfr': m.rfr, 'X': X[idx], 'cache': m.row_cache}
+             for idx in shards]
+
+    print(f"\tPredicting {len(tasks)} shards...") if verbose else None
+    parts = af.parallel_map(rfr_shard, tasks, n_jobs=n_jobs,
+                            backend='threading')
+
+    y_pred = np.empty(X.shape[0])
+    for idx, part in zip(shards, parts):
+        y_pred[idx] = part
+    return y_pred
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,251 @@
+"""
+_store.py
+
+Serialización del estado ajustado de los modelos para reinicios en
+caliente (Model.store / Model.load).
+
+Cada modelo se guarda en su propio directorio:
+
+* state.joblib    : atributos livianos (parámetros, mallas chicas,
+  métricas)
+* <attr>.npy      : arreglos numéricos (mallas, predicciones, scores)
+* <attr>.parquet  : (Geo)DataFrames
+* <attr>/         : FeatureStores
+* forest.joblib, kde.joblib : estimadores ajustados, comprimidos
+
+Los caches de los modelos se guardan vacíos y los atributos derivados
+de otros no se guardan. Al cargar, los arreglos se mapean sin leerlos y
+los dataframes, los estimadores y los atributos derivados se leen o
+reconstruyen recién al primer acceso (ver LazyAttributes).
+"""
+
+import json
+import os
+import shutil
+import uuid
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from predictivehp.utils._index import IncidentIndex
+from predictivehp.utils._lazy import lazy_import
+from ._features import FeatureStore
+
+gpd = lazy_import('geopandas')
+joblib = lazy_import('joblib')
+
+STORE_VERSION = 2
+
+# Atributos que no se serializan (se entregan al momento de cargar)
+EXCLUDE = {'shps'}
+# Caches, que se guardan vacíos
+CACHES = {'row_cache', 'm_cache'}
+# Atributos que se reconstruyen a partir de otros al primer acceso
+DERIVED = {
+    'incidents': lambda m: IncidentIndex.from_frame(m.data, geometry=True),
+}
+# Estimadores ajustados, guardados en archivos propios
+HEAVY = {'rfr': 'forest.joblib', 'kde': 'kde.joblib'}
+
+
+class LazyAttributes:
+    """Base de los modelos: los atributos registrados en self._lazy
+    ({nombre: función que retorna el valor}) se cargan recién al primer
+    acceso.
+    """
+
+    def __getattr__(self, attr):
+        lazy = self.__dict__.get('_lazy')
+        if not lazy or attr not in lazy:
+            raise AttributeError(f"'{type(self).__name__}' object has no "
+                                 f"attribute '{attr}'")
+        value = lazy[attr]()
+        setattr(self, attr, value)
+        del lazy[attr]
+        return value
+
+    def load_lazy(self):
+        """Carga todos los atributos pendientes."""
+        for attr in list(self.__dict__.get('_lazy') or ()):
+            getattr(self, attr)
+
+
+def replace_dir(tmp, path):
+    """Reemplaza el directorio path por tmp. El directorio anterior se
+    renombra antes de borrarlo, por lo que los arreglos mapeados desde
+    él siguen siendo válidos.
+    """
+    old = None
+    if os.path.exists(path):
+        old = f'{path}.old-{uuid.uuid4().hex}'
+        os.replace(path, old)
+    os.replace(tmp, path)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def store_model(m, path):
+    """Guarda el estado del modelo m en el directorio path, reemplazando
+    su contenido. Se escribe primero en un directorio temporal hermano,
+    de modo que se puede guardar un modelo sobre el directorio desde el
+    que se cargó.
+
+    Parameters
+    ----------
+    m : {STKDE, RForestRegressor, ProMap, StoredModel}
+    path : str
+    """
+    if isinstance(m, StoredModel):
+        m = m.model
+    if isinstance(m, LazyAttributes):
+        m.load_lazy()
+    path = os.path.normpath(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmp)
+    try:
+        write_model(m, tmp)
+        replace_dir(tmp, path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def write_model(m, path):
+    """Escribe el estado de m en el directorio vacío path."""
+    state, arrays, frames, stores, derived = {}, {}, {}, [], []
+    for attr, value in vars(m).items():
+        if attr in EXCLUDE or attr == '_lazy':
+            continue
+        if attr in CACHES:
+            state[attr] = {}
+        elif attr in DERIVED:
+            if value is not None:
+                derived.append(attr)
+        elif attr in HEAVY and value is not None:
+            joblib.dump(value, os.path.join(path, HEAVY[attr]), compress=3)
+        elif isinstance(value, FeatureStore):
+            s_arrays, meta = value.to_arrays()
+            s_path = os.path.join(path, attr)
+            os.makedirs(s_path)
+            for name, a in s_arrays.items():
+                np.save(os.path.join(s_path, f'{name}.npy'), a)
+            with open(os.path.join(s_path, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            stores.append(attr)
+        elif isinstance(value, pd.DataFrame):
+            value.to_parquet(os.path.join(path, f'{attr}.parquet'))
+            # parquet lee las columnas de texto como str
+            frames[attr] = {
+                'geo': isinstance(value, gpd.GeoDataFrame),
+                'objects': [c for c in value.columns
+                            if value[c].dtype == object]}
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            arrays[attr] = value
+        else:
+            state[attr] = value
+
+    for attr, a in arrays.items():
+        np.save(os.path.join(path, f'{attr}.npy'), a)
+    joblib.dump({'class': type(m).__name__, 'version': STORE_VERSION,
+                 'state': state, 'arrays': list(arrays), 'frames': frames,
+                 'stores': stores, 'derived': derived},
+                os.path.join(path, 'state.joblib'), compress=3)
+
+
+def read_frame(f_name, geo=False, objects=()):
+    df = gpd.read_parquet(f_name) if geo else pd.read_parquet(f_name)
+    return df.astype({c: 'object' for c in objects}) if objects else df
+
+
+def load_model(path, shps=None, mmap_mode='r'):
+    """Reconstruye un modelo guardado con store_model. Los dataframes,
+    los estimadores y los atributos derivados se cargan al primer
+    acceso.
+
+    Parameters
+    ----------
+    path : str
+    shps : dict
+      Shapefiles a asociar al modelo
+    mmap_mode : str
+      Se entrega a np.load para los arreglos del modelo
+
+    Returns
+    -------
+    {STKDE, RForestRegressor, ProMap}
+    """
+    from ._models import STKDE, RForestRegressor, ProMap
+
+    classes = {c.__name__: c for c in (STKDE, RForestRegressor, ProMap)}
+    d = joblib.load(os.path.join(path, 'state.joblib'))
+    if d.get('version') != STORE_VERSION:
+        raise ValueError(f"{path} was stored with an incompatible version "
+                         f"({d.get('version', 1)}), store it again")
+
+    m = classes[d['class']].__new__(classes[d['class']])
+    m.__dict__.update(d['state'])
+    m.shps = shps
+    lazy = {}
+    for attr in d['arrays']:
+        setattr(m, attr, np.load(os.path.join(path, f'{attr}.npy'),
+                                 mmap_mode=mmap_mode))
+    for attr in d['stores']:
+        s_path = os.path.join(path, attr)
+        with open(os.path.join(s_path, 'meta.json')) as f:
+            meta = json.load(f)
+        s_arrays = {f[:-4]: np.load(os.path.join(s_path, f),
+                                    mmap_mode=mmap_mode)
+                    for f in os.listdir(s_path) if f.endswith('.npy')}
+        setattr(m, attr, FeatureStore.from_arrays(s_arrays, meta))
+    for attr, kwargs in d['frames'].items():
+        lazy[attr] = partial(read_frame,
+                             os.path.join(path, f'{attr}.parquet'), **kwargs)
+    for attr, f_name in HEAVY.items():
+        if os.path.isfile(os.path.join(path, f_name)):
+            lazy[attr] = partial(joblib.load, os.path.join(path, f_name))
+    for attr in d['derived']:
+        lazy[attr] = partial(DERIVED[attr], m)
+    m._lazy = lazy
+    return m
+
+
+class StoredModel:
+    def __init__(self, name, path, shps=None):
+        """Modelo almacenado que se deserializa recién al primer acceso
+        a alguno de sus atributos. Permite que un servicio que solo usa
+        ProMap no cargue, por ejemplo, el forest de RForestRegressor.
+
+        Parameters
+        ----------
+        name : str
+          Nombre del modelo
+        path : str
+          Directorio generado por store_model
+        shps : dict
+        """
+        self.__dict__.update(name=name, path=path, shps=shps, _model=None)
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.__dict__['_model'] = load_model(self.path, self.shps)
+        return self._model
+
+    def __getattr__(self, attr):
+        return getattr(self.model, attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.model, attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f'StoredModel({self.name!r}, {state})'
+
+
+if __name__ == '__main__':
+    pass
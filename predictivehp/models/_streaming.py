@@ -0,0 +1,224 @@
+"""
+_streaming.py
+
+Entrenamiento y predicción de RForestRegressor por bloques de celdas,
+para features que no caben en memoria (ver FeatureStore.from_counts con
+path y FeatureView).
+
+El forest se entrena por tandas de árboles con warm_start: la malla se
+reparte al azar en bloques de celdas y cada tanda se ajusta sobre uno de
+ellos, de modo que solo el bloque en curso (con las columnas
+seleccionadas) reside en memoria. El forest final promedia árboles
+entrenados sobre todos los bloques, como un bagging con submuestras
+disjuntas. Los regressors que no son forests no se pueden entrenar por
+bloques.
+
+Al predecir, cada fila distinta de features se evalúa una sola vez: la
+mayoría de las celdas tiene todas sus features en cero, por lo que las
+filas únicas son pocas. Las predicciones se guardan en un cache indexado
+por el dtype, el nº de columnas y los bytes de la fila, que se reutiliza
+entre bloques y entre predicciones sucesivas hasta que el modelo se
+vuelve a ajustar.
+"""
+
+import numpy as np
+
+import predictivehp.utils._aux_functions as af
+from predictivehp import get_config
+from predictivehp.utils._lazy import lazy_import
+from ._regressors import is_forest
+from ._sampling import make_rng
+
+sp = lazy_import('scipy.sparse')
+
+
+def batch_rows(n_cols, itemsize, memory_limit=None):
+    """Filas por bloque que caben en memory_limit: cada fila se lee como
+    enteros y sklearn la convierte a float32.
+
+    Parameters
+    ----------
+    n_cols : int
+    itemsize : int
+      Bytes por valor de la matriz de features
+    memory_limit : int
+      None usa get_config()['memory_limit']
+
+    Returns
+    -------
+    int
+    """
+    memory_limit = get_config()['memory_limit'] if memory_limit is None \
+        else memory_limit
+    per_row = n_cols * (itemsize + 4) + 64  # + índices y nodos del árbol
+    return int(max(memory_limit // per_row, 1))
+
+
+def fit_batches(forest, X, y, rows=None, sample_weight=None,
+                batch_size=None, random_state=None, verbose=False):
+    """Entrena forest por tandas de árboles, una por bloque de filas.
+
+    Parameters
+    ----------
+    forest : sklearn.ensemble.BaseForest
+      Forest con warm_start. Sus n_estimators se reparten entre los
+      bloques, por lo que debe tener al menos un árbol por bloque
+    X : {np.ndarray, FeatureView}
+    y : np.ndarray
+    rows : np.ndarray
+      Filas de X con las que se entrena. None usa todas
+    sample_weight : np.ndarray
+      Peso de cada una de las filas rows
+    batch_size : int
+      Filas por bloque. None las calcula con batch_rows
+    random_state : {None, int, np.random.Generator}
+      Semilla de la partición en bloques, ver make_rng
+    verbose : bool
+
+    Returns
+    -------
+    forest
+
+    Raises
+    ------
+    ValueError
+      Si forest no es un forest o si tiene menos árboles que bloques
+      (cada bloque excedería batch_size)
+    """
+    if not is_forest(forest):
+        raise ValueError(f"out_of_core training needs a forest with "
+                         f"warm_start and n_estimators, got "
+                         f"{type(forest).__name__}")
+    rows = np.arange(X.shape[0]) if rows is None else np.asarray(rows)
+    n = rows.size
+    y = np.asarray(y).ravel()
+    if batch_size is None:
+        batch_size = batch_rows(X.shape[1], X.dtype.itemsize)
+
+    def fit(pick):
+        pick.sort()  # Lectura secuencial del memmap
+        kwargs = {} if sample_weight is None \
+            else {'sample_weight': np.asarray(sample_weight)[pick]}
+        return forest.fit(X[rows[pick]], y[rows[pick]], **kwargs)
+
+    n_trees = forest.get_params()['n_estimators']
+    n_batches = int(max(np.ceil(n / batch_size), 1))
+    if n_batches > n_trees:
+        raise ValueError(f"{n} rows in batches of {batch_size} need "
+                         f"{n_batches} trees, the forest has {n_trees}: "
+                         f"increase n_estimators, batch_size or "
+                         f"memory_limit")
+
+    rng = make_rng(random_state)
+    blocks = np.array_split(rng.permutation(n), n_batches)
+    sizes = np.diff(np.linspace(0, n_trees, n_batches + 1).round()) \
+        .astype(int)
+
+    print(f"\tFitting {n_trees} trees in {n_batches} batches...") \
+        if verbose else None
+    trained = 0
+    for k, (pick, size) in enumerate(zip(blocks, sizes)):
+        trained += size
+        forest.set_params(warm_start=k > 0, n_estimators=trained)
+        fit(pick)
+    forest.set_params(warm_start=False)
+    return forest
+
+
+def unique_rows(X):
+    """Filas distintas de una matriz densa.
+
+    Parameters
+    ----------
+    X : np.ndarray
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray, np.ndarray)
+      Bytes de cada fila única (dtype void), índice de su primera
+      aparición en X y, para cada fila de X, su posición entre las
+      únicas
+    """
+    X = np.ascontiguousarray(X)
+    rows = X.view(np.dtype((np.void, X.dtype.itemsize * X.shape[1])))
+    return np.unique(rows.ravel(), return_index=True, return_inverse=True)
+
+
+def dedup_predict(estimator, X, cache=None):
+    """Predice cada fila distinta de X una sola vez.
+
+    Parameters
+    ----------
+    estimator
+      Regressor ya ajustado
+    X : {np.ndarray, sp.csr_matrix}
+    cache : dict
+      {(dtype, nº de columnas, bytes de la fila): predicción}. Se
+      consulta y se actualiza con las filas nuevas. Debe vaciarse al
+      reajustar el estimador
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if sp.issparse(X):
+        X = X.toarray()
+    keys, first, inverse = unique_rows(X)
+    u_pred = np.empty(keys.size)
+    if cache is None:
+        miss = np.arange(keys.size)
+    else:
+        # Los mismos bytes son otra fila con otro dtype o nº de columnas
+        layout = (X.dtype.str, X.shape[1])
+        keys = [layout + (k.tobytes(),) for k in keys]
+        hits = [cache.get(k) for k in keys]
+        miss = np.array([i for i, h in enumerate(hits) if h is None],
+                        dtype=np.int64)
+        found = np.setdiff1d(np.arange(len(keys)), miss)
+        u_pred[found] = [hits[i] for i in found]
+    if miss.size:
+        u_pred[miss] = estimator.predict(X[first[miss]])
+        if cache is not None:
+            cache.update(zip([keys[i] for i in miss], u_pred[miss].tolist()))
+    return u_pred[inverse.ravel()]
+
+
+def predict_batches(estimator, X, batch_size=None, n_jobs=None, cache=None):
+    """Predicción por bloques contiguos de filas, evaluando cada fila
+    distinta una sola vez (ver dedup_predict).
+
+    Parameters
+    ----------
+    estimator
+      Regressor ya ajustado
+    X : {np.ndarray, sp.csr_matrix, FeatureView}
+    batch_size : int
+      None usa batch_rows
+    n_jobs : int
+      Bloques predichos en paralelo (threads, los árboles liberan el
+      GIL). None usa get_config()['n_jobs']
+    cache : dict
+      Cache de predicciones por fila compartido por los bloques
+
+    Returns
+    -------
+    np.ndarray
+    """
+    n = X.shape[0]
+    if batch_size is None:
+        n_jobs = get_config()['n_jobs'] if n_jobs is None else n_jobs
+        batch_size = max(batch_rows(X.shape[1], X.dtype.itemsize) //
+                         max(n_jobs, 1), 1)
+    y_pred = np.empty(n)
+
+    def block(rows):
+        y_pred[rows] = dedup_predict(estimator, X[rows], cache=cache)
+
+    af.parallel_map(block, [slice(i, min(i + batch_size, n))
+                            for i in range(0, n, batch_size)],
+                    n_jobs=n_jobs, backend='threading')
+    return y_pred
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,9 @@
+from ._service import ScoringService
+from ._service import LatencyStats
+from ._client import InProcessClient
+
+__all__ = [
+    'ScoringService',
+    'LatencyStats',
+    'InProcessClient',
+]
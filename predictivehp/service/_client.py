@@ -0,0 +1,76 @@
+"""
+_client.py
+
+Cliente en proceso del servicio de scoring: serializa cada petición y
+respuesta a JSON, igual que un transporte de red, pero llama directamente
+a ScoringService.handle. Sirve para probar el servicio localmente y para
+medir su latencia sin red.
+"""
+
+import json
+
+import numpy as np
+
+
+class InProcessClient:
+    def __init__(self, service):
+        """
+        Parameters
+        ----------
+        service : ScoringService
+          Servicio ya iniciado
+        """
+        self.service = service
+
+    async def request(self, route, **payload):
+        """
+        Parameters
+        ----------
+        route : str
+        payload
+          Campos de la petición, ver ScoringService.handle
+
+        Returns
+        -------
+        dict
+        """
+        payload = json.loads(json.dumps(payload, default=_to_json))
+        response = json.loads(json.dumps(
+            await self.service.handle(route, payload)))
+        if response.pop('status') != 200:
+            raise RuntimeError(response['error'])
+        return response
+
+    async def score(self, model, x, y, t=None, exact=False):
+        """
+        Returns
+        -------
+        np.ndarray
+        """
+        r = await self.request('score', model=model, x=x, y=y, t=t,
+                               exact=exact)
+        return np.asarray(r['scores'], dtype=float)
+
+    async def hotspots(self, model, ap=None, c=None, polygons=False):
+        """
+        Returns
+        -------
+        dict
+        """
+        return await self.request('hotspots', model=model, ap=ap, c=c,
+                                  polygons=polygons)
+
+    async def stats(self):
+        return await self.request('stats')
+
+
+def _to_json(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+
+if __name__ == '__main__':
+    pass
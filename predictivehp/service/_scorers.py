@@ -0,0 +1,45 @@
+"""
+_scorers.py
+
+Celdas hotspot de los modelos ajustados para el servicio de scoring. El
+score de puntos usa directamente score_points de cada modelo.
+"""
+
+import json
+
+from predictivehp.models import hotspot_index
+
+
+def hotspot_cells(m, ap=None, c=None, polygons=False):
+    """Celdas del hotspot de m para un area percentage ap o un umbral c,
+    leídas del HotspotIndex del modelo.
+
+    Parameters
+    ----------
+    m : {STKDE, ProMap, RForestRegressor}
+    ap : float
+      Area percentage, en [0, 1]
+    c : float
+      Umbral de score, se usa si ap es None
+    polygons : bool
+      True para agregar los polígonos del hotspot como GeoJSON
+
+    Returns
+    -------
+    dict
+      i, j (índices en la malla de score_grid), score, ordenados de
+      mayor a menor score, threshold (score de la última celda) y, con
+      polygons, geojson
+    """
+    index = hotspot_index(m)
+    cells = index.cells(ap, c)
+    ans = {'i': cells['i'].to_numpy(), 'j': cells['j'].to_numpy(),
+           'score': cells['score'].to_numpy(),
+           'threshold': index.threshold(ap, c)}
+    if polygons:
+        ans['geojson'] = json.loads(index.polygons(ap, c).to_json())
+    return ans
+
+
+if __name__ == '__main__':
+    pass
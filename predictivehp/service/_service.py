@@ -0,0 +1,336 @@
+"""
+_service.py
+
+Servicio de scoring asíncrono (asyncio) sobre un Model ajustado. El
+modelo se carga una sola vez y las peticiones concurrentes de score de
+cada modelo se agrupan en micro-batches: la primera petición de un batch
+espera a lo más max_delay segundos a que lleguen otras, y todas se
+evalúan en una sola llamada a score_points del modelo, fuera del event
+loop. Las coordenadas están en el sistema de cada modelo (EPSG:3857
+para ProMap y RForestRegressor con shapefiles, el de los datos para
+STKDE).
+
+    >>> async with ScoringService.load('model.data') as service:
+    ...     s = await service.score('ProMap', x, y)
+    ...     h = await service.hotspots('ProMap', ap=0.01)
+    ...     service.stats()
+
+handle(route, payload) expone las mismas operaciones con payloads
+serializables a JSON, para montarlas sobre cualquier transporte (ver
+InProcessClient).
+"""
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ._scorers import hotspot_cells
+
+
+class LatencyStats:
+    def __init__(self, maxlen=10_000):
+        """Latencias de las últimas maxlen peticiones de cada ruta.
+
+        Parameters
+        ----------
+        maxlen : int
+        """
+        self.samples = defaultdict(lambda: deque(maxlen=maxlen))
+        self.counts = defaultdict(int)
+
+    def add(self, route, seconds):
+        self.samples[route].append(seconds)
+        self.counts[route] += 1
+
+    def percentiles(self, q=(50, 90, 99)):
+        """
+        Parameters
+        ----------
+        q : tuple
+          Percentiles a reportar
+
+        Returns
+        -------
+        dict
+          {ruta: {'count', 'p50', ..., 'max'}}, latencias en ms
+        """
+        ans = {}
+        for route, s in self.samples.items():
+            s = np.asarray(s) * 1e3
+            ans[route] = {'count': self.counts[route],
+                          **{f'p{p}': float(np.percentile(s, p)) for p in q},
+                          'max': float(s.max())}
+        return ans
+
+
+class _Request:
+    __slots__ = ('x', 'y', 't', 'future')
+
+    def __init__(self, x, y, t, future):
+        self.x, self.y, self.t, self.future = x, y, t, future
+
+
+class _Batcher:
+    def __init__(self, model, exact, executor, max_batch, max_delay):
+        """Agrupa las peticiones de score de un modelo con el mismo
+        exact y con o sin t."""
+        self.model, self.exact, self.executor = model, exact, executor
+        self.max_batch, self.max_delay = max_batch, max_delay
+        self.queue = asyncio.Queue()
+        self.n_batches, self.n_points = 0, 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        await self.queue.put(None)
+        await self.task
+
+    async def submit(self, x, y, t):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(_Request(x, y, t, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            r = await self.queue.get()
+            if r is None:
+                break
+            batch, size = [r], r.x.size
+            deadline = loop.time() + self.max_delay
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    r = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if r is None:
+                    closing = True
+                    break
+                batch.append(r)
+                size += r.x.size
+            try:
+                await self.flush(batch)
+            except Exception as e:
+                # Un batch con errores no debe detener el loop: las
+                # peticiones siguientes quedarían esperando para siempre
+                for r in batch:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+
+    async def flush(self, batch):
+        x = np.concatenate([r.x for r in batch])
+        y = np.concatenate([r.y for r in batch])
+        t = None if batch[0].t is None \
+            else np.concatenate([r.t for r in batch])
+        try:
+            out = await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: self.model.score_points(
+                    x, y, t, exact=self.exact))
+        except Exception as e:
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+            return
+        self.n_batches += 1
+        self.n_points += x.size
+        bounds = np.cumsum([0] + [r.x.size for r in batch])
+        for r, a, b in zip(batch, bounds[:-1], bounds[1:]):
+            # Las peticiones canceladas (e.g. por un timeout) ya terminaron
+            if not r.future.done():
+                r.future.set_result(out[a:b])
+
+
+class ScoringService:
+    def __init__(self, model, max_batch=4096, max_delay=0.002, n_threads=1):
+        """
+        Parameters
+        ----------
+        model : Model
+          Modelos ya ajustados (o cargados con Model.load)
+        max_batch : int
+          Máximo de puntos por llamada vectorizada
+        max_delay : float
+          Segundos que la primera petición de un batch espera a otras
+        n_threads : int
+          Threads que evalúan los batches. Con 1 los modelos nunca se
+          usan concurrentemente
+        """
+        self.models = {m.name: m for m in model.models}
+        self.max_batch, self.max_delay = max_batch, max_delay
+        self.n_threads = n_threads
+        self.latency = LatencyStats()
+        self.executor = None
+        self.batchers = {}
+
+    @classmethod
+    def load(cls, file_name='model.data', shps=None, **kwargs):
+        """Servicio sobre los modelos guardados con Model.store.
+
+        Parameters
+        ----------
+        file_name : str
+        shps : dict
+        kwargs
+          Ver ScoringService
+
+        Returns
+        -------
+        ScoringService
+        """
+        from predictivehp.models import Model
+
+        return cls(Model.load(file_name, shps=shps), **kwargs)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+        return False
+
+    async def start(self):
+        self.executor = ThreadPoolExecutor(self.n_threads)
+        self.batchers = {}
+
+    async def stop(self):
+        for b in self.batchers.values():
+            await b.stop()
+        self.batchers = {}
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def model(self, name):
+        if name not in self.models:
+            raise KeyError(f"Unknown model '{name}', available: "
+                           f"{sorted(self.models)}")
+        return self.models[name]
+
+    def batcher(self, name, exact, timed):
+        key = (name, exact, timed)
+        if key not in self.batchers:
+            self.batchers[key] = _Batcher(self.model(name), exact,
+                                          self.executor, self.max_batch,
+                                          self.max_delay)
+            self.batchers[key].start()
+        return self.batchers[key]
+
+    async def score(self, name, x, y, t=None, exact=False):
+        """Score de los puntos (x, y, t) según el modelo name, ver
+        score_points de cada modelo.
+
+        Parameters
+        ----------
+        name : str
+        x : array_like
+        y : array_like
+        t : array_like
+          Día del año de cada punto. Solo lo usa STKDE; None usa su
+          mapa integrado en la ventana de predicción
+        exact : bool
+          True para evaluar el kernel en los puntos en vez de leer el
+          score de su celda
+
+        Returns
+        -------
+        np.ndarray
+        """
+        self.model(name)
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        if x.shape != y.shape:
+            raise ValueError("x and y must have the same shape")
+        if t is not None:
+            t = np.broadcast_to(np.asarray(t, dtype=float).ravel(), x.shape)
+        return await self.batcher(name, bool(exact),
+                                  t is not None).submit(x, y, t)
+
+    async def hotspots(self, name, ap=None, c=None, polygons=False):
+        """Celdas hotspot del modelo name para el area percentage ap o el
+        umbral c.
+
+        Returns
+        -------
+        dict
+          Ver hotspot_cells
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, hotspot_cells, self.model(name), ap, c, polygons)
+
+    def stats(self):
+        """
+        Returns
+        -------
+        dict
+          Percentiles de latencia por ruta (ms) y tamaño medio de los
+          batches de cada modelo
+        """
+        batches = {}
+        for (name, exact, timed), b in self.batchers.items():
+            label = name + ('/exact' if exact else '') + \
+                ('/t' if timed else '')
+            batches[label] = {'count': b.n_batches,
+                              'mean_size': b.n_points / max(b.n_batches, 1)}
+        return {'latency': self.latency.percentiles(), 'batches': batches}
+
+    async def handle(self, route, payload):
+        """Atiende una petición con payload serializable a JSON.
+
+        Parameters
+        ----------
+        route : str
+          'score' ({model, x, y[, t, exact]}), 'hotspots' ({model, ap
+          o c[, polygons]}), 'stats' o 'models'
+        payload : dict
+
+        Returns
+        -------
+        dict
+          Respuesta con 'status' (200, 400 o 404) y el resultado o
+          'error'
+        """
+        def field(key):
+            if key not in payload:
+                raise ValueError(f"Missing field '{key}'")
+            return payload[key]
+
+        st = time.perf_counter()
+        try:
+            if route == 'score':
+                body = {'scores': (await self.score(
+                    field('model'), field('x'), field('y'),
+                    payload.get('t'), payload.get('exact', False))).tolist()}
+            elif route == 'hotspots':
+                ap, c = payload.get('ap'), payload.get('c')
+                h = await self.hotspots(
+                    field('model'), None if ap is None else float(ap),
+                    None if c is None else float(c),
+                    bool(payload.get('polygons', False)))
+                body = {k: v.tolist() if isinstance(v, np.ndarray) else v
+                        for k, v in h.items()}
+            elif route == 'stats':
+                body = self.stats()
+            elif route == 'models':
+                body = {'models': sorted(self.models)}
+            else:
+                return {'status': 404, 'error': f"Unknown route '{route}'"}
+        except KeyError as e:
+            return {'status': 404, 'error': str(e.args[0])}
+        except (ValueError, TypeError) as e:
+            return {'status': 400, 'error': str(e)}
+        self.latency.add(route, time.perf_counter() - st)
+        return {'status': 200, **body}
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,50 @@
+"""
+conftest.py
+
+Fixtures compartidas por los tests: un set chico de incidentes
+sintéticos (make_incidents), los shapefiles de councils en EPSG:3857 y
+un cache de artefactos temporal, para no escribir en
+predictivehp/data/cache.
+"""
+
+import pytest
+
+import predictivehp as p
+from predictivehp.models import create_model
+from predictivehp.utils._synthetic import make_incidents, load_councils
+
+
+@pytest.fixture(scope='session', autouse=True)
+def cache_dir(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('cache'))
+    with p.config_context(cache_dir=path):
+        yield path
+
+
+@pytest.fixture(scope='session')
+def incidents():
+    return make_incidents(2000, seed=0)
+
+
+@pytest.fixture(scope='session')
+def shps():
+    councils = load_councils(crs=2276).to_crs(epsg=3857)
+    return {'streets': councils, 'councils': councils, 'c_limits': None}
+
+
+@pytest.fixture(scope='session')
+def fitted(incidents, shps):
+    """Model con STKDE, ProMap y RForestRegressor ajustados sobre
+    incidents, con mallas gruesas para que los tests sean rápidos. Los
+    tests no deben modificarlo."""
+    m = create_model(incidents, shps, use_promap=True, use_rfr=True,
+                     use_stkde=True)
+    m.set_parameters()
+    m.set_parameters('ProMap', bw=[1500, 1100, 35], hx=400, hy=400,
+                     read_density=False)
+    m.set_parameters('RForestRegressor', t_history=4, xc_size=500,
+                     yc_size=500, n_layers=7)
+    m.fit()
+    m.predict()
+    m.validate(ap=0.05)
+    return m
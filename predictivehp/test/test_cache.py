@@ -0,0 +1,135 @@
+"""
+test_cache.py
+
+Las llaves del cache de artefactos cambian con los datos y con los
+parámetros: un resultado cacheado siempre es igual al que se calcula
+sin cache.
+"""
+
+import os
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+import predictivehp as p
+from predictivehp.models import create_model
+from predictivehp.utils._cache import hash_frame, make_key
+
+RFR_PARAMS = dict(t_history=4, xc_size=1000, yc_size=1000, n_layers=3)
+
+
+def artifacts(path, name):
+    return sorted(f for f in os.listdir(path) if f.startswith(f'{name}-'))
+
+
+def rfr_features(data, shps, **params):
+    m = create_model(data, shps, use_rfr=True)
+    m.set_parameters('RForestRegressor', **dict(RFR_PARAMS, **params))
+    m.prepare_rfr()
+    return m.models[0].X
+
+
+def test_make_key():
+    assert make_key(a=1, b=[1, 2]) == make_key(b=[1, 2], a=1)
+    assert make_key(a=1, b=[1, 2]) != make_key(a=1, b=[2, 1])
+
+
+def test_hash_frame(incidents):
+    changed = incidents.copy()
+    changed.loc[0, 'x'] += 1e-6
+    assert hash_frame(incidents) == hash_frame(incidents.copy())
+    assert hash_frame(incidents) != hash_frame(changed)
+    # Solo cuentan las columnas pedidas
+    changed = incidents.assign(month1='-')
+    assert hash_frame(incidents, ['x', 'y']) == hash_frame(changed, ['x', 'y'])
+
+
+def test_rfr_cache_hit(incidents, shps, tmp_path):
+    with p.config_context(cache_dir=str(tmp_path)):
+        a = rfr_features(incidents, shps)
+        keys = artifacts(tmp_path, 'rfr_X')
+        b = rfr_features(incidents, shps)
+    assert len(keys) == 1 and artifacts(tmp_path, 'rfr_X') == keys
+    assert np.array_equal(a.values, b.values)
+    assert np.array_equal(a.cells, b.cells)
+
+
+@pytest.mark.parametrize('change', [
+    {'data': True}, {'n_layers': 2}, {'xc_size': 1200}, {'sparse': True},
+])
+def test_rfr_cache_invalidation(incidents, shps, tmp_path, change):
+    params = dict(change)
+    data = incidents
+    if params.pop('data', False):
+        data = incidents.assign(date=incidents['date'] + timedelta(days=7))
+    with p.config_context(cache_dir=str(tmp_path)):
+        first = rfr_features(incidents, shps)
+        cached = rfr_features(data, shps, **params)
+        fresh = rfr_features(data, shps, use_cache=False, **params)
+    assert len(artifacts(tmp_path, 'rfr_X')) == 2
+    values = cached.values.toarray() if params.get('sparse') \
+        else cached.values
+    assert np.array_equal(values, fresh.values.toarray()
+                          if params.get('sparse') else fresh.values)
+    assert np.array_equal(cached.cells, fresh.cells)
+    if 'sparse' not in params:
+        assert values.shape != first.values.shape or \
+            not np.array_equal(values, first.values)
+
+
+PM_PARAMS = dict(bw=[1500, 1100, 35], hx=400, hy=400)
+
+
+def promap(data, shps, read_density=True, **params):
+    m = create_model(data, shps, use_promap=True)
+    m.set_parameters('ProMap', read_density=read_density,
+                     **dict(PM_PARAMS, **params))
+    m.fit()
+    m.predict()
+    return m.models[0]
+
+
+def test_promap_cache_hit(incidents, shps, tmp_path):
+    with p.config_context(cache_dir=str(tmp_path)):
+        a = promap(incidents, shps)
+        keys = artifacts(tmp_path, 'promap')
+        b = promap(incidents, shps)
+    assert len(keys) == 1 and artifacts(tmp_path, 'promap') == keys
+    assert isinstance(b.prediction, np.memmap)
+    assert np.array_equal(a.prediction, b.prediction)
+    assert a.d_max == b.d_max
+
+
+@pytest.mark.parametrize('change', [
+    {'data': True}, {'bw': [1000, 1100, 35]}, {'hx': 500, 'hy': 500},
+])
+def test_promap_cache_invalidation(incidents, shps, tmp_path, change):
+    params = dict(change)
+    data = incidents
+    if params.pop('data', False):
+        data = incidents.assign(date=incidents['date'] + timedelta(days=7))
+    with p.config_context(cache_dir=str(tmp_path)):
+        first = promap(incidents, shps)
+        cached = promap(data, shps, **params)
+        fresh = promap(data, shps, read_density=False, **params)
+    assert len(artifacts(tmp_path, 'promap')) == 2
+    assert np.array_equal(cached.prediction, fresh.prediction)
+    assert cached.d_max == fresh.d_max
+    assert cached.prediction.shape != first.prediction.shape or \
+        not np.array_equal(cached.prediction, first.prediction)
+
+
+def test_promap_no_cache(incidents, shps, tmp_path):
+    """Por defecto ProMap no lee ni escribe el cache"""
+    with p.config_context(cache_dir=str(tmp_path)):
+        m = create_model(incidents, shps, use_promap=True)
+        m.set_parameters()
+        pm = m.models[0]
+        assert pm.read_density is False
+        m.set_parameters('ProMap', **PM_PARAMS)
+        assert pm.read_density is False
+        m.fit()
+        m.predict()
+    assert artifacts(tmp_path, 'promap') == []
+    assert not isinstance(pm.prediction, np.memmap)
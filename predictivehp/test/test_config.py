@@ -0,0 +1,106 @@
+"""
+test_config.py
+
+Configuración de ejecución (n_jobs, backend, ...) y su uso en
+RForestRegressor.fit y STKDE.fit.
+"""
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from statsmodels.nonparametric.kernel_density import KDEMultivariate
+
+import predictivehp as p
+from predictivehp._config import check_n_jobs
+from predictivehp.models import STKDE, RForestRegressor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def test_check_n_jobs():
+    n_cpu = os.cpu_count() or 1
+    assert check_n_jobs(3) == 3
+    assert check_n_jobs('2') == 2
+    assert check_n_jobs(-1) == n_cpu
+    with pytest.raises(ValueError):
+        check_n_jobs(0)
+    with pytest.raises(ValueError):
+        check_n_jobs(-(n_cpu + 1))
+
+
+def test_set_config_validates():
+    old = p.get_config()
+    with pytest.raises(ValueError):
+        p.set_config(n_jobs=0)
+    with pytest.raises(ValueError):
+        p.set_config(backend='dask')
+    assert p.get_config() == old
+
+
+def test_config_context_restores():
+    old = p.get_config()
+    with p.config_context(n_jobs=1, chunk_size=5):
+        assert p.get_config()['n_jobs'] == 1
+        assert p.get_config()['chunk_size'] == 5
+    assert p.get_config() == old
+
+
+@pytest.mark.parametrize('value, n_jobs', [('2', 2), ('0', None)])
+def test_env_n_jobs(value, n_jobs):
+    """PREDICTIVEHP_N_JOBS se valida igual que set_config"""
+    r = subprocess.run(
+        [sys.executable, '-c',
+         'import predictivehp; print(predictivehp.get_config()["n_jobs"])'],
+        env=dict(os.environ, PREDICTIVEHP_N_JOBS=value), cwd=ROOT,
+        capture_output=True, text=True)
+    if n_jobs is None:
+        assert r.returncode != 0 and 'ValueError' in r.stderr
+    else:
+        assert r.returncode == 0 and int(r.stdout.split()[-1]) == n_jobs
+
+
+@pytest.mark.parametrize('regressor, n_jobs', [
+    ('rf', 2),
+    (RandomForestRegressor(n_estimators=5), 2),
+    (RandomForestRegressor(n_estimators=5, n_jobs=3), 3),
+])
+def test_rfr_n_jobs(regressor, n_jobs):
+    """El n_jobs global no pisa el de un estimador del usuario"""
+    rng = np.random.default_rng(0)
+    X, y = rng.random((50, 3)), rng.random(50)
+    r = RForestRegressor(regressor=regressor)
+    with p.config_context(n_jobs=2):
+        r.fit(X, y)
+    assert r.rfr.n_jobs == n_jobs
+
+
+@pytest.mark.parametrize('value, ok', [('threading', True), ('dask', False)])
+def test_env_backend(value, ok):
+    """PREDICTIVEHP_BACKEND se valida igual que set_config"""
+    r = subprocess.run(
+        [sys.executable, '-c',
+         'import predictivehp; print(predictivehp.get_config()["backend"])'],
+        env=dict(os.environ, PREDICTIVEHP_BACKEND=value), cwd=ROOT,
+        capture_output=True, text=True)
+    if ok:
+        assert r.returncode == 0 and r.stdout.split()[-1] == value
+    else:
+        assert r.returncode != 0 and 'ValueError' in r.stderr
+
+
+def test_stkde_bandwidth(incidents):
+    """Con bw=None el bandwidth es el de KDEMultivariate, sin importar
+    n_jobs"""
+    X = incidents.iloc[:300]
+    ref = KDEMultivariate([X[['x']].to_numpy(), X[['y']].to_numpy(),
+                           X[['y_day']].to_numpy()], 'ccc').bw
+    for n_jobs in (1, 2):
+        st = STKDE(data=incidents)
+        with p.config_context(n_jobs=n_jobs):
+            st.fit(X, X)
+        assert np.array_equal(st.bw, ref)
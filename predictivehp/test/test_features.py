@@ -0,0 +1,162 @@
+"""
+test_features.py
+
+FeatureStore de RForestRegressor contra el pd.DataFrame que generaba
+generate_X antes (loops por incidente y filtrado celda a celda), y
+features out_of_core (memmap) contra las features en memoria.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+
+import predictivehp.utils._aux_functions as af
+from predictivehp.models import create_model
+from predictivehp.models._features import FeatureView
+
+
+def old_features(rfr, shp):
+    """Features y celdas como las calculaba generate_X con el
+    pd.DataFrame."""
+    g = rfr.grid
+    x_min, y_min = g['x_min'], g['y_min']
+    D_cols = {}
+    for week in rfr.weeks:
+        w_data = rfr.data[(week <= rfr.data.date) &
+                          (rfr.data.date <= week + timedelta(days=6))]
+        D = np.zeros((rfr.nx, rfr.ny), dtype=int)
+        for _, row in w_data.iterrows():
+            D[af.n_i(row.geometry.x, x_min, rfr.hx),
+              af.n_i(row.geometry.y, y_min, rfr.hy)] += 1
+        for i in range(rfr.n_layers + 1):
+            D_cols[(f"Incidents_{i}", week)] = \
+                af.to_df_col(D if i == 0 else af.il_neighbors(D, i))
+    X = pd.DataFrame(D_cols)
+
+    city = shapely.prepared.prep(shp.geometry.union_all())
+    i, j = np.divmod(np.arange(rfr.nx * rfr.ny), rfr.ny)
+    in_city = [city.intersects(shapely.Point(x, y)) for x, y in
+               zip(x_min + i * rfr.hx, y_min + j * rfr.hy)]
+    return X[in_city]
+
+
+@pytest.fixture(scope='module')
+def model(incidents, shps):
+    m = create_model(incidents, shps, use_rfr=True)
+    m.set_parameters('RForestRegressor', t_history=4, xc_size=1000,
+                     yc_size=1000, n_layers=3, use_cache=False)
+    m.prepare_rfr()
+    return m
+
+
+def rfr_of(m):
+    return m.models[0]
+
+
+def test_assign_cells(model):
+    rfr = rfr_of(model)
+    old = [af.n_i(p.y, rfr.grid['y_min'], rfr.hy) +
+           rfr.ny * af.n_i(p.x, rfr.grid['x_min'], rfr.hx)
+           for p in rfr.data.geometry]
+    assert np.array_equal(rfr.data.index.to_numpy(dtype=int), old)
+
+
+def test_in_shp(model, shps):
+    rfr = rfr_of(model)
+    x, y = rfr.X.xy()
+    city = shps['councils'].geometry.union_all()
+    rng = np.random.default_rng(0)
+    x = np.concatenate([x[:200], rng.uniform(*city.bounds[::2], 300)])
+    y = np.concatenate([y[:200], rng.uniform(*city.bounds[1::2], 300)])
+    old = [city.intersects(shapely.Point(a, b)) for a, b in zip(x, y)]
+    assert np.array_equal(af.in_shp(x, y, shps['councils']), old)
+
+
+def test_feature_store(model, shps):
+    rfr = rfr_of(model)
+    old = old_features(rfr, shps['councils'])
+    new = rfr.X.to_frame()
+    assert np.array_equal(new.index, old.index)
+    assert np.array_equal(new[old.columns].to_numpy(), old.to_numpy())
+    assert new.to_numpy().dtype.itemsize <= 4
+
+
+def test_sparse_store(model):
+    rfr = rfr_of(model)
+    dense = rfr.X
+    rfr.sparse, rfr.X = True, None
+    try:
+        rfr.generate_X()
+        assert np.array_equal(rfr.X.values.toarray(), dense.values)
+        assert np.array_equal(rfr.X.cells, dense.cells)
+    finally:
+        rfr.sparse, rfr.X = False, dense
+
+
+@pytest.mark.parametrize('mode', ['train', 'test'])
+def test_prepare_rfr(model, shps, mode):
+    """X, y de prepare_rfr contra la selección de columnas del
+    pd.DataFrame"""
+    rfr = rfr_of(model)
+    old = old_features(rfr, shps['councils'])
+    f_weeks, l_week = (rfr.weeks[:-2], rfr.weeks[-2]) if mode == 'train' \
+        else (rfr.weeks[1:-1], rfr.weeks[-1])
+    X_old = old[[(f'Incidents_{i}', week) for i in range(rfr.n_layers)
+                 for week in f_weeks]]
+    y_old = old[[(f'Incidents_{i}', l_week)
+                 for i in range(rfr.n_layers)]].T.any().astype(int)
+
+    X, y = model.prepare_rfr(mode=mode)
+    assert np.array_equal(X, X_old.to_numpy())
+    assert np.array_equal(y, y_old.to_numpy())
+
+
+@pytest.fixture(scope='module')
+def ooc_model(incidents, shps):
+    m = create_model(incidents, shps, use_rfr=True)
+    m.set_parameters('RForestRegressor', t_history=4, xc_size=1000,
+                     yc_size=1000, n_layers=3, use_cache=False,
+                     out_of_core=True, batch_size=100_000)
+    m.prepare_rfr()
+    return m
+
+
+def test_out_of_core_store(model, ooc_model):
+    X, ooc = rfr_of(model).X, rfr_of(ooc_model).X
+    assert isinstance(ooc.values, np.memmap)
+    assert np.array_equal(ooc.values, X.values)
+    assert np.array_equal(ooc.cells, X.cells)
+    assert list(ooc.columns) == list(X.columns)
+
+
+@pytest.mark.parametrize('mode', ['train', 'test'])
+def test_out_of_core_view(model, ooc_model, mode):
+    X, y = model.prepare_rfr(mode=mode)
+    view, y_ooc = ooc_model.prepare_rfr(mode=mode)
+    assert isinstance(view, FeatureView) and view.shape == X.shape
+    assert np.array_equal(view.toarray(), X)
+    assert np.array_equal(y_ooc, y)
+    rows = np.random.default_rng(0).choice(X.shape[0], 50, replace=False)
+    rows.sort()
+    assert np.array_equal(view[rows], X[rows])
+    assert np.array_equal(view[10:40], X[10:40])
+
+
+def test_out_of_core_fit(model, ooc_model):
+    """Con un solo bloque el forest entrenado por tandas es el mismo, y
+    predice lo mismo sobre el FeatureView que sobre el arreglo"""
+    forest = RandomForestRegressor(n_estimators=10, random_state=0,
+                                   n_jobs=1)
+    predictions = []
+    for m in (model, ooc_model):
+        rfr = rfr_of(m)
+        rfr.regressor, rfr.rfr = forest, clone(forest)
+        rfr.fit(*m.prepare_rfr(mode='train'))
+        X_test, _ = m.prepare_rfr(mode='test')
+        predictions.append(rfr.predict(X_test))
+    assert np.array_equal(predictions[0], predictions[1])
@@ -0,0 +1,87 @@
+"""
+test_heatmap.py
+
+heatmap de cada modelo, llamado directamente o desde Plotter, con el
+backend Agg de matplotlib.
+"""
+
+import copy
+
+import numpy as np
+import pytest
+
+import predictivehp.utils._aux_functions as af
+from predictivehp.utils._lazy import plt
+from predictivehp.visualization import Plotter
+
+
+@pytest.fixture(autouse=True)
+def agg():
+    backend = plt.get_backend()
+    plt.switch_backend('Agg')
+    yield
+    plt.close('all')
+    plt.switch_backend(backend)
+
+
+@pytest.fixture(scope='module')
+def model(fitted):
+    return copy.deepcopy(fitted)
+
+
+def get(model, name):
+    return [m for m in model.models if m.name == name][0]
+
+
+@pytest.mark.parametrize('c', [None, 0.3, [0.2, 0.5]])
+def test_rfr_imshow(model, tmp_path, c):
+    """La malla de niveles se dibuja con un único imshow y fname sin
+    extensión se guarda como .png"""
+    rfr = get(model, 'RForestRegressor')
+    rfr.heatmap(c=c, savefig=True, fname=str(tmp_path / 'rfr'),
+                show_axis=False)
+    ax = plt.gcf().axes[0]
+    z, extent = rfr.score_grid()
+    c = None if c is None else np.asarray(c)
+    assert len(ax.images) == 1
+    assert np.array_equal(ax.images[0].get_array(),
+                          np.flipud(af.score_levels(z, c).T),
+                          equal_nan=True)
+    assert list(ax.images[0].get_extent()) == list(extent)
+    assert not ax.axison
+    assert (tmp_path / 'rfr.png').exists()
+
+
+def test_plotter(model, tmp_path, monkeypatch):
+    """Plotter entrega colors y show_axis a cada modelo; ninguno llega a
+    plt.savefig"""
+    monkeypatch.chdir(tmp_path)
+    Plotter(model).heatmap(savefig=True, show_axis=False)
+    assert sorted(f.name for f in tmp_path.iterdir()) == \
+        ['Promap_heatmap.png', 'RFR_heatmap.png', 'STKDE_heatmap.png']
+    for f in plt.get_fignums():
+        assert not plt.figure(f).axes[0].axison
+
+
+def count_shows(monkeypatch):
+    calls = []
+    monkeypatch.setattr(plt, 'show', lambda *a, **k: calls.append(1))
+    return calls
+
+
+@pytest.mark.parametrize('show', [True, False])
+def test_show(model, monkeypatch, show):
+    calls = count_shows(monkeypatch)
+    Plotter(model).heatmap(c=0.3, show=show)
+    assert len(calls) == (len(model.models) if show else 0)
+    # Con show=False las figuras quedan abiertas para el que llama
+    assert len(plt.get_fignums()) == len(model.models)
+
+
+def test_render_headless(model, tmp_path, monkeypatch):
+    """Plotter.render no pasa por heatmap ni por plt.show"""
+    calls = count_shows(monkeypatch)
+    paths = Plotter(model).render(c=[0.3], out_dir=str(tmp_path),
+                                  n_jobs=1)
+    assert paths and not calls
+    assert plt.get_fignums() == []
@@ -0,0 +1,183 @@
+"""
+test_hotspots.py
+
+HotspotIndex contra umbralizar la malla de scores completa y contra un
+etiquetado de componentes por BFS.
+"""
+
+import copy
+from collections import deque
+
+import geopandas as gpd
+import numpy as np
+import pytest
+
+from predictivehp.models import HotspotIndex, export_hotspots, hotspot_index
+from predictivehp.models._hotspots import components
+
+AP = [0, 0.001, 0.02, 0.1, 1]
+
+
+def get(model, name):
+    return [m for m in model.models if m.name == name][0]
+
+
+def grid_scores(m):
+    z, _ = m.score_grid()
+    return np.asarray(z, dtype=float).ravel()
+
+
+def old_components(cells, nx, ny):
+    """Etiqueta las celdas recorriendo sus vecinos con BFS"""
+    pos = {c: k for k, c in enumerate(cells)}
+    labels = np.full(len(cells), -1)
+    n_labels = 0
+    for k, c in enumerate(cells):
+        if labels[k] >= 0:
+            continue
+        labels[k] = n_labels
+        queue = deque([c])
+        while queue:
+            i, j = divmod(queue.popleft(), ny)
+            for a, b in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)):
+                n = a * ny + b
+                if 0 <= a < nx and 0 <= b < ny and n in pos and \
+                        labels[pos[n]] < 0:
+                    labels[pos[n]] = n_labels
+                    queue.append(n)
+        n_labels += 1
+    return labels
+
+
+def same_partition(a, b):
+    """True si las etiquetas a y b agrupan igual los elementos"""
+    pairs = set(zip(a, b))
+    return len(pairs) == len(set(a)) == len(set(b))
+
+
+@pytest.mark.parametrize('name', ['ProMap', 'RForestRegressor', 'STKDE'])
+@pytest.mark.parametrize('ap', AP)
+def test_cells_ap(fitted, name, ap):
+    m = get(fitted, name)
+    index = hotspot_index(m)
+    z = grid_scores(m)
+    finite = np.isfinite(z)
+    n_area = getattr(m, 'cells_in_map', None) or finite.sum()
+    k = index.size(ap)
+    assert k == min(np.ceil(ap * n_area), finite.sum())
+
+    cells = index.cells(ap)
+    assert len(cells) == k
+    assert np.all(np.diff(cells['score']) <= 0)
+    assert np.array_equal(cells['score'], z[cells['cell']])
+    # Las k celdas de mayor score, sin importar el orden de los empates
+    top = np.sort(z[finite])[::-1][:k]
+    assert np.array_equal(cells['score'], top)
+    if k:
+        assert index.threshold(ap) == top[-1]
+        assert np.all(z[finite][~np.isin(np.flatnonzero(finite),
+                                         cells['cell'])] <= top[-1])
+    else:
+        assert index.threshold(ap) is None
+
+
+@pytest.mark.parametrize('name', ['ProMap', 'RForestRegressor', 'STKDE'])
+@pytest.mark.parametrize('c', [0, 0.1, 0.5, 1, 2])
+def test_cells_c(fitted, name, c):
+    m = get(fitted, name)
+    z = grid_scores(m)
+    cells = hotspot_index(m).cells(c=c)
+    with np.errstate(invalid='ignore'):
+        assert sorted(cells['cell']) == list(np.flatnonzero(z >= c))
+
+
+def test_cell_centers(fitted):
+    m = get(fitted, 'ProMap')
+    cells = hotspot_index(m).cells(0.05)
+    assert np.array_equal(m.cell_ids(cells['x'], cells['y']), cells['cell'])
+    assert np.array_equal(cells['score'],
+                          m.score_points(cells['x'], cells['y']))
+
+
+def test_errors():
+    index = HotspotIndex(np.arange(6.).reshape(2, 3),
+                         {'x_0': 0, 'y_0': 0, 'hx': 1, 'hy': 1, 'nx': 2,
+                          'ny': 3})
+    with pytest.raises(ValueError):
+        index.size(1.5)
+    with pytest.raises(ValueError):
+        index.size()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_components(seed):
+    rng = np.random.default_rng(seed)
+    nx, ny = rng.integers(1, 30, 2)
+    cells = rng.permutation(nx * ny)[:rng.integers(0, nx * ny + 1)]
+    assert same_partition(components(cells, nx, ny),
+                          old_components(cells, nx, ny))
+
+
+@pytest.mark.parametrize('name', ['ProMap', 'RForestRegressor', 'STKDE'])
+def test_polygons(fitted, name):
+    m = get(fitted, name)
+    index = hotspot_index(m)
+    cells = index.cells(0.05)
+    hotspots = index.polygons(0.05)
+    g = index.grid
+    labels = old_components(cells['cell'].to_numpy(), g['nx'], g['ny'])
+    assert len(hotspots) == len(set(labels))
+    assert hotspots['n_cells'].sum() == len(cells)
+    assert np.isclose(hotspots['score'].sum(), cells['score'].sum())
+    assert np.all(np.diff(hotspots['score']) <= 0)
+    assert list(hotspots['rank']) == list(range(1, len(hotspots) + 1))
+    assert np.allclose(hotspots.area, hotspots['area'])
+
+
+def test_index_cache(fitted):
+    m = copy.deepcopy(get(fitted, 'ProMap'))
+    index = hotspot_index(m)
+    assert hotspot_index(m) is index
+
+    # Una predicción nueva reemplaza la matriz de scores
+    m.prediction = np.asarray(m.prediction)[::-1].copy()
+    new = hotspot_index(m)
+    assert new is not index
+    assert np.array_equal(new.cells(0.05)['score'],
+                          index.cells(0.05)['score'])
+    assert not np.array_equal(new.cells(0.05)['cell'],
+                              index.cells(0.05)['cell'])
+
+
+@pytest.mark.parametrize('ext', ['geojson', 'parquet'])
+def test_export(fitted, tmp_path, ext):
+    m = get(fitted, 'ProMap')
+    path = str(tmp_path / f'hotspots.{ext}')
+    hotspots = export_hotspots(m, path, ap=0.05)
+    read = gpd.read_parquet(path) if ext == 'parquet' else gpd.read_file(path)
+    assert list(read['rank']) == list(hotspots['rank'])
+    assert np.array_equal(read['n_cells'], hotspots['n_cells'])
+    assert np.allclose(read['score'], hotspots['score'])
+    assert read.geometry.geom_equals_exact(hotspots.geometry, 1e-6).all()
+
+
+def test_model_hotspots(fitted):
+    hotspots = fitted.hotspots(ap=0.05)
+    assert list(hotspots) == [m.name for m in fitted.models]
+    for m in fitted.models:
+        assert hotspots[m.name].equals(hotspot_index(m).polygons(0.05))
+
+
+@pytest.mark.parametrize('c', [0.1, 0.3])
+def test_stkde_area(fitted, c):
+    """El área de validate usa las celdas de los hotspots, centradas en
+    los nodos de la malla"""
+    st = copy.deepcopy(get(fitted, 'STKDE'))
+    st.validate(c=c)
+    g = hotspot_index(st).grid
+    x, y = np.mgrid[st.x_min:st.x_max:st.n_nodes * 1j,
+                    st.y_min:st.y_max:st.n_nodes * 1j]
+    assert np.isclose(g['hx'], x[1, 0] - x[0, 0])
+    assert np.isclose(g['hy'], y[0, 1] - y[0, 0])
+    n_cells = np.sum(st.f_nodos >= c) / st.days.size
+    assert np.isclose(st.h_area, n_cells * g['hx'] * g['hy'] / 10 ** 6)
@@ -0,0 +1,105 @@
+"""
+test_index.py
+
+IncidentIndex contra filtrar la tabla de incidentes con máscaras por
+fecha, bbox y celda.
+"""
+
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from predictivehp.utils import IncidentIndex
+from predictivehp.utils._index import to_days
+
+GRID = {'x_min': 0, 'y_min': 0, 'hx': 10, 'hy': 20, 'nx': 8, 'ny': 4}
+
+
+def make_frame(n, sort, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2017-01-01') + \
+        pd.to_timedelta(rng.integers(0, 60, n), unit='D')
+    df = pd.DataFrame({'x': rng.uniform(-5, 85, n),
+                       'y': rng.uniform(-5, 85, n),
+                       'date': dates})
+    return df.sort_values('date', kind='stable') if sort else df
+
+
+def brute_cells(df, grid):
+    ids = []
+    for x, y in zip(df['x'], df['y']):
+        i = int(np.floor((x - grid['x_min']) / grid['hx']))
+        j = int(np.floor((y - grid['y_min']) / grid['hy']))
+        inside = 0 <= i < grid['nx'] and 0 <= j < grid['ny']
+        ids.append(i * grid['ny'] + j if inside else -1)
+    return np.array(ids)
+
+
+def test_to_days():
+    assert to_days('1970-01-02') == 1
+    assert to_days(date(2017, 1, 1)) == to_days(datetime(2017, 1, 1, 23))
+    days = to_days(['2017-01-01 00:00', '2017-01-03 10:00'])
+    assert days.dtype == np.int64
+    assert list(days - days[0]) == [0, 2]
+
+
+WINDOWS = [(None, None), ('2017-01-10', None), (None, '2017-02-01'),
+           ('2017-01-10', '2017-02-01'), ('2017-01-10', '2017-01-10'),
+           ('2017-02-01', '2017-01-10'), ('2016-01-01', '2016-02-01'),
+           ('2017-01-01', '2018-01-01')]
+
+
+@pytest.mark.parametrize('sort', [True, False])
+@pytest.mark.parametrize('d0, d1', WINDOWS)
+def test_query(sort, d0, d1):
+    df = make_frame(500, sort)
+    index = IncidentIndex.from_frame(df)
+    assert index.in_order == sort and len(index) == len(df)
+    mask = np.ones(len(df), dtype=bool)
+    if d0 is not None:
+        mask &= (df['date'] >= d0).to_numpy()
+    if d1 is not None:
+        mask &= (df['date'] < d1).to_numpy()
+    assert np.array_equal(index.query(d0, d1), np.flatnonzero(mask))
+    assert index.take(df, d0, d1).equals(df[mask])
+    assert index.window(d0, d1).stop - index.window(d0, d1).start == \
+        mask.sum()
+
+    bbox = (10, 20, 50, 60)
+    in_bbox = mask & df['x'].between(10, 50).to_numpy() & \
+        df['y'].between(20, 60).to_numpy()
+    assert np.array_equal(index.query(d0, d1, bbox=bbox),
+                          np.flatnonzero(in_bbox))
+
+    cells = [0, 5, 13, 31]
+    in_cells = mask & np.isin(brute_cells(df, GRID), cells)
+    assert np.array_equal(index.query(d0, d1, cells=cells, grid=GRID),
+                          np.flatnonzero(in_cells))
+    assert np.array_equal(
+        index.query(d0, d1, bbox=bbox, cells=cells, grid=GRID),
+        np.flatnonzero(in_bbox & in_cells))
+
+
+def test_cell_ids():
+    df = make_frame(500, sort=False)
+    index = IncidentIndex.from_frame(df)
+    ids = index.cell_ids(GRID)
+    # Ordenados por fecha, como el índice
+    assert np.array_equal(ids, brute_cells(df, GRID)[index.order])
+    assert (ids == -1).any()
+    assert index.cell_ids(dict(GRID)) is ids
+    assert index.cell_ids(dict(GRID, hx=5)) is not ids
+
+
+def test_geometry():
+    gpd = pytest.importorskip('geopandas')
+    df = make_frame(100, sort=False)
+    gdf = gpd.GeoDataFrame(df[['date']],
+                           geometry=gpd.points_from_xy(df['x'], df['y']))
+    index = IncidentIndex.from_frame(gdf, geometry=True)
+    ref = IncidentIndex.from_frame(df)
+    assert np.array_equal(index.x, ref.x) and np.array_equal(index.y, ref.y)
+    assert np.array_equal(index.query('2017-01-10', '2017-02-01'),
+                          ref.query('2017-01-10', '2017-02-01'))
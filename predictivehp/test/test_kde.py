@@ -0,0 +1,119 @@
+"""
+test_kde.py
+
+Evaluación por bloques del kde de STKDE (pdf_chunked, pdf_cube) contra
+KDEMultivariate.pdf.
+"""
+
+import numpy as np
+import pytest
+
+from predictivehp.models._kde import MyKDEMultivariate
+
+
+@pytest.fixture(scope='module')
+def kde():
+    rng = np.random.default_rng(0)
+    data = [rng.normal(0, 1000, 3000), rng.normal(0, 1000, 3000),
+            rng.integers(1, 300, 3000).astype(float)]
+    return MyKDEMultivariate([d[:, None] for d in data], 'ccc',
+                             bw=[700, 1000, 25])
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(1)
+    return np.array([rng.normal(0, 1000, 700), rng.normal(0, 1000, 700),
+                     rng.integers(280, 310, 700).astype(float)])
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'chunk_size': 64}, {'memory_limit': 2 ** 20, 'n_jobs': 3},
+    {'memory_limit': 1},
+])
+def test_pdf_chunked(kde, points, kwargs):
+    assert np.allclose(kde.pdf_chunked(points, **kwargs), kde.pdf(points),
+                       rtol=1e-12, atol=0)
+
+
+# 700 puntos: bloques de un punto, que no dividen n, y n - 1, n, n + 1
+CHUNKS = [1, 7, 699, 700, 701]
+
+
+@pytest.mark.parametrize('chunk_size', CHUNKS)
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_pdf_chunks(kde, points, chunk_size, n_jobs):
+    """Cada punto se escribe una vez, en su posición, sin importar dónde
+    caen los bordes de los bloques"""
+    out = np.full(points.shape[1], np.nan)
+    kde.pdf_chunked(points, out=out, chunk_size=chunk_size, n_jobs=n_jobs)
+    assert np.allclose(out, kde.pdf(points), rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize('n', [0, 1, 2])
+def test_pdf_chunked_small(kde, points, n):
+    assert np.allclose(kde.pdf_chunked(points[:, :n], chunk_size=1),
+                       kde.pdf(points[:, :n]) if n else np.empty(0),
+                       rtol=1e-12, atol=0)
+    # Un punto como arreglo 1-D, igual que en pdf
+    if n == 1:
+        assert np.allclose(kde.pdf_chunked(points[:, 0]),
+                           kde.pdf(points[:, 0]), rtol=1e-12, atol=0)
+
+
+def test_pdf_chunked_out(kde, points, tmp_path):
+    path = str(tmp_path / 'pdf.npy')
+    out = kde.pdf_chunked(points, out=path, memory_limit=2 ** 20)
+    assert isinstance(out, np.memmap)
+    assert np.array_equal(np.load(path), kde.pdf_chunked(points))
+
+
+def pdf_days(kde, points, days):
+    """Cubo como se calculaba antes: un pdf completo por día"""
+    n = points.shape[1]
+    return np.stack([kde.pdf(np.vstack([points, np.full(n, t)]))
+                     for t in days], axis=1)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'chunk_size': 64}, {'memory_limit': 2 ** 20, 'n_jobs': 3},
+    {'memory_limit': 1},
+])
+def test_pdf_cube(kde, points, kwargs):
+    days = np.arange(298, 306)
+    cube = kde.pdf_cube(points[:2], days, **kwargs)
+    assert cube.shape == (points.shape[1], days.size)
+    assert np.allclose(cube, pdf_days(kde, points[:2], days), rtol=1e-12,
+                       atol=0)
+
+
+@pytest.mark.parametrize('chunk_size', CHUNKS)
+def test_pdf_cube_chunks(kde, points, chunk_size):
+    days = np.array([290., 300.5])
+    out = np.full((points.shape[1], days.size), np.nan)
+    kde.pdf_cube(points[:2], days, out=out, chunk_size=chunk_size,
+                 n_jobs=2)
+    assert np.allclose(out, pdf_days(kde, points[:2], days), rtol=1e-12,
+                       atol=0)
+
+
+def test_pdf_cube_small(kde, points):
+    assert kde.pdf_cube(points[:2, :0], [300]).shape == (0, 1)
+    cube = kde.pdf_cube(points[:2, :1], 300, chunk_size=1)
+    assert cube.shape == (1, 1)
+    assert np.allclose(cube, kde.pdf([*points[:2, 0], 300]), rtol=1e-12,
+                       atol=0)
+
+
+def test_stkde_cube(fitted):
+    """Cada día de f_cube es el pdf de los nodos de la ciudad en ese
+    día"""
+    st = [m for m in fitted.models if m.name == 'STKDE'][0]
+    x, y = np.mgrid[st.x_min:st.x_max:st.n_nodes * 1j,
+                    st.y_min:st.y_max:st.n_nodes * 1j]
+    inside = ~np.isnan(st.f_cube[0].ravel())
+    nodes = np.array([x.ravel()[inside], y.ravel()[inside]])
+    old = pdf_days(st.kde, nodes, st.days) / st.f_max
+    assert inside.any()
+    assert np.allclose(st.f_cube.reshape(st.days.size, -1)[:, inside],
+                       old.T, rtol=1e-12, atol=0)
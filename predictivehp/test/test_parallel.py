@@ -0,0 +1,114 @@
+"""
+test_parallel.py
+
+parallel_map y los paths que reparten trabajo entre procesos: los
+workers usan la configuración del proceso que los lanza y el resultado
+es el mismo que en serie.
+"""
+
+import matplotlib.image as mpimg
+import numpy as np
+import pytest
+
+import predictivehp as p
+import predictivehp.utils._aux_functions as af
+from predictivehp.models import create_model, fit_batch
+from predictivehp.utils._synthetic import COUNCILS, make_incidents
+from predictivehp.visualization import BatchRenderer
+
+
+def probe(_):
+    c = p.get_config()
+    return c['memory_limit'], c['cache_dir'], c['n_jobs']
+
+
+@pytest.mark.parametrize('backend', ['loky', 'multiprocessing'])
+def test_workers_config(tmp_path, backend):
+    with p.config_context(memory_limit=123, cache_dir=str(tmp_path),
+                          n_jobs=2):
+        assert af.parallel_map(probe, range(2), backend=backend) == \
+            [(123, str(tmp_path), 2)] * 2
+        assert af.parallel_map(probe, range(2), backend=backend,
+                               config={'n_jobs': 1}) == \
+            [(123, str(tmp_path), 1)] * 2
+
+
+def test_inline_config(tmp_path):
+    with p.config_context(memory_limit=123, cache_dir=str(tmp_path),
+                          n_jobs=2):
+        assert af.parallel_map(probe, range(1), config={'n_jobs': 1}) == \
+            [(123, str(tmp_path), 1)]
+        # La configuración del proceso no cambia
+        assert p.get_config()['n_jobs'] == 2
+
+
+def test_threading_config():
+    assert af.parallel_map(probe, range(2), n_jobs=2,
+                           backend='threading') == [probe(None)] * 2
+    with pytest.raises(ValueError):
+        af.parallel_map(probe, range(2), n_jobs=2, backend='threading',
+                        config={'n_jobs': 1})
+
+
+def test_batch_renderer(fitted, shps, tmp_path):
+    """Las imágenes renderizadas en paralelo son iguales a las
+    renderizadas en serie"""
+    images = []
+    for n_jobs in (1, 2):
+        r = BatchRenderer(fitted.models, shps=shps,
+                          out_dir=str(tmp_path / str(n_jobs)), dpi=40,
+                          streets_px=256)
+        paths = r.render(c=[None, 0.5], n_jobs=n_jobs)
+        assert len(paths) == 2 * len(fitted.models)
+        images.append({path.rsplit('/', 1)[1]: mpimg.imread(path)
+                       for path in paths})
+    assert images[0].keys() == images[1].keys()
+    for name, img in images[0].items():
+        assert np.array_equal(img, images[1][name]), name
+
+
+@pytest.fixture(scope='module')
+def offenses():
+    return make_incidents(3000, offenses=['A', 'B'], seed=0)
+
+
+PM_PARAMS = {'ProMap': dict(bw=[1500, 1100, 35], hx=400, hy=400,
+                            read_density=False)}
+
+
+def test_fit_batch(offenses, shps):
+    """Cada par ajustado en el pool da las mismas métricas que ajustarlo
+    solo"""
+    r = fit_batch([('dallas', COUNCILS, 'A'), ('dallas', COUNCILS, 'B')],
+                  data=offenses, models=('ProMap',), parameters=PM_PARAMS,
+                  n_jobs=2)
+    assert r['error'].isna().all()
+    for offense, row in zip('AB', r.itertuples()):
+        data = offenses[offenses['offincident'] == offense]
+        m = create_model(data.reset_index(drop=True), shps, use_promap=True)
+        m.set_parameters()
+        m.set_parameters('ProMap', **PM_PARAMS['ProMap'])
+        m.fit()
+        m.predict()
+        m.validate(ap=0.05)
+        pm = m.models[0]
+        assert row.offense == offense and row.n_incidents == len(data)
+        assert (row.hr, row.pai, row.d_incidents) == \
+            (pm.hr_validated, pm.pai_validated, pm.d_incidents)
+
+
+@pytest.mark.parametrize('n_jobs, n_pairs, inner', [
+    (4, 2, 2), (4, 3, 1), (2, 4, 1), (1, 2, 1), (8, 2, 4),
+])
+def test_fit_batch_n_jobs(offenses, monkeypatch, n_jobs, n_pairs, inner):
+    """Los modelos de cada par se reparten los núcleos del batch"""
+    calls = []
+
+    def parallel_map(fn, tasks, n_jobs=None, config=None):
+        calls.append((n_jobs, config))
+        return [[] for _ in tasks]
+
+    monkeypatch.setattr(af, 'parallel_map', parallel_map)
+    fit_batch([(f'r{i}', COUNCILS, 'A') for i in range(n_pairs)],
+              data=offenses, models=('ProMap',), n_jobs=n_jobs)
+    assert calls == [(n_jobs, {'n_jobs': inner})]
@@ -0,0 +1,74 @@
+"""
+test_profiling.py
+
+Registro de etapas del Profiler. Las funciones marcadas retornan lo
+mismo con y sin un Profiler activo.
+"""
+
+import json
+
+import numpy as np
+
+from predictivehp.utils._profiling import (Profiler, add_hook, profiled,
+                                           remove_hook, stage)
+
+
+@profiled()
+def work(n):
+    with stage('inner', n=n):
+        return np.arange(n).sum()
+
+
+def test_records(tmp_path):
+    seen = []
+    expected = work(10)
+    with Profiler(hooks=[seen.append]) as prof:
+        assert work(10) == expected
+        with stage('outer'):
+            work(5)
+    names = [r['name'] for r in prof.records]
+    assert names == ['inner', 'work', 'inner', 'work', 'outer']
+    assert [r['depth'] for r in prof.records] == [1, 0, 2, 1, 0]
+    assert prof.records[0]['n'] == 10
+    assert seen == prof.records
+    assert all(r['wall'] >= 0 for r in prof.records)
+
+    summary = prof.summary()
+    assert summary.loc['work', 'calls'] == 2
+    trace = prof.to_chrome_trace(str(tmp_path / 'trace.json'))
+    with open(tmp_path / 'trace.json') as f:
+        assert json.load(f) == trace
+    assert sum(e['ph'] == 'X' for e in trace['traceEvents']) == 5
+
+
+def test_inactive():
+    with Profiler() as prof:
+        pass
+    assert work(10) == 45
+    assert prof.records == [] and prof.summary().empty
+
+
+def test_global_hook():
+    seen = []
+    add_hook(seen.append)
+    try:
+        with Profiler():
+            work(3)
+    finally:
+        remove_hook(seen.append)
+    with Profiler():
+        work(3)
+    assert [r['name'] for r in seen] == ['inner', 'work']
+
+
+def test_stop_open_stage():
+    """Detener el Profiler con etapas abiertas las cierra; salir de ellas
+    después no falla"""
+    prof = Profiler().start()
+    with stage('outer'):
+        with stage('inner'):
+            prof.stop()
+            result = work(4)
+    assert result == 6
+    assert [r['name'] for r in prof.records] == ['inner', 'outer']
+    assert all(r['wall'] is not None for r in prof.records)
@@ -0,0 +1,99 @@
+"""
+test_regressors.py
+
+Backends de RForestRegressor (regressor='rf', 'hgb' o un estimador de
+sklearn) y el n_jobs con que se entrenan.
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sklearn.ensemble import (HistGradientBoostingRegressor,
+                              RandomForestRegressor)
+
+import predictivehp as p
+from predictivehp.models import RForestRegressor
+from predictivehp.models._regressors import (accepts_sparse,
+                                             accepts_weights, is_forest,
+                                             make_regressor)
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 3, (300, 6)).astype(np.int32)
+    return X, (X.sum(axis=1) > 6).astype(int)
+
+
+def rfr(regressor, **kwargs):
+    r = RForestRegressor(regressor=regressor, **kwargs)
+    r.X = SimpleNamespace(cells=np.arange(300))
+    r.nx, r.ny = 300, 1
+    return r
+
+
+@pytest.mark.parametrize('regressor, cls', [
+    ('rf', RandomForestRegressor), ('hgb', HistGradientBoostingRegressor),
+])
+def test_make_regressor(regressor, cls):
+    assert type(make_regressor(regressor)) is cls
+    assert is_forest(make_regressor(regressor)) == (regressor == 'rf')
+    assert accepts_sparse(make_regressor(regressor)) == (regressor == 'rf')
+    assert accepts_weights(make_regressor(regressor))
+
+
+def test_make_regressor_estimator():
+    est = RandomForestRegressor(n_estimators=7, n_jobs=2)
+    clone = make_regressor(est)
+    assert clone is not est and clone.get_params() == est.get_params()
+    with pytest.raises(ValueError):
+        make_regressor('svm')
+
+
+def test_user_n_jobs(data):
+    """El n_jobs de un estimador del usuario se conserva, aunque la
+    configuración global sea otra"""
+    X, y = data
+    est = RandomForestRegressor(n_estimators=5, n_jobs=2)
+    r = rfr(est)
+    with p.config_context(n_jobs=1):
+        r.fit(X, y)
+    assert r.rfr.n_jobs == 2 and est.n_jobs == 2
+    assert not hasattr(est, 'estimators_')  # El original no se ajusta
+
+
+def test_string_n_jobs(data):
+    """Con regressor='rf' se usa el n_jobs de la configuración al
+    momento de entrenar"""
+    X, y = data
+    r = rfr('rf')
+    for n_jobs in (1, 2):
+        with p.config_context(n_jobs=n_jobs):
+            r.fit(X, y)
+        assert r.rfr.n_jobs == n_jobs
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_hgb(data, sparse):
+    X, y = data
+    r = rfr('hgb')
+    Z = sp.csr_matrix(X) if sparse else X
+    y_pred = r.fit(Z, y).predict(Z)
+    ref = HistGradientBoostingRegressor(max_bins=255).fit(X, y).predict(X)
+    assert isinstance(r.rfr, HistGradientBoostingRegressor)
+    assert np.allclose(y_pred, ref)
+
+
+def test_set_regressor(data):
+    X, y = data
+    r = rfr('rf')
+    r.fit(X, y).predict(X)
+    params = r.t_history, r.xc_size, r.yc_size, r.n_layers
+    r.set_parameters(*params, regressor='hgb')
+    assert isinstance(r.rfr, HistGradientBoostingRegressor)
+    assert r.row_cache == {}
+    # regressor=None mantiene el backend
+    r.set_parameters(*params)
+    assert isinstance(r.rfr, HistGradientBoostingRegressor)
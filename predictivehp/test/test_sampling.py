@@ -0,0 +1,103 @@
+"""
+test_sampling.py
+
+Submuestreo de las celdas vacías (negative_sample) y su uso en
+RForestRegressor con neg_rate.
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.neighbors import KNeighborsRegressor
+
+from predictivehp.models import RForestRegressor
+from predictivehp.models._features import FeatureView
+from predictivehp.models._sampling import empty_rows, negative_sample
+
+
+@pytest.fixture(scope='module')
+def data():
+    """200 celdas: 30 con features, 10 vacías con label 1 y 160 vacías
+    con label 0"""
+    rng = np.random.default_rng(0)
+    X = np.zeros((200, 5), dtype=np.int32)
+    X[:30] = rng.integers(1, 4, (30, 5))
+    y = np.zeros(200, dtype=int)
+    y[:20:2] = 1
+    y[30:40] = 1
+    return X, y
+
+
+def test_empty_rows(data):
+    X, _ = data
+    expected = ~X.any(axis=1)
+    assert np.array_equal(empty_rows(X), expected)
+    assert np.array_equal(empty_rows(sp.csr_matrix(X)), expected)
+    assert np.array_equal(empty_rows(FeatureView(X, np.arange(5)),
+                                     batch_size=7), expected)
+
+
+@pytest.mark.parametrize('rate', [0.05, 0.1, 0.33, 0.5, 1])
+def test_negative_sample(data, rate):
+    X, y = data
+    rows, weights = negative_sample(X, y, rate, random_state=0)
+    negative = ~X.any(axis=1) & (y == 0)
+
+    # Las filas positivas o con features nunca se descartan
+    assert np.isin(np.flatnonzero(~negative), rows).all()
+    assert np.all(np.diff(rows) > 0)
+    assert np.all(weights[~negative[rows]] == 1)
+
+    n_keep = negative[rows].sum()
+    assert n_keep == round(rate * negative.sum())
+    # El peso n_neg / n_keep reconstruye el total de celdas vacías
+    assert np.isclose(weights[negative[rows]].sum(), negative.sum())
+    assert np.isclose(weights.sum(), y.size)
+    # y la fracción ponderada de positivos es la de todas las celdas
+    assert np.isclose(np.average(y[rows], weights=weights), y.mean())
+
+
+def test_negative_sample_inputs(data):
+    X, y = data
+    dense = negative_sample(X, y, 0.25, random_state=1)
+    for Z in (sp.csr_matrix(X), FeatureView(X, np.arange(5))):
+        r, w = negative_sample(Z, y, 0.25, random_state=1)
+        assert np.array_equal(r, dense[0]) and np.array_equal(w, dense[1])
+    for rate in (0, 1.5):
+        with pytest.raises(ValueError):
+            negative_sample(X, y, rate)
+
+
+def fit_predict(regressor, X, y, neg_rate):
+    r = RForestRegressor(regressor=regressor, neg_rate=neg_rate)
+    r.X = SimpleNamespace(cells=np.arange(y.size))
+    r.nx, r.ny = y.size, 1
+    r.fit(X, y)
+    return r, r.predict(X)
+
+
+def test_empty_label(data):
+    """Sin sample_weight, las celdas vacías reciben la label media de
+    todas ellas, no la de la submuestra"""
+    X, y = data
+    empty = ~X.any(axis=1)
+    r, y_pred = fit_predict(KNeighborsRegressor(n_neighbors=1), X, y, 0.1)
+    assert r.empty_label == y[empty].mean()
+    assert np.all(y_pred[empty] == r.empty_label)
+    assert np.array_equal(y_pred[~empty], y[~empty].astype(float))
+
+
+def test_weighted_fit(data):
+    """Con sample_weight no se fija la label de las celdas vacías: el
+    peso hace que el forest estime su label media sin submuestrear"""
+    X, y = data
+    empty = ~X.any(axis=1)
+    forest = RandomForestRegressor(n_estimators=5, bootstrap=False,
+                                   random_state=0, n_jobs=1)
+    for neg_rate in (0.1, None):
+        r, y_pred = fit_predict(forest, X, y, neg_rate)
+        assert r.empty_label is None
+        assert np.allclose(y_pred[empty], y[empty].mean())
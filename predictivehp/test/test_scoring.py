@@ -0,0 +1,102 @@
+"""
+test_scoring.py
+
+score_points de cada modelo contra el score de su malla (o de la
+predicción por incidente) que usaban los métodos anteriores.
+"""
+
+import numpy as np
+import pytest
+
+import predictivehp.utils._aux_functions as af
+
+
+def get(model, name):
+    return [m for m in model.models if m.name == name][0]
+
+
+@pytest.fixture(scope='module')
+def promap(fitted):
+    return get(fitted, 'ProMap')
+
+
+@pytest.fixture(scope='module')
+def stkde(fitted):
+    return get(fitted, 'STKDE')
+
+
+@pytest.fixture(scope='module')
+def rfr(fitted):
+    return get(fitted, 'RForestRegressor')
+
+
+def test_promap_nodes(promap):
+    x, y = promap.xx.ravel(), promap.yy.ravel()
+    assert np.array_equal(promap.score_points(x, y),
+                          np.asarray(promap.prediction).ravel())
+    assert np.allclose(promap.score_points(x, y, exact=True),
+                       np.asarray(promap.prediction).ravel(), rtol=0,
+                       atol=1e-6)
+
+
+def test_promap_points(promap):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(promap.x_min, promap.x_max, 1000)
+    y = rng.uniform(promap.y_min, promap.y_max, 1000)
+    i, j = af.find_positions(promap.xx, promap.yy, x, y, promap.hx,
+                             promap.hy)
+    assert np.array_equal(promap.score_points(x, y), promap.prediction[i, j])
+
+    # Fuera de la malla find_positions usaba la celda del borde
+    outside = promap.score_points([promap.x_min - 10 * promap.hx],
+                                  [promap.y_min])
+    assert np.isnan(outside).all()
+
+
+def test_promap_cell_ids(promap):
+    ids = np.arange(promap.bins_x * promap.bins_y)
+    i, j = np.divmod(ids, promap.bins_y)
+    assert np.array_equal(promap.cell_ids(promap.xx[i, j],
+                                          promap.yy[i, j]), ids)
+
+
+def nodes(st):
+    x, y = np.mgrid[st.x_min:st.x_max:st.n_nodes * 1j,
+                    st.y_min:st.y_max:st.n_nodes * 1j]
+    return x.ravel(), y.ravel()
+
+
+def test_stkde_nodes(stkde):
+    x, y = nodes(stkde)
+    assert np.array_equal(stkde.cell_ids(x, y), np.arange(x.size))
+    assert np.array_equal(stkde.score_points(x, y), stkde.z_grid.ravel(),
+                          equal_nan=True)
+    for d, day in enumerate(stkde.days):
+        assert np.array_equal(stkde.score_points(x, y, t=day),
+                              stkde.f_cube[d].ravel(), equal_nan=True)
+    # Fuera de la ventana de predicción
+    assert np.isnan(stkde.score_points(x, y, t=stkde.days[-1] + 1)).all()
+
+    inside = ~np.isnan(stkde.z_grid.ravel())
+    assert np.allclose(stkde.score_points(x, y, exact=True)[inside],
+                       stkde.z_grid.ravel()[inside], rtol=1e-12, atol=0)
+
+
+def test_stkde_exact(stkde):
+    """Evaluado en el día de cada incidente de testeo, el score exacto es
+    f_delitos"""
+    X = stkde.X_test
+    assert np.allclose(stkde.score_points(X['x'], X['y'], t=X['y_day'],
+                                          exact=True),
+                       stkde.f_delitos, rtol=1e-12, atol=0)
+
+
+def test_rfr_points(rfr):
+    data = rfr.test_data()
+    x, y = data.geometry.x.to_numpy(), data.geometry.y.to_numpy()
+    old = rfr.score().reindex(data.index).to_numpy()
+    assert np.array_equal(rfr.score_points(x, y), old, equal_nan=True)
+    assert np.array_equal(rfr.cell_ids(x, y), data.index)
+    # t y exact se ignoran
+    assert np.array_equal(rfr.score_points(x, y, t=1, exact=True), old,
+                          equal_nan=True)
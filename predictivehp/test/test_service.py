@@ -0,0 +1,129 @@
+"""
+test_service.py
+
+ScoringService sobre un modelo guardado: agrupar muchas peticiones de un
+punto en batches da los mismos scores que score_points.
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from predictivehp.models import hotspot_index
+from predictivehp.service import InProcessClient, ScoringService
+
+
+@pytest.fixture(scope='module')
+def path(fitted, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('service') / 'model.data')
+    fitted.store(path)
+    return path
+
+
+@pytest.fixture(scope='module')
+def points(fitted):
+    pm = fitted.models[0]
+    rng = np.random.default_rng(0)
+    return rng.uniform(pm.x_min, pm.x_max, 60), \
+        rng.uniform(pm.y_min, pm.y_max, 60)
+
+
+def serve(path, shps, fn, **kwargs):
+    async def main():
+        async with ScoringService.load(path, shps=shps, **kwargs) as svc:
+            return await fn(svc, InProcessClient(svc))
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize('name, exact, timed', [
+    ('ProMap', False, False), ('ProMap', True, False),
+    ('RForestRegressor', False, False),
+    ('STKDE', False, False), ('STKDE', False, True), ('STKDE', True, True),
+])
+def test_score(fitted, shps, path, points, name, exact, timed):
+    x, y = points
+    m = [m for m in fitted.models if m.name == name][0]
+    t = np.full(x.size, m.days[0], dtype=float) if timed else None
+    old = m.score_points(x, y, t, exact=exact)
+
+    async def fn(svc, c):
+        single = await asyncio.gather(*[
+            c.score(name, [a], [b], None if t is None else [t[k]],
+                    exact=exact)
+            for k, (a, b) in enumerate(zip(x, y))])
+        batch = await c.score(name, x, y, t, exact=exact)
+        return np.concatenate(single), batch, svc.stats()['batches']
+
+    single, batch, stats = serve(path, shps, fn, max_delay=0.005)
+    assert np.array_equal(single, old, equal_nan=True)
+    assert np.array_equal(batch, old, equal_nan=True)
+    # Las peticiones de un punto se agruparon
+    (counts,) = stats.values()
+    assert counts['count'] < x.size
+
+
+def test_hotspots(fitted, shps, path):
+    pm = fitted.models[0]
+
+    async def fn(svc, c):
+        return await c.hotspots('ProMap', ap=0.05, polygons=True)
+
+    h = serve(path, shps, fn)
+    cells = hotspot_index(pm).cells(0.05)
+    assert h['i'] == cells['i'].tolist() and h['j'] == cells['j'].tolist()
+    assert np.array_equal(h['score'], cells['score'])
+    assert h['threshold'] == hotspot_index(pm).threshold(0.05)
+    assert h['geojson']['type'] == 'FeatureCollection'
+
+
+@pytest.mark.parametrize('route, payload, status', [
+    ('score', {'model': 'KDE', 'x': [0], 'y': [0]}, 'Unknown model'),
+    ('score', {'model': 'ProMap', 'x': [0, 1], 'y': [0]}, 'same shape'),
+    ('score', {'model': 'ProMap', 'x': [0]}, "Missing field 'y'"),
+    ('predict', {}, 'Unknown route'),
+])
+def test_errors(shps, path, route, payload, status):
+    async def fn(svc, c):
+        with pytest.raises(RuntimeError, match=status):
+            await c.request(route, **payload)
+        return (await c.request('models'))['models']
+
+    assert serve(path, shps, fn) == ['ProMap', 'RForestRegressor', 'STKDE']
+
+
+class Slow:
+    """Modelo que tarda delay segundos por batch y falla con x < 0"""
+    name = 'Slow'
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def score_points(self, x, y, t=None, exact=False):
+        time.sleep(self.delay)
+        if (x < 0).any():
+            raise ValueError("negative x")
+        return x + y
+
+
+def test_cancelled_requests():
+    """Una petición cancelada o un batch con error no detienen el
+    batcher: las peticiones siguientes se atienden"""
+    async def main():
+        svc = ScoringService(SimpleNamespace(models=[Slow(0.05)]),
+                             max_delay=0)
+        async with svc:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(svc.score('Slow', [1], [2]), 0.01)
+            with pytest.raises(ValueError, match='negative'):
+                await svc.score('Slow', [-1], [2])
+            return await svc.score('Slow', [1, 2], [3, 4])
+
+    assert np.array_equal(asyncio.run(main()), [4, 6])
+
+
+def test_stop_without_start():
+    asyncio.run(ScoringService(SimpleNamespace(models=[Slow(0)])).stop())
@@ -0,0 +1,64 @@
+"""
+test_shard.py
+
+La predicción por shards es igual a la predicción sin shards.
+"""
+
+import copy
+
+import numpy as np
+import pytest
+
+import predictivehp as p
+from predictivehp.models._shard import row_blocks
+
+
+@pytest.fixture(scope='module')
+def model(fitted):
+    return copy.deepcopy(fitted)
+
+
+def get(model, name):
+    return [m for m in model.models if m.name == name][0]
+
+
+@pytest.mark.parametrize('n', [1, 3, 8, 500])
+def test_row_blocks(n):
+    p_x = np.random.default_rng(0).integers(0, 120, 1000)
+    blocks = row_blocks(p_x, 120, n)
+    assert blocks[0][0] == 0 and blocks[-1][1] == 120
+    assert all(a[1] == b[0] for a, b in zip(blocks[:-1], blocks[1:]))
+    assert all(i_0 < i_1 for i_0, i_1 in blocks)
+    assert len(blocks) <= min(n, 120)
+
+
+@pytest.mark.parametrize('n_jobs, backend', [
+    (1, 'loky'), (4, 'threading'), (13, 'threading'), (2, 'loky'),
+])
+def test_promap(model, n_jobs, backend):
+    pm = get(model, 'ProMap')
+    pm.read_density = False
+    pm.predict()
+    plain, d_max = np.array(pm.prediction), pm.d_max
+    with p.config_context(backend=backend):
+        pm.predict(sharded=True, n_jobs=n_jobs)
+    assert pm.d_max == d_max
+    assert np.array_equal(pm.prediction, plain)
+
+
+def test_stkde(model):
+    st = get(model, 'STKDE')
+    st.f_delitos = None
+    plain = [np.array(a) for a in st.predict()] + [st.f_cube.copy()]
+    st.f_delitos = None
+    sharded = list(st.predict(sharded=True, n_jobs=2)) + [st.f_cube]
+    for a, b in zip(plain, sharded):
+        assert np.array_equal(a, b, equal_nan=True)
+
+
+def test_rfr(model):
+    rfr = get(model, 'RForestRegressor')
+    X, _ = model.prepare_rfr(mode='test')
+    plain = rfr.predict(X)
+    rfr.row_cache = {}
+    assert np.array_equal(rfr.predict(X, sharded=True, n_jobs=2), plain)
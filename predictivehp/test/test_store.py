@@ -0,0 +1,108 @@
+"""
+test_store.py
+
+Model.store / Model.load: el modelo cargado es igual al guardado.
+"""
+
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from predictivehp.models import Model
+from predictivehp.models._store import CACHES, DERIVED, EXCLUDE, HEAVY
+
+SKIP = EXCLUDE | CACHES | set(HEAVY) | set(DERIVED)
+
+
+def assert_same(a, b, attr):
+    if isinstance(a, pd.DataFrame):
+        pd.testing.assert_frame_equal(a, b, obj=attr)
+    elif isinstance(a, np.ndarray):
+        assert np.array_equal(a, b, equal_nan=a.dtype.kind == 'f'), attr
+    elif hasattr(a, 'to_arrays'):  # FeatureStore
+        (a_arrays, a_meta), (b_arrays, b_meta) = a.to_arrays(), \
+            b.to_arrays()
+        assert a_meta == b_meta, attr
+        for k in a_arrays:
+            assert np.array_equal(a_arrays[k], b_arrays[k]), attr
+    else:
+        assert type(a) is type(b), attr
+        try:
+            equal = bool(a == b)
+        except (TypeError, ValueError):  # e.g. dicts de arreglos
+            return
+        assert equal, attr
+
+
+@pytest.fixture(scope='module')
+def stored(fitted, shps, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('store') / 'model.data')
+    fitted.store(path)
+    return path, Model.load(path, shps=shps)
+
+
+def test_round_trip(fitted, stored):
+    _, loaded = stored
+    models = {m.name: m for m in loaded.models}
+    for m in fitted.models:
+        l_m = models[m.name].model
+        for attr, value in vars(m).items():
+            if attr not in SKIP:
+                assert_same(value, getattr(l_m, attr), f'{m.name}.{attr}')
+        for attr in CACHES & set(vars(m)):
+            assert getattr(l_m, attr) == {}
+        z, extent = m.score_grid()
+        l_z, l_extent = l_m.score_grid()
+        assert np.array_equal(np.asarray(z), np.asarray(l_z), equal_nan=True)
+        assert extent == l_extent
+
+
+def test_lazy_load(fitted, shps, stored):
+    path, _ = stored
+    loaded = Model.load(path, shps=shps)
+    assert not any(m.loaded for m in loaded.models)
+    rfr = [m for m in loaded.models if m.name == 'RForestRegressor'][0]
+    assert rfr.nx is not None and rfr.loaded
+    lazy = rfr.model.__dict__['_lazy']
+    assert {'rfr', 'data', 'incidents'} <= set(lazy)
+    assert isinstance(rfr.s_grid, np.memmap)
+
+    # El forest y el IncidentIndex se cargan al primer acceso
+    o_rfr = [m for m in fitted.models if m.name == 'RForestRegressor'][0]
+    X, _ = fitted.prepare_rfr(mode='test')
+    assert np.array_equal(rfr.rfr.predict(X), o_rfr.rfr.predict(X))
+    assert np.array_equal(rfr.test_data().index, o_rfr.test_data().index)
+    assert 'rfr' not in lazy and 'incidents' not in lazy
+
+
+def test_store_again(fitted, shps, tmp_path):
+    """Un modelo cargado se puede guardar sobre su propio directorio y
+    no quedan archivos de la versión anterior"""
+    path = str(tmp_path / 'model.data')
+    fitted.store(path)
+    stale = os.path.join(path, 'ProMap', 'stale.npy')
+    open(stale, 'wb').close()
+
+    loaded = Model.load(path, shps=shps)
+    grids = {m.name: np.array(m.score_grid()[0]) for m in loaded.models}
+    loaded.store(path)
+    assert not os.path.exists(stale)
+    assert sorted(os.listdir(tmp_path)) == ['model.data']
+
+    for m in Model.load(path, shps=shps).models:
+        assert np.array_equal(np.asarray(m.score_grid()[0]), grids[m.name],
+                              equal_nan=True)
+
+
+def test_old_version(fitted, shps, tmp_path):
+    path = str(tmp_path / 'model.data')
+    fitted.store(path)
+    state = os.path.join(path, 'ProMap', 'state.joblib')
+    d = joblib.load(state)
+    d['version'] = 1
+    joblib.dump(d, state)
+    with pytest.raises(ValueError):
+        Model.load(path, shps=shps).models[0].model
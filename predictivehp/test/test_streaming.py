@@ -0,0 +1,133 @@
+"""
+test_streaming.py
+
+Predicción de RForestRegressor evaluando cada fila distinta una sola vez
+contra forest.predict sobre todas las filas, y entrenamiento por bloques.
+"""
+
+import copy
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sklearn.ensemble import (HistGradientBoostingRegressor,
+                              RandomForestRegressor)
+
+from predictivehp.models._streaming import (dedup_predict, fit_batches,
+                                            predict_batches, unique_rows)
+
+
+@pytest.fixture(scope='module')
+def model(fitted):
+    return copy.deepcopy(fitted)
+
+
+@pytest.fixture(scope='module')
+def rfr(model):
+    return [m for m in model.models if m.name == 'RForestRegressor'][0]
+
+
+@pytest.fixture(scope='module')
+def X(model):
+    return model.prepare_rfr(mode='test')[0]
+
+
+def test_unique_rows(X):
+    X = np.asarray(X)
+    keys, first, inverse = unique_rows(X)
+    assert keys.size == np.unique(X, axis=0).shape[0] < X.shape[0]
+    assert np.array_equal(X[first][inverse.ravel()], X)
+
+
+@pytest.mark.parametrize('dense', [True, False])
+def test_dedup_predict(rfr, X, dense):
+    X = np.asarray(X) if dense else sp.csr_matrix(X)
+    old = rfr.rfr.predict(X)
+    assert np.array_equal(dedup_predict(rfr.rfr, X), old)
+    cache = {}
+    assert np.array_equal(dedup_predict(rfr.rfr, X, cache=cache), old)
+    assert len(cache) == unique_rows(np.asarray(
+        X.toarray() if sp.issparse(X) else X))[0].size
+    # Segunda pasada solo desde el cache
+    assert np.array_equal(dedup_predict(None, X, cache=cache), old)
+
+
+@pytest.mark.parametrize('batch_size, n_jobs', [(None, 1), (97, 1),
+                                                (97, 3), (1, 2)])
+def test_predict_batches(rfr, X, batch_size, n_jobs):
+    X = np.asarray(X)[:300]
+    assert np.array_equal(
+        predict_batches(rfr.rfr, X, batch_size=batch_size, n_jobs=n_jobs,
+                        cache={}),
+        rfr.rfr.predict(X))
+
+
+def test_row_cache(model, rfr, X):
+    old = rfr.rfr.predict(X)
+    rfr.row_cache = {}
+    assert np.array_equal(rfr.predict(X), old)
+    assert rfr.row_cache
+    assert np.array_equal(rfr.predict(X), old)
+
+    # Reajustar el forest vacía el cache
+    rfr.fit(*model.prepare_rfr(mode='train'))
+    assert rfr.row_cache == {}
+    assert np.array_equal(rfr.predict(X), rfr.rfr.predict(X))
+
+
+class Recorder:
+    """Matriz que registra cuántas filas se leen en cada acceso"""
+
+    def __init__(self, X):
+        self.X, self.reads = X, []
+        self.shape, self.dtype = X.shape, X.dtype
+
+    def __getitem__(self, rows):
+        self.reads.append(np.size(rows))
+        return self.X[rows]
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 3, (1000, 4)).astype(np.int32)
+    return X, X.sum(axis=1) + rng.random(1000)
+
+
+@pytest.mark.parametrize('batch_size', [100, 333, 1000])
+def test_fit_batches(data, batch_size):
+    X, y = data
+    forest = RandomForestRegressor(n_estimators=10, random_state=0)
+    r = Recorder(X)
+    fit_batches(forest, r, y, batch_size=batch_size, random_state=0)
+    assert len(forest.estimators_) == 10
+    assert len(r.reads) == int(np.ceil(1000 / batch_size))
+    assert max(r.reads) <= batch_size and sum(r.reads) == 1000
+
+
+def test_fit_batches_errors(data):
+    X, y = data
+    with pytest.raises(ValueError, match='forest'):
+        fit_batches(HistGradientBoostingRegressor(), X, y, batch_size=100)
+    # Más bloques que árboles: cada bloque excedería batch_size
+    with pytest.raises(ValueError, match='trees'):
+        fit_batches(RandomForestRegressor(n_estimators=5), X, y,
+                    batch_size=100)
+
+
+class RowSum:
+    """Regressor que acepta cualquier nº de columnas"""
+
+    def predict(self, X):
+        return np.asarray(X, dtype=float).sum(axis=1) + X.shape[1]
+
+
+def test_cache_layouts():
+    """Filas con los mismos bytes pero otro dtype o nº de columnas no
+    comparten la predicción del cache"""
+    X = np.random.default_rng(0).integers(0, 4, (200, 4)).astype(np.int32)
+    cache = {}
+    for Z in (X, X.view(np.float32), X.view(np.int64), X.view(np.int16),
+              X):
+        assert np.array_equal(dedup_predict(RowSum(), Z, cache=cache),
+                              RowSum().predict(Z), equal_nan=True)
@@ -0,0 +1,79 @@
+"""
+test_synthetic.py
+
+make_incidents: reproducible con una semilla fija y con el formato de
+get_data.
+"""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from predictivehp.utils._synthetic import (FIXTURE, load_councils,
+                                           load_incidents, make_incidents)
+
+COLUMNS = ['x', 'y', 'date', 'month1', 'y_day']
+
+
+@pytest.fixture(scope='module')
+def df():
+    return make_incidents(3000, seed=1)
+
+
+def test_seed(df):
+    assert make_incidents(3000, seed=1).equals(df)
+    other = make_incidents(3000, seed=2)
+    assert not np.array_equal(other['x'], df['x'])
+
+
+def test_schema(df):
+    assert list(df.columns) == COLUMNS and len(df) == 3000
+    assert df.index.equals(pd.RangeIndex(3000))
+    assert df['x'].dtype == df['y'].dtype == np.float64
+    assert df['y_day'].dtype == np.int64
+    assert df['date'].map(type).eq(date).all()
+    assert df['month1'].dtype == object
+
+    dates = pd.to_datetime(df['date'])
+    assert np.all(np.diff(df['y_day']) >= 0)
+    assert np.array_equal(df['y_day'], dates.dt.dayofyear)
+    assert np.array_equal(df['month1'], dates.dt.month_name())
+    assert (dates.dt.year == 2017).all()
+
+
+def test_inside(df):
+    region = shapely.union_all(load_councils().geometry.values)
+    assert shapely.contains_xy(region, df['x'], df['y']).all()
+
+
+@pytest.mark.parametrize('offenses', [
+    ['BURGLARY', 'THEFT'], {'BURGLARY': 0.9, 'THEFT': 0.1},
+])
+def test_offenses(df, offenses):
+    off = make_incidents(3000, offenses=offenses, seed=1)
+    assert list(off.columns) == COLUMNS[:4] + ['offincident', 'y_day']
+    assert set(off['offincident']) == set(offenses)
+    # Los tipos se sortean al final: los incidentes son los mismos
+    assert off.drop(columns='offincident').equals(df)
+    if isinstance(offenses, dict):
+        assert np.isclose((off['offincident'] == 'BURGLARY').mean(), 0.9,
+                          atol=0.03)
+
+
+def test_leap_year():
+    df = make_incidents(2000, year=2016, background=1, seed=0)
+    assert (pd.to_datetime(df['date']).dt.year == 2016).all()
+    assert df['y_day'].max() == 366
+
+
+def test_load_incidents(df, tmp_path):
+    path = tmp_path / 'incidents.csv'
+    df.to_csv(path, index=False)
+    read = load_incidents(str(path))
+    assert read[COLUMNS[2:]].equals(df[COLUMNS[2:]])
+    assert np.allclose(read[['x', 'y']], df[['x', 'y']])
+    fixture = load_incidents(FIXTURE)
+    assert list(fixture.columns) == COLUMNS
@@ -0,0 +1,206 @@
+"""
+test_vectorized.py
+
+Versiones vectorizadas contra los loops por incidente que reemplazan.
+"""
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import predictivehp.utils._aux_functions as af
+from predictivehp.utils._synthetic import make_incidents
+
+
+@pytest.fixture(scope='module')
+def promap(fitted):
+    return [m for m in fitted.models if m.name == 'ProMap'][0]
+
+
+@pytest.fixture(scope='module')
+def points(promap):
+    """Puntos en la malla de ProMap, incluyendo los nodos y los bordes
+    de las celdas (find_position falla fuera de ella)"""
+    rng = np.random.default_rng(0)
+    x_nodes, y_nodes = promap.xx[:, 0], promap.yy[0, :]
+    x = np.concatenate([rng.uniform(promap.x_min, promap.x_max, 500),
+                        x_nodes, x_nodes - promap.hx / 2])
+    y = rng.choice(np.concatenate([y_nodes, y_nodes - promap.hy / 2,
+                                   rng.uniform(promap.y_min, promap.y_max,
+                                               500)]), x.size)
+    return x, y
+
+
+def test_find_positions(promap, points):
+    x, y = points
+    old = np.array([af.find_position(promap.xx, promap.yy, a, b,
+                                     promap.hx, promap.hy)
+                    for a, b in zip(x, y)])
+    i, j = af.find_positions(promap.xx, promap.yy, x, y, promap.hx,
+                             promap.hy)
+    assert np.array_equal(i, old[:, 0]) and np.array_equal(j, old[:, 1])
+
+
+def test_test_scores(promap):
+    y = promap.y[promap.y['y_day'] <= promap.dias_train + promap.lp]
+    old = [promap.prediction[af.find_position(promap.xx, promap.yy, a, b,
+                                              promap.hx, promap.hy)]
+           for a, b in zip(y['x_point'], y['y_point'])]
+    assert np.array_equal(promap.test_scores()[2], old)
+
+
+@pytest.mark.parametrize('c', [0.3, [0.2, 0.5, 0.8], [0.8, 0.2]])
+def test_captured_levels(promap, c):
+    """Nivel de cada incidente con np.digitize contra el loop de
+    iterrows de ProMap.heatmap, una pasada por threshold"""
+    c = np.sort(np.atleast_1d(c))
+    y = promap.y
+    old = np.zeros(len(y), dtype=int)
+    for index_c, c_i in enumerate(c, start=1):
+        for k, (_, row) in enumerate(y.iterrows()):
+            if row['y_day'] <= promap.dias_train + promap.lp:
+                x_pos, y_pos = af.find_position(
+                    promap.xx, promap.yy, row['x_point'], row['y_point'],
+                    promap.hx, promap.hy)
+                if promap.prediction[x_pos][y_pos] >= c_i:
+                    old[k] = index_c
+            else:
+                break
+
+    _, _, scores = promap.test_scores()
+    assert np.array_equal(np.digitize(scores, c), old)
+
+
+@pytest.mark.parametrize('c', [None, 0.3, [0.2, 0.5, 0.8]])
+def test_score_levels(promap, c):
+    z = np.asarray(promap.prediction)
+    if c is None:
+        old = z
+    elif np.ndim(c) == 0:
+        old = np.where(z >= c, 1, 0)
+    else:
+        # El loop de heatmap usaba z > c_i; ahora las celdas siguen la
+        # misma regla z >= c_i que los incidentes
+        old = np.zeros(z.shape)
+        for c_i in c:
+            old[z >= c_i] += 1
+        old = old / np.max(old)
+    assert np.array_equal(af.score_levels(z, c), old)
+
+
+@pytest.mark.parametrize('c', [0.5, [0.25, 0.5, 0.75]])
+def test_levels_on_threshold(c):
+    """Un score igual a un threshold queda en el mismo nivel como celda
+    y como incidente, y cuenta como hit"""
+    scores = np.array([0, 0.25, 0.3, 0.5, 0.75, 1])
+    cells = af.score_levels(scores, c)
+    groups = af.incident_groups(scores, c, {i: i for i in range(1, 5)})
+    incidents = np.zeros(scores.size)
+    for level, (mask, _, _) in enumerate(groups):
+        incidents[mask] = level
+    assert np.array_equal(cells * np.size(c), incidents)
+    assert incidents[scores == 0.5] == np.sum(np.atleast_1d(c) <= 0.5)
+
+
+def old_counts(promap, df, keep):
+    """Matriz de incidentes como la llenaban load_train_matrix y
+    load_test_matrix, sumando find_position fila a fila"""
+    matrix = np.zeros((promap.bins_x, promap.bins_y))
+    for _, row in df.iterrows():
+        if keep(row['y_day']):
+            x_pos, y_pos = af.find_position(promap.xx, promap.yy,
+                                            row['x_point'], row['y_point'],
+                                            promap.hx, promap.hy)
+            matrix[x_pos][y_pos] += 1
+    return matrix
+
+
+def test_grid_counts(promap, points):
+    x, y = points
+    old = np.zeros(promap.xx.shape)
+    for a, b in zip(x, y):
+        old[af.find_position(promap.xx, promap.yy, a, b, promap.hx,
+                             promap.hy)] += 1
+    assert np.array_equal(
+        af.grid_counts(promap.xx, promap.yy, x, y, promap.hx, promap.hy),
+        old)
+
+
+def test_incident_matrices(promap):
+    train = old_counts(promap, promap.X,
+                       lambda t: t >= promap.dias_train - promap.bw_t)
+    test = old_counts(promap, promap.y,
+                      lambda t: t <= promap.dias_train + promap.lp)
+    assert train.sum() > 0 and test.sum() > 0
+    assert np.array_equal(promap.load_train_matrix(), train)
+    assert np.array_equal(promap.load_test_matrix(), test)
+
+
+def test_matrix_cache(promap):
+    """Las matrices se reutilizan mientras no cambien los datos"""
+    matrix = promap.load_test_matrix()
+    assert promap.load_test_matrix() is matrix
+
+    y = promap.y
+    try:
+        promap.y = y.iloc[::2]
+        half = promap.load_test_matrix()
+        assert half is not matrix
+        assert np.array_equal(half, old_counts(
+            promap, promap.y, lambda t: t <= promap.dias_train + promap.lp))
+    finally:
+        promap.y = y
+        promap.load_test_matrix()
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks',
+                       'fixtures', 'socrata_1k.json')
+
+
+def old_parse(results):
+    """Formato de get_data con apply y strptime por registro"""
+    df = pd.DataFrame.from_records(results)
+    for col in ['x_coordinate', 'y_cordinate']:
+        df[col] = df[col].apply(lambda x: float(x))
+    df['date1'] = df['date1'].apply(
+        lambda x: datetime.strptime(x.split(' ')[0], '%Y-%m-%d').date())
+    df = df[['x_coordinate', 'y_cordinate', 'date1', 'month1']].copy()
+    df['y_day'] = df['date1'].apply(lambda x: x.timetuple().tm_yday)
+    df.rename(columns={'x_coordinate': 'x', 'y_cordinate': 'y',
+                       'date1': 'date'}, inplace=True)
+    # El sort de get_data no era estable; el orden entre incidentes del
+    # mismo día no estaba definido
+    df.sort_values(by=['date'], inplace=True, kind='stable')
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def records(n=500, seed=0):
+    """Registros de la Socrata API en desorden, como en bench_pipeline"""
+    df = make_incidents(n, seed=seed).sample(frac=1, random_state=seed)
+    return [{'incidentnum': f'{i:06d}-{d.year}', 'year1': str(d.year),
+             'date1': f'{d:%Y-%m-%d} 00:00:00.000', 'month1': m,
+             'x_coordinate': f'{x:.4f}', 'y_cordinate': f'{y:.4f}',
+             'offincident': 'BURGLARY OF HABITATION - FORCED ENTRY'}
+            for i, (d, m, x, y) in enumerate(zip(df['date'], df['month1'],
+                                                 df['x'], df['y']))]
+
+
+def test_parse_socrata():
+    with open(FIXTURE) as f:
+        fixture = json.load(f)
+    for results in (fixture, records()):
+        pd.testing.assert_frame_equal(af.parse_socrata(results),
+                                      old_parse(results))
+
+
+def test_parse_socrata_iso():
+    """Fechas con separador 'T' (formato ISO de la API)"""
+    results = records(50)
+    iso = [dict(r, date1=r['date1'].replace(' ', 'T')) for r in results]
+    pd.testing.assert_frame_equal(af.parse_socrata(iso),
+                                  af.parse_socrata(results))
@@ -7,11 +7,19 @@ from ._aux_functions import diamond
 from ._aux_functions import il_neighbors
 from ._aux_functions import to_df_col
 from ._aux_functions import filter_cells
+from ._aux_functions import in_shp
+from ._aux_functions import polygon_labels
 
 from ._aux_functions import n_semanas
 from ._aux_functions import cells_distance
 from ._aux_functions import linear_distance
 from ._aux_functions import find_position
+from ._aux_functions import find_positions
+from ._aux_functions import cell_index
+from ._aux_functions import gather
+from ._aux_functions import grid_counts
+from ._aux_functions import promap_density
+from ._aux_functions import promap_points
 from ._aux_functions import n_celdas_pintar
 from ._aux_functions import radio_pintar
 from ._aux_functions import limites_x
@@ -21,12 +29,23 @@ from ._aux_functions import print_mes
 from ._aux_functions import checked_points_pm
 
 from ._aux_functions import get_data
+from ._aux_functions import parse_socrata
 from ._aux_functions import get_Socrata_data
 from ._aux_functions import get_stored_data
 from ._aux_functions import shps_processing
 
 from ._cmaps import truncate_cmap
 
+from ._cache import ArtifactCache
+from ._index import IncidentIndex
+from ._synthetic import make_incidents
+from ._synthetic import load_incidents
+from ._profiling import Profiler
+from ._profiling import stage
+from ._profiling import profiled
+from ._profiling import add_hook
+from ._profiling import remove_hook
+
 
 __all__ = [
     'timer',
@@ -38,11 +57,19 @@ __all__ = [
     'il_neighbors',
     'to_df_col',
     'filter_cells',
+    'in_shp',
+    'polygon_labels',
 
     'n_semanas',
     'cells_distance',
     'linear_distance',
     'find_position',
+    'find_positions',
+    'cell_index',
+    'gather',
+    'grid_counts',
+    'promap_density',
+    'promap_points',
     'n_celdas_pintar',
     'radio_pintar',
     'limites_x',
@@ -52,11 +79,22 @@ __all__ = [
     'checked_points_pm',
 
     'get_data',
+    'parse_socrata',
     'get_Socrata_data',
     'get_stored_data',
     'shps_processing',
 
-    'truncate_cmap'
+    'truncate_cmap',
+
+    'ArtifactCache',
+    'IncidentIndex',
+    'make_incidents',
+    'load_incidents',
+    'Profiler',
+    'stage',
+    'profiled',
+    'add_hook',
+    'remove_hook',
 ]
 
 
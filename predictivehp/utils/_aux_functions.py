@@ -1,30 +1,132 @@
 from datetime import datetime
+from functools import wraps
 from math import floor, sqrt, ceil
 from time import time
 
-import geopandas as gpd
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.signal import convolve2d
-from shapely.geometry import Point
-from sodapy import Socrata
 
 import predictivehp._credentials as cre
+from predictivehp._config import config_context, get_config
+from predictivehp.utils._cache import ArtifactCache, hash_arrays, hash_frame, \
+    hash_geoms, make_key
+from predictivehp.utils._lazy import lazy_import, plt
+from predictivehp.utils._profiling import profiled
+
+gpd = lazy_import('geopandas')
+joblib = lazy_import('joblib')
+signal = lazy_import('scipy.signal')
 
 
 # General
 
 def timer(fn):
+    @wraps(fn)
     def inner(*args, **kwargs):
         st = time()
-        fn(*args, **kwargs)
+        ans = fn(*args, **kwargs)
         print(f"\nFinished! ({time() - st:3.1f} sec)")
+        return ans
 
     return inner
 
 
-def get_data(year=2017, n=150000):
+class _WithConfig:
+    def __init__(self, fn, config):
+        """fn ejecutada con la configuración de ejecución config. Los
+        workers de los backends basados en procesos parten con la
+        configuración por defecto (o la de las variables de entorno), no
+        con la del proceso que los lanza.
+
+        Parameters
+        ----------
+        fn : callable
+        config : dict
+          Ver get_config
+        """
+        self.fn, self.config = fn, config
+
+    def __call__(self, item):
+        with config_context(**self.config):
+            return self.fn(item)
+
+
+def parallel_map(fn, iterable, n_jobs=None, backend=None, config=None):
+    """Aplica fn a cada elemento de iterable en paralelo, usando la
+    configuración de ejecución del paquete (ver set_config).
+
+    Con backends basados en procesos, cada worker ejecuta fn con la
+    configuración vigente en el proceso que llama (cache_dir,
+    memory_limit, etc.).
+
+    Parameters
+    ----------
+    fn : callable
+      Debe ser serializable (definida a nivel de módulo) para los
+      backends basados en procesos
+    iterable : iterable
+    n_jobs : int
+      None usa get_config()['n_jobs']
+    backend : str
+      None usa get_config()['backend']
+    config : dict
+      Parámetros de la configuración que se cambian para las llamadas
+      a fn, p. ej. {'n_jobs': 1} para que no lancen sus propios
+      workers. No se admite con el backend 'threading'
+
+    Returns
+    -------
+    list
+      Resultados en el mismo orden de iterable
+    """
+    parent = get_config()
+    n_jobs = parent['n_jobs'] if n_jobs is None else n_jobs
+    backend = parent['backend'] if backend is None else backend
+    items = list(iterable)
+    if n_jobs == 1 or len(items) <= 1:
+        # En el mismo proceso solo se aplican los cambios pedidos
+        fn = _WithConfig(fn, config) if config else fn
+        return [fn(item) for item in items]
+    if backend == 'threading':
+        if config:
+            raise ValueError("config can't be changed per call with the "
+                             "threading backend, the threads share it")
+    else:
+        fn = _WithConfig(fn, dict(parent, **(config or {})))
+    return joblib.Parallel(n_jobs=n_jobs, backend=backend)(
+        joblib.delayed(fn)(item) for item in items
+    )
+
+
+def get_data(year=2017, n=150000,
+             offense='BURGLARY OF HABITATION - FORCED ENTRY'):
+    """Descarga los incidentes del año dado desde Socrata.
+
+    Parameters
+    ----------
+    year : int
+    n : int
+      Nº máximo de registros a extraer
+    offense : {str, list, None}
+      Tipo(s) de incidente (offincident). Con una lista o None (todos
+      los tipos) se conserva la columna 'offincident' para separar los
+      incidentes de cada tipo
+
+    Returns
+    -------
+    pd.DataFrame
+      Columnas x, y (en el crs de la base de datos), date, month1, y_day
+    """
+    from sodapy import Socrata
+
+    if offense is None:
+        off_filter = ''
+    elif isinstance(offense, str):
+        off_filter = f"and offincident = '{offense}'"
+    else:
+        off_filter = "and offincident in ({})".format(
+            ', '.join(f"'{o}'" for o in offense))
+
     # print("\nRequesting data...")
     with Socrata(cre.socrata_domain,
                  cre.API_KEY_S,
@@ -45,7 +147,7 @@ def get_data(year=2017, n=150000):
                     and date1 is not null
                     and x_coordinate is not null
                     and y_cordinate is not null
-                    and offincident = 'BURGLARY OF HABITATION - FORCED ENTRY'
+                    {off_filter}
                 order by date1
                 limit
                     {n}
@@ -54,39 +156,55 @@ def get_data(year=2017, n=150000):
         results = client.get(cre.socrata_dataset_identifier,
                              query=query,
                              content_type='json')
-        df = pd.DataFrame.from_records(results)
-        # print("\n"
-        #       f"\tn = {n} incidents requested  Year = {year}"
-        #       "\n"
-        #       f"\t{data.shape[0]} incidents successfully retrieved!")
+    return parse_socrata(results, offense=offense)
 
-        # DB Cleaning & Formatting
-        for col in ['x_coordinate', 'y_cordinate']:
-            df.loc[:, col] = df[col].apply(
-                lambda x: float(x))
-        df.loc[:, 'x_coordinate'] = df['x_coordinate'].apply(
-            lambda x: float(x))
-        df.loc[:, 'y_cordinate'] = df['y_cordinate'].apply(
-            lambda x: float(x))
-        df.loc[:, 'date1'] = df['date1'].apply(  # OJO AL SEPARADOR ' '
-            lambda x: datetime.strptime(
-                x.split(' ')[0], '%Y-%m-%d')
-        )
-        df.loc[:, 'date1'] = df["date1"].apply(lambda x: x.date())
 
-        df = df[['x_coordinate', 'y_cordinate', 'date1', 'month1']]
-        df.loc[:, 'y_day'] = df["date1"].apply(
-            lambda x: x.timetuple().tm_yday
-        )
-        df.rename(columns={'x_coordinate': 'x',
-                           'y_cordinate': 'y',
-                           'date1': 'date'},
-                  inplace=True)
+def parse_socrata(results, offense='BURGLARY OF HABITATION - FORCED ENTRY'):
+    """Da formato a los registros entregados por la Socrata API.
+    Separado de get_data para poder procesar registros guardados (e.g.
+    fixtures de los benchmarks) sin conexión.
 
-        df.sort_values(by=['date'], inplace=True)
-        df.reset_index(drop=True, inplace=True)
+    Parameters
+    ----------
+    results : list
+      Registros (dicts) con los campos de la consulta de get_data
+    offense : {str, list, None}
+      Ver get_data
 
-        return df
+    Returns
+    -------
+    pd.DataFrame
+      Columnas x, y, date, month1, y_day y, si offense no es un str,
+      offincident
+    """
+    df = pd.DataFrame.from_records(results)
+    # print("\n"
+    #       f"\tn = {n} incidents requested  Year = {year}"
+    #       "\n"
+    #       f"\t{data.shape[0]} incidents successfully retrieved!")
+
+    # DB Cleaning & Formatting
+    for col in ['x_coordinate', 'y_cordinate']:
+        df[col] = df[col].astype(float)
+    # OJO AL SEPARADOR ' '
+    df['date1'] = pd.to_datetime(
+        df['date1'].str.split(' ').str[0].str.split('T').str[0],
+        format='%Y-%m-%d').dt.date
+
+    columns = ['x_coordinate', 'y_cordinate', 'date1', 'month1']
+    if not isinstance(offense, str):
+        columns.append('offincident')
+    df = df[columns].copy()
+    df['y_day'] = df['date1'].apply(lambda x: x.timetuple().tm_yday)
+    df.rename(columns={'x_coordinate': 'x',
+                       'y_cordinate': 'y',
+                       'date1': 'date'},
+              inplace=True)
+
+    df.sort_values(by=['date'], inplace=True, kind='stable')
+    df.reset_index(drop=True, inplace=True)
+
+    return df
 
 
 def get_Socrata_data(domain=cre.socrata_domain, app_token=cre.API_KEY_S,
@@ -127,6 +245,8 @@ def get_Socrata_data(domain=cre.socrata_domain, app_token=cre.API_KEY_S,
     -------
     pd.DataFrame
     """
+    from sodapy import Socrata
+
     with Socrata(domain, app_token,
                  username=username, password=password) as client:
         query = \
@@ -185,7 +305,7 @@ def get_stored_data(path='../predictivehp/data/SOCRATA_DATA_Dallas.xlsx'):
     return pd.read_excel(path, index_col=0)
 
 
-def shps_processing(s_shp='', c_shp='', cl_shp=''):
+def shps_processing(s_shp='', c_shp='', cl_shp='', crs=2276):
     """
 
     Parameters
@@ -193,6 +313,8 @@ def shps_processing(s_shp='', c_shp='', cl_shp=''):
     s_shp
     c_shp
     cl_shp
+    crs
+      crs de los shapefiles, se transforman a EPSG:3857
 
     Returns
     -------
@@ -202,15 +324,15 @@ def shps_processing(s_shp='', c_shp='', cl_shp=''):
     shps = {}
     if s_shp:
         streets = gpd.read_file(filename=s_shp)
-        streets.crs = 2276
+        streets.crs = crs
         streets.to_crs(epsg=3857, inplace=True)
     if c_shp:
         councils = gpd.read_file(filename=c_shp)
-        councils.crs = 2276
+        councils.crs = crs
         councils.to_crs(epsg=3857, inplace=True)
     if cl_shp:
         c_limits = gpd.read_file(filename=cl_shp)
-        c_limits.crs = 2276
+        c_limits.crs = crs
         c_limits.to_crs(epsg=3857, inplace=True)
 
     shps['streets'], shps['councils'], shps['c_limits'] = \
@@ -268,31 +390,16 @@ def checked_points(points, shp):
 
     Parameters
     ----------
-    points
+    points : np.ndarray
+      Arreglo (3, n) con las coordenadas x, y, t
     shp : gpd.GeoDataFrame
       Councils shp
     Returns
     -------
     np.ndarray
+      Los puntos que están dentro de shp
     """
-    dallas_shp = shp
-    df_points = pd.DataFrame(
-        {'x': points[0, :], 'y': points[1, :], 't': points[2, :]}
-    )
-    inc_points = df_points[['x', 'y']].apply(lambda row:
-                                             Point(row['x'], row['y']),
-                                             axis=1)
-    geo_inc = gpd.GeoDataFrame({'geometry': inc_points, 'day': df_points['t']})
-    geo_inc.crs = dallas_shp.crs
-    valid_inc = gpd.tools.sjoin(geo_inc, dallas_shp,
-                                how='inner', op='intersects').reset_index()
-    valid_inc_2 = valid_inc[['geometry', 'day']]
-
-    x = valid_inc_2['geometry'].apply(lambda row: row.x)
-    y = valid_inc_2['geometry'].apply(lambda row: row.y)
-    t = valid_inc_2['day']
-
-    return np.array([x, y, t])
+    return points[:, in_shp(points[0, :], points[1, :], shp)]
 
 
 # ML
@@ -354,7 +461,7 @@ def il_neighbors(matrix, i=1):
     """
     kernel = diamond(d=2 * i + 1)
 
-    return convolve2d(in1=matrix, in2=kernel, mode='same')
+    return signal.convolve2d(in1=matrix, in2=kernel, mode='same')
 
 
 def to_df_col(D):
@@ -372,6 +479,7 @@ def to_df_col(D):
     return D.flatten()
 
 
+@profiled()
 def filter_cells(df, shp, verbose=False):
     """Completa la columna "in_dallas" del dataframe, explicitando cuales
     de las celdas se encuentran dentro de Dallas.
@@ -402,7 +510,7 @@ def filter_cells(df, shp, verbose=False):
     print('\t\tFiltering...') if verbose else None
     geo_pd = gpd.tools.sjoin(geo_pd, dallas_shp,
                              how='left',
-                             op='intersects')[['in_dallas', 'index_right']]
+                             predicate='intersects')[['in_dallas', 'index_right']]
 
     print('\t\tUpdating dataframe... ', end='') if verbose else None
     geo_pd.fillna(value={'index_right': 14}, inplace=True)  # para filtrar
@@ -417,6 +525,99 @@ def filter_cells(df, shp, verbose=False):
     return aux_df
 
 
+@profiled()
+def in_shp(x, y, shp, verbose=False, use_cache=False):
+    """Versión vectorizada de filter_cells. Indica cuales de los puntos
+    (x, y) intersectan alguno de los polígonos del shapefile.
+
+    Parameters
+    ----------
+    x : np.ndarray
+    y : np.ndarray
+    shp : gpd.GeoDataFrame
+      Councils shp
+    use_cache : bool
+      True para guardar la máscara en el ArtifactCache. Útil para las
+      mallas, que se repiten entre ajustes para una misma región
+
+    Returns
+    -------
+    np.ndarray
+      Arreglo booleano con True para los puntos dentro de la ciudad
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if use_cache:
+        cache = ArtifactCache()
+        key = make_key(points=hash_arrays(x, y), shp=hash_geoms(shp))
+        arrays, _ = cache.load_arrays('shp_mask', key)
+        if arrays is not None:
+            return arrays['mask']
+
+    print('\tFiltering cells...') if verbose else None
+    geo_pts = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y),
+                               crs=shp.crs)
+    joined = gpd.tools.sjoin(geo_pts, shp[[shp.geometry.name]], how='inner',
+                             predicate='intersects')
+    mask = np.zeros(len(geo_pts), dtype=bool)
+    mask[np.unique(joined.index.to_numpy())] = True
+    if use_cache:
+        cache.save_arrays('shp_mask', key, {'mask': mask})
+    return mask
+
+
+@profiled()
+def polygon_labels(x, y, shp, verbose=False, use_cache=False):
+    """Asigna cada punto (x, y) al polígono del shapefile que lo
+    contiene o, si está fuera de todos, al polígono con el centroide más
+    cercano. Todos los puntos quedan asignados, por lo que las etiquetas
+    particionan la malla.
+
+    Parameters
+    ----------
+    x : np.ndarray
+    y : np.ndarray
+    shp : gpd.GeoDataFrame
+      Councils shp
+    use_cache : bool
+      True para guardar las etiquetas en el ArtifactCache
+
+    Returns
+    -------
+    np.ndarray
+      Posición (0, ..., len(shp) - 1) del polígono de cada punto
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if use_cache:
+        cache = ArtifactCache()
+        key = make_key(points=hash_arrays(x, y), shp=hash_geoms(shp))
+        arrays, _ = cache.load_arrays('shp_labels', key)
+        if arrays is not None:
+            return arrays['labels']
+
+    print('\tLabeling cells...') if verbose else None
+    polygons = shp[[shp.geometry.name]].reset_index(drop=True)
+    geo_pts = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y),
+                               crs=shp.crs)
+    joined = gpd.tools.sjoin(geo_pts, polygons, how='inner',
+                             predicate='intersects')
+    # En los bordes compartidos se usa el primer polígono
+    joined = joined[~joined.index.duplicated(keep='first')]
+
+    labels = np.full(x.size, -1, dtype=np.int64)
+    labels[joined.index.to_numpy()] = joined['index_right'].to_numpy()
+    outside = labels < 0
+    if outside.any():
+        c = polygons.geometry.centroid
+        d = (x[outside, None] - c.x.to_numpy()) ** 2 + \
+            (y[outside, None] - c.y.to_numpy()) ** 2
+        labels[outside] = d.argmin(axis=1)
+    if use_cache:
+        cache.save_arrays('shp_labels', key, {'labels': labels})
+    return labels
+
+
 # ProMap
 
 def n_semanas(total_dias, dia):
@@ -500,6 +701,227 @@ def find_position(mgridx, mgridy, x, y, hx, hy):
     return pos_x, pos_y
 
 
+def find_positions(mgridx, mgridy, x, y, hx, hy):
+    """Versión vectorizada de find_position. Ubica cada uno de los
+    puntos (x, y) en la malla mediante búsqueda binaria sobre los bordes
+    de las celdas.
+
+    Parameters
+    ----------
+    mgridx : np.ndarray
+    mgridy : np.ndarray
+    x : np.ndarray
+    y : np.ndarray
+    hx : float
+    hy : float
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+      Índices (i, j) de la celda de cada punto. Los puntos fuera de la
+      malla se asignan a la celda del borde más cercana
+    """
+    x_desplazada = mgridx[:, 0] - hx / 2
+    y_desplazada = mgridy[0, :] - hy / 2
+    pos_x = np.searchsorted(x_desplazada, x, side='right') - 1
+    pos_y = np.searchsorted(y_desplazada, y, side='right') - 1
+    return np.clip(pos_x, 0, x_desplazada.size - 1), \
+        np.clip(pos_y, 0, y_desplazada.size - 1)
+
+
+def cell_index(x, y, x_0, y_0, hx, hy, nx, ny):
+    """Id de la celda de cada punto en una malla regular, calculado
+    aritméticamente (O(1) por punto).
+
+    Parameters
+    ----------
+    x : np.ndarray
+    y : np.ndarray
+    x_0 : float
+    y_0 : float
+      Esquina inferior izquierda de la celda (0, 0)
+    hx : float
+    hy : float
+      Tamaño de las celdas
+    nx : int
+    ny : int
+
+    Returns
+    -------
+    np.ndarray
+      n = i * ny + j, -1 para los puntos fuera de la malla
+    """
+    i = np.floor((np.asarray(x, dtype=float) - x_0) / hx)
+    j = np.floor((np.asarray(y, dtype=float) - y_0) / hy)
+    inside = (0 <= i) & (i < nx) & (0 <= j) & (j < ny)
+    return np.where(inside, i * ny + j, -1).astype(np.int64)
+
+
+def gather(values, ids):
+    """values[ids], con nan para los ids negativos.
+
+    Parameters
+    ----------
+    values : np.ndarray
+    ids : np.ndarray
+
+    Returns
+    -------
+    np.ndarray
+    """
+    ids = np.asarray(ids)
+    return np.where(ids >= 0, values[np.maximum(ids, 0)], np.nan)
+
+
+def grid_counts(mgridx, mgridy, x, y, hx, hy):
+    """Cantidad de puntos (x, y) en cada celda de la malla, calculada con
+    un único np.histogram2d. Equivale a sumar 1 en la posición entregada
+    por find_positions para cada punto.
+
+    Parameters
+    ----------
+    mgridx : np.ndarray
+    mgridy : np.ndarray
+    x : np.ndarray
+    y : np.ndarray
+    hx : float
+    hy : float
+
+    Returns
+    -------
+    np.ndarray
+      Matriz con la forma de mgridx
+    """
+
+    def edges(nodes, h):
+        e = nodes - h / 2
+        return np.append(e, e[-1] + (e[-1] - e[-2] if e.size > 1 else h))
+
+    e_x, e_y = edges(mgridx[:, 0], hx), edges(mgridy[0, :], hy)
+    # Los puntos fuera de la malla quedan en la celda del borde
+    x = np.clip(np.asarray(x, dtype=float), e_x[0], e_x[-1])
+    y = np.clip(np.asarray(y, dtype=float), e_y[0], e_y[-1])
+    counts, _, _ = np.histogram2d(x, y, bins=[e_x, e_y])
+    return counts
+
+
+def promap_density(mgridx, mgridy, x, y, t, dias_train, hx, hy, bw_x, bw_y,
+                   rows=None, cols=None, positions=None):
+    """Densidad de ProMap (sin normalizar) en el bloque rows x cols de la
+    malla. Cada incidente suma 1 / n_semanas * 1 / cells_distance en las
+    celdas a menos de bw de él, en el mismo orden que el cálculo celda a
+    celda, por lo que los bloques calculados por separado coinciden
+    exactamente con la malla completa.
+
+    Parameters
+    ----------
+    mgridx : np.ndarray
+      Centros de las celdas en x, con forma (nx, 1) o (nx, ny)
+    mgridy : np.ndarray
+      Centros de las celdas en y, con forma (1, ny) o (nx, ny)
+    x : np.ndarray
+    y : np.ndarray
+    t : np.ndarray
+      Día de cada incidente
+    dias_train : int
+    hx : float
+    hy : float
+    bw_x : float
+    bw_y : float
+    rows : tuple
+      Rango (i_0, i_1) de filas del bloque, None para todas
+    cols : tuple
+      Rango (j_0, j_1) de columnas del bloque, None para todas
+    positions : tuple
+      (p_x, p_y), celda de cada incidente en la malla (ver
+      find_positions). None para calcularlas con mgridx y mgridy; hay
+      que entregarlas cuando la malla es solo una parte de aquella en
+      que se ubican los incidentes
+
+    Returns
+    -------
+    np.ndarray
+      Matriz (i_1 - i_0, j_1 - j_0)
+    """
+    c_x, c_y = mgridx[:, 0], mgridy[0, :]
+    r_0, r_1 = (0, c_x.size) if rows is None else rows
+    c_0, c_1 = (0, c_y.size) if cols is None else cols
+    density = np.zeros((r_1 - r_0, c_1 - c_0))
+
+    ancho_x, ancho_y = radio_pintar(hx, bw_x), radio_pintar(hy, bw_y)
+    p_x, p_y = find_positions(mgridx, mgridy, x, y, hx, hy) \
+        if positions is None else positions
+    delta = (dias_train // 7 + 1) - (np.asarray(t) // 7 + 1)
+    time_weight = 1 / np.where(delta == 0, 1, delta)
+
+    for k in range(p_x.size):
+        i_0, i_1 = max(p_x[k] - ancho_x, r_0), min(p_x[k] + ancho_x, r_1)
+        j_0, j_1 = max(p_y[k] - ancho_y, c_0), min(p_y[k] + ancho_y, c_1)
+        if i_0 >= i_1 or j_0 >= j_1:
+            continue
+        d_x = np.abs(c_x[i_0:i_1] - x[k])
+        d_y = np.abs(c_y[j_0:j_1] - y[k])
+        inside = (d_x <= bw_x)[:, None] & (d_y <= bw_y)[None, :]
+        d = 1 + np.floor(d_x / hx)[:, None] + np.floor(d_y / hy)[None, :]
+        density[i_0 - r_0:i_1 - r_0, j_0 - c_0:j_1 - c_0] += \
+            time_weight[k] * np.where(inside, 1 / d, 0)
+    return density
+
+
+def promap_points(p_x, p_y, mgridx, mgridy, x, y, t, dias_train, hx, hy,
+                  bw_x, bw_y):
+    """Densidad de ProMap (sin normalizar) evaluada en los puntos
+    (p_x, p_y) en vez de en los centros de las celdas. Cada incidente
+    alcanza las mismas celdas que en promap_density, por lo que en un
+    centro ambas coinciden.
+
+    Parameters
+    ----------
+    p_x : np.ndarray
+    p_y : np.ndarray
+      Puntos a evaluar
+    mgridx : np.ndarray
+    mgridy : np.ndarray
+      Centros de las celdas, ver promap_density
+    x : np.ndarray
+    y : np.ndarray
+    t : np.ndarray
+      Coordenadas y día de los incidentes
+    dias_train : int
+    hx : float
+    hy : float
+    bw_x : float
+    bw_y : float
+
+    Returns
+    -------
+    np.ndarray
+    """
+    p_x = np.asarray(p_x, dtype=float).ravel()
+    p_y = np.asarray(p_y, dtype=float).ravel()
+    delta = (dias_train // 7 + 1) - (np.asarray(t) // 7 + 1)
+    time_weight = 1 / np.where(delta == 0, 1, delta)
+
+    ancho_x, ancho_y = radio_pintar(hx, bw_x), radio_pintar(hy, bw_y)
+    i_k, j_k = find_positions(mgridx, mgridy, x, y, hx, hy)
+    i_p, j_p = find_positions(mgridx, mgridy, p_x, p_y, hx, hy)
+
+    density = np.empty(p_x.size)
+    size = max(get_config()['memory_limit'] // (6 * 8 * max(x.size, 1)), 1)
+    for s in range(0, p_x.size, size):
+        b = slice(s, s + size)
+        d_x = np.abs(p_x[b, None] - x[None, :])
+        d_y = np.abs(p_y[b, None] - y[None, :])
+        o_x = i_p[b, None] - i_k[None, :]
+        o_y = j_p[b, None] - j_k[None, :]
+        inside = (d_x <= bw_x) & (d_y <= bw_y) & \
+            (-ancho_x <= o_x) & (o_x < ancho_x) & \
+            (-ancho_y <= o_y) & (o_y < ancho_y)
+        d = 1 + np.floor(d_x / hx) + np.floor(d_y / hy)
+        density[b] = np.where(inside, time_weight / d, 0).sum(axis=1)
+    return density
+
+
 def n_celdas_pintar(xi, yi, x, y, hx, hy):
     """
 
@@ -640,25 +1062,17 @@ def checked_points_pm(points, shp):
 
     Parameters
     ----------
-    points
+    points : np.ndarray
+      Arreglo (2, n) con las coordenadas x, y
     shp : gpd.GeoDataFrame
       Councils shp
     Returns
     -------
-    np.ndarray
+    int
+      Nº de puntos dentro de shp
     """
-    dallas_shp = shp
-    df_points = pd.DataFrame(
-        {'x': points[0, :], 'y': points[1, :]}
-    )
-    inc_points = df_points[['x', 'y']].apply(lambda row:
-                                             Point(row['x'], row['y']),
-                                             axis=1)
-    geo_inc = gpd.GeoDataFrame({'geometry': inc_points})
-    geo_inc.crs = dallas_shp.crs
-    valid_inc = gpd.tools.sjoin(geo_inc, dallas_shp,
-                                how='inner', op='intersects').reset_index()
-    return len(valid_inc)
+    return int(np.count_nonzero(
+        in_shp(points[0, :], points[1, :], shp, use_cache=True)))
 
 
 def find_c(area_array, c_list, ap):
@@ -684,6 +1098,66 @@ def find_hr_pai(values, area_array, ap):
     return values[np.argmin(np.abs(area_array))]
 
 
+def score_levels(z, c=None):
+    """Discretiza una matriz de scores según los thresholds c, tal como
+    se muestra en los heatmaps.
+
+    Parameters
+    ----------
+    z : np.ndarray
+      Scores normalizados en [0, 1], nan fuera de la ciudad
+    c : {None, float, list, np.ndarray}
+      None retorna z sin cambios. Un float retorna 1 para z >= c y 0 en
+      otro caso. Una lista cuenta cuántos de los thresholds en (0, 1)
+      cumplen z >= c, normalizado por el máximo nivel. Es la misma
+      regla de incident_groups y de validate: una celda con score igual
+      a un threshold queda en el mismo nivel que sus incidentes
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if c is None:
+        return z
+    z = np.asarray(z, dtype=float)
+    if np.ndim(c) == 0:
+        levels = (z >= c).astype(float)
+    else:
+        c = np.asarray(c, dtype=float).ravel()
+        c = np.unique(c[(0 < c) & (c < 1)])
+        levels = np.searchsorted(c, np.nan_to_num(z), side='right')
+        levels = levels / max(levels.max(initial=0), 1)
+    return np.where(np.isnan(z), np.nan, levels)
+
+
+def incident_groups(scores, c, colors):
+    """Clasifica los incidentes según los thresholds del frame.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+    c : {None, float, list}
+    colors : dict
+      {nivel: color}, con niveles desde 1
+
+    Returns
+    -------
+    list
+      Tuplas (máscara, color, label)
+    """
+    scores = np.nan_to_num(np.asarray(scores, dtype=float), nan=-1.0)
+    if c is None:
+        return [(np.ones(scores.size, dtype=bool), 'red', 'Incidents')]
+    if np.ndim(c) == 0:
+        hits = scores >= c
+        return [(~hits, 'red', 'Misses'), (hits, 'lime', 'Hits')]
+    c = np.asarray(c, dtype=float).ravel()
+    c = np.unique(c[(0 < c) & (c < 1)])
+    levels = np.searchsorted(c, scores, side='right')
+    return [(levels == i, colors[i + 1], f'Level {i + 1}')
+            for i in range(c.size + 1)]
+
+
 if __name__ == '__main__':
     area_array = [1, 0.7, 0.6, 0.5, 0.45, 0.33, 0]
     c = [0, 0.2, 0.3, 0.4, 0.6, 0.8, 1]
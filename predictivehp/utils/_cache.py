@@ -0,0 +1,235 @@
+"""
+_cache.py
+
+Cache de artefactos (dataframes, arreglos) direccionado por contenido.
+Cada artefacto se guarda bajo una llave calculada a partir del hash de
+los datos de entrada y de los parámetros que lo generaron, de modo que
+un cambio en cualquiera de ellos invalida automáticamente el cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from predictivehp._config import get_config
+
+# Aumentar cada vez que cambie el formato de algún artefacto
+CACHE_VERSION = 1
+
+
+def hash_frame(df, columns=None):
+    """Hash del contenido de un pd.DataFrame.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    columns : list
+      Columnas a considerar. None usa todas
+
+    Returns
+    -------
+    str
+    """
+    if columns is not None:
+        df = df[columns]
+    h = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha1(h.tobytes()).hexdigest()
+
+
+def hash_arrays(*arrays):
+    """Hash del contenido de uno o más np.ndarray.
+
+    Parameters
+    ----------
+    arrays : np.ndarray
+
+    Returns
+    -------
+    str
+    """
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(str((a.dtype, a.shape)).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def hash_geoms(shp):
+    """Hash de las geometrías y el crs de un gpd.GeoDataFrame.
+
+    Parameters
+    ----------
+    shp : gpd.GeoDataFrame
+
+    Returns
+    -------
+    str
+    """
+    h = hashlib.sha1(str(shp.crs).encode())
+    for wkb in shp.geometry.to_wkb():
+        h.update(wkb)
+    return h.hexdigest()
+
+
+def make_key(**params):
+    """Llave del artefacto generado con los parámetros dados.
+
+    Parameters
+    ----------
+    params
+      Valores serializables (los no serializables se pasan a str)
+
+    Returns
+    -------
+    str
+    """
+    params['cache_version'] = CACHE_VERSION
+    s = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(s.encode()).hexdigest()[:20]
+
+
+class ArtifactCache:
+    def __init__(self, root=None):
+        """
+        Parameters
+        ----------
+        root : str
+          Directorio raíz del cache. None usa get_config()['cache_dir']
+        """
+        self.root = root if root is not None else get_config()['cache_dir']
+
+    def path(self, name, key):
+        return os.path.join(self.root, f'{name}-{key}')
+
+    def exists(self, name, key):
+        return os.path.isfile(os.path.join(self.path(name, key),
+                                           'meta.json'))
+
+    def _write(self, name, key, write_fn, meta):
+        """Escribe el artefacto en un directorio temporal y luego lo
+        renombra, de modo que lectores concurrentes nunca ven un
+        artefacto a medio escribir.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        tmp = os.path.join(self.root, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(tmp)
+        try:
+            write_fn(tmp)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(dict(meta or {}, key=key), f, default=str)
+            os.replace(tmp, self.path(name, key))
+        except OSError:
+            # Otro proceso escribió el mismo artefacto primero
+            if not self.exists(name, key):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def meta(self, name, key):
+        with open(os.path.join(self.path(name, key), 'meta.json')) as f:
+            return json.load(f)
+
+    def save_frame(self, name, key, df, meta=None):
+        """Guarda un (Geo)DataFrame en formato parquet.
+
+        Parameters
+        ----------
+        name : str
+        key : str
+        df : pd.DataFrame
+        meta : dict
+        """
+        self._write(name, key,
+                    lambda p: df.to_parquet(os.path.join(p, 'frame.parquet')),
+                    meta)
+
+    def load_frame(self, name, key, geo=False):
+        """
+        Parameters
+        ----------
+        name : str
+        key : str
+        geo : bool
+          True si el artefacto es un gpd.GeoDataFrame
+
+        Returns
+        -------
+        {pd.DataFrame, None}
+          None si el artefacto no existe
+        """
+        if not self.exists(name, key):
+            return None
+        fname = os.path.join(self.path(name, key), 'frame.parquet')
+        if geo:
+            import geopandas as gpd
+
+            return gpd.read_parquet(fname)
+        return pd.read_parquet(fname)
+
+    def save_arrays(self, name, key, arrays, meta=None):
+        """Guarda un conjunto de arreglos como archivos .npy.
+
+        Parameters
+        ----------
+        name : str
+        key : str
+        arrays : dict
+          {nombre: np.ndarray}
+        meta : dict
+        """
+
+        def write(p):
+            for a_name, a in arrays.items():
+                np.save(os.path.join(p, f'{a_name}.npy'), a)
+
+        self._write(name, key, write, meta)
+
+    def build_arrays(self, name, key, build_fn):
+        """Guarda arreglos que build_fn escribe directamente en el
+        directorio del artefacto (e.g. con np.lib.format.open_memmap),
+        para artefactos que no caben en memoria.
+
+        Parameters
+        ----------
+        name : str
+        key : str
+        build_fn : callable
+          build_fn(path) escribe los .npy en path y retorna la metadata
+        """
+        meta = {}
+        self._write(name, key, lambda p: meta.update(build_fn(p)), meta)
+
+    def load_arrays(self, name, key, mmap_mode=None):
+        """
+        Parameters
+        ----------
+        name : str
+        key : str
+        mmap_mode : str
+          Se entrega a np.load. 'r' mapea los arreglos sin leerlos
+
+        Returns
+        -------
+        (dict, dict)
+          Arreglos y metadata, (None, None) si el artefacto no existe
+        """
+        if not self.exists(name, key):
+            return None, None
+        path = self.path(name, key)
+        arrays = {f[:-4]: np.load(os.path.join(path, f), mmap_mode=mmap_mode)
+                  for f in os.listdir(path) if f.endswith('.npy')}
+        return arrays, self.meta(name, key)
+
+    def clear(self):
+        """Elimina todos los artefactos del cache"""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    pass
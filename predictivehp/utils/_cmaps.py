@@ -5,9 +5,12 @@ Establece ciertas configuraciones sobre algunos cmaps de matplotlib
 
 # Author: Mauro Mendoza <msmendoza@uc.cl>
 
-import matplotlib.colors as colors
 import numpy as np
 
+from predictivehp.utils._lazy import lazy_import
+
+colors = lazy_import('matplotlib.colors')
+
 
 def truncate_cmap(cmap, minval=0.0, maxval=1.0, n=100):
     """
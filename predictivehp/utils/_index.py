@@ -0,0 +1,176 @@
+"""
+_index.py
+
+Índice espacio-temporal de incidentes. Los incidentes se ordenan por
+fecha una sola vez y se guardan en arreglos contiguos, de modo que las
+consultas por ventana temporal se resuelven con búsqueda binaria en
+O(log n + k) en lugar de recorrer la tabla completa con una máscara.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def to_days(dates):
+    """Convierte fechas a días desde 1970-01-01.
+
+    Parameters
+    ----------
+    dates : {date, datetime, str, np.datetime64, array-like}
+
+    Returns
+    -------
+    {int, np.ndarray}
+    """
+    if np.ndim(dates) == 0:
+        return int(np.datetime64(pd.Timestamp(dates), 'D').astype(np.int64))
+    dates = pd.to_datetime(np.asarray(dates))
+    return np.asarray(dates.values.astype('datetime64[D]'), dtype=np.int64)
+
+
+class IncidentIndex:
+    def __init__(self, x, y, dates):
+        """
+        Parameters
+        ----------
+        x : np.ndarray
+        y : np.ndarray
+        dates : array-like
+          Fecha de cada incidente
+        """
+        days = to_days(dates)
+        order = np.argsort(days, kind='stable')
+        # Posición de cada incidente en la tabla original
+        self.order = order
+        self.days = np.ascontiguousarray(days[order])
+        self.x = np.ascontiguousarray(np.asarray(x, dtype=float)[order])
+        self.y = np.ascontiguousarray(np.asarray(y, dtype=float)[order])
+        # True si la tabla original ya estaba ordenada por fecha
+        self.in_order = bool(np.all(order[1:] > order[:-1]))
+        self.cells = {}
+
+    @classmethod
+    def from_frame(cls, df, geometry=False, x='x', y='y', date='date'):
+        """
+        Parameters
+        ----------
+        df : {pd.DataFrame, gpd.GeoDataFrame}
+        geometry : bool
+          True para usar las coordenadas de df.geometry en lugar de las
+          columnas x, y
+        x : str
+        y : str
+        date : str
+
+        Returns
+        -------
+        IncidentIndex
+        """
+        if geometry:
+            xs, ys = df.geometry.x.to_numpy(), df.geometry.y.to_numpy()
+        else:
+            xs, ys = df[x].to_numpy(), df[y].to_numpy()
+        return cls(xs, ys, df[date].to_numpy())
+
+    def __len__(self):
+        return self.days.size
+
+    def window(self, d0=None, d1=None):
+        """Rango de los incidentes ordenados con d0 <= fecha < d1.
+
+        Parameters
+        ----------
+        d0 : date
+          None para no acotar por abajo
+        d1 : date
+          None para no acotar por arriba
+
+        Returns
+        -------
+        slice
+        """
+        lo = 0 if d0 is None else \
+            int(np.searchsorted(self.days, to_days(d0), side='left'))
+        hi = self.days.size if d1 is None else \
+            int(np.searchsorted(self.days, to_days(d1), side='left'))
+        return slice(lo, max(lo, hi))
+
+    def cell_ids(self, grid):
+        """Id de la celda de cada incidente (ordenados por fecha), con
+        n = i * ny + j y -1 para los que quedan fuera de la malla. Se
+        calculan una vez por malla.
+
+        Parameters
+        ----------
+        grid : dict
+          x_min, y_min, hx, hy, nx, ny
+
+        Returns
+        -------
+        np.ndarray
+        """
+        key = tuple(float(grid[k]) for k in
+                    ('x_min', 'y_min', 'hx', 'hy', 'nx', 'ny'))
+        if key not in self.cells:
+            i = np.floor((self.x - grid['x_min']) / grid['hx'])
+            j = np.floor((self.y - grid['y_min']) / grid['hy'])
+            inside = (0 <= i) & (i < grid['nx']) & (0 <= j) & (j < grid['ny'])
+            ids = np.full(self.days.size, -1, dtype=np.int64)
+            ids[inside] = i[inside].astype(np.int64) * grid['ny'] + \
+                j[inside].astype(np.int64)
+            self.cells[key] = ids
+        return self.cells[key]
+
+    def query(self, d0=None, d1=None, bbox=None, cells=None, grid=None):
+        """Incidentes con d0 <= fecha < d1, opcionalmente dentro de un
+        bbox o de un conjunto de celdas.
+
+        Parameters
+        ----------
+        d0 : date
+        d1 : date
+        bbox : tuple
+          (x_min, y_min, x_max, y_max)
+        cells : array-like
+          Ids de celdas, requiere grid
+        grid : dict
+
+        Returns
+        -------
+        np.ndarray
+          Posiciones de los incidentes en la tabla original, en el
+          mismo orden que en ella (para usar con df.iloc)
+        """
+        sl = self.window(d0, d1)
+        rows = self.order[sl]
+        mask = None
+        if bbox is not None:
+            x, y = self.x[sl], self.y[sl]
+            mask = (bbox[0] <= x) & (x <= bbox[2]) & \
+                   (bbox[1] <= y) & (y <= bbox[3])
+        if cells is not None:
+            in_cells = np.isin(self.cell_ids(grid)[sl], cells)
+            mask = in_cells if mask is None else mask & in_cells
+        if mask is not None:
+            rows = rows[mask]
+        return rows if self.in_order else np.sort(rows)
+
+    def take(self, df, d0=None, d1=None, **kwargs):
+        """Filas de df (la tabla con que se construyó el índice) que
+        cumplen la consulta. Ver IncidentIndex.query.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+        d0 : date
+        d1 : date
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        return df.iloc[self.query(d0, d1, **kwargs)]
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,73 @@
+"""
+_lazy.py
+
+Importación diferida de dependencias pesadas (geopandas, matplotlib,
+statsmodels, sklearn, ...). El módulo real se importa recién cuando se
+accede a alguno de sus atributos, de modo que `import predictivehp`
+solo carga numpy y pandas.
+"""
+
+import importlib
+import types
+
+from predictivehp._config import apply_rc
+
+
+class LazyModule(types.ModuleType):
+    def __init__(self, name, on_import=None):
+        """
+        Parameters
+        ----------
+        name : str
+          Nombre completo del módulo, e.g. 'matplotlib.pyplot'
+        on_import : callable
+          Función que recibe el módulo y se ejecuta una sola vez, justo
+          después de importarlo
+        """
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_on_import'] = on_import
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = module
+            on_import = self.__dict__['_lazy_on_import']
+            if on_import is not None:
+                on_import(module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] else 'not loaded'
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name, on_import=None):
+    """Retorna un proxy del módulo name que lo importa al primer uso.
+
+    Parameters
+    ----------
+    name : str
+    on_import : callable
+
+    Returns
+    -------
+    LazyModule
+    """
+    return LazyModule(name, on_import=on_import)
+
+
+# Los parámetros de ploteo de _config.rc se aplican al primer uso de
+# matplotlib dentro del paquete
+mpl = lazy_import('matplotlib', on_import=apply_rc)
+plt = lazy_import('matplotlib.pyplot', on_import=apply_rc)
+
+if __name__ == '__main__':
+    pass
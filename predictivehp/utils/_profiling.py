@@ -0,0 +1,289 @@
+"""
+_profiling.py
+
+Instrumentación por etapas. Las etapas se marcan con el context manager
+stage o con el decorador profiled y solo se registran mientras hay un
+Profiler activo; sin él su costo es una comparación.
+
+Por cada etapa se registra el tiempo de pared, el tiempo de CPU del
+proceso y el RSS al inicio, al final y el máximo durante la etapa
+(muestreado por un thread). Los registros se exportan como tabla
+(pd.DataFrame) o como trace JSON para chrome://tracing / Perfetto.
+
+    >>> with Profiler() as prof:
+    ...     m.fit()
+    ...     m.predict()
+    >>> prof.summary()
+    >>> prof.to_chrome_trace('trace.json')
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+_active = []  # Profilers activos
+_hooks = []  # Funciones llamadas con cada registro
+_local = threading.local()
+
+
+def rss():
+    """RSS actual del proceso en bytes, None si no se puede medir.
+
+    Returns
+    -------
+    int
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # ru_maxrss es el máximo histórico, en KiB en Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+
+def add_hook(fn):
+    """Registra fn, que se llama con el dict de cada etapa terminada en
+    cualquier Profiler (e.g. para loggear).
+
+    Parameters
+    ----------
+    fn : callable
+    """
+    _hooks.append(fn)
+
+
+def remove_hook(fn):
+    """
+    Parameters
+    ----------
+    fn : callable
+    """
+    _hooks.remove(fn)
+
+
+class _Sampler(threading.Thread):
+    """Muestrea el RSS cada interval segundos y actualiza el máximo de
+    las etapas abiertas."""
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.open = []
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def sample(self):
+        value = rss()
+        if value is None:
+            return
+        with self.lock:
+            for record in self.open:
+                if value > record['peak_rss']:
+                    record['peak_rss'] = value
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.sample()
+
+
+class Profiler:
+    def __init__(self, interval=0.01, hooks=None):
+        """Registra las etapas ejecutadas mientras está activo.
+
+        Parameters
+        ----------
+        interval : float
+          Segundos entre muestras de RSS
+        hooks : list
+          Funciones llamadas con cada registro, además de las
+          globales de add_hook
+        """
+        self.interval = interval
+        self.hooks = list(hooks or [])
+        self.records = []
+        self.t0 = None
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        self.t0 = time.perf_counter()
+        self._sampler = _Sampler(self.interval)
+        self._sampler.start()
+        _active.append(self)
+        return self
+
+    def stop(self):
+        if self in _active:
+            _active.remove(self)
+        if self._sampler is not None:
+            self._sampler.done.set()
+            self._sampler.join()
+            # Las etapas que siguen abiertas se cierran al detenerse
+            for record in reversed(list(self._sampler.open)):
+                self.close(record)
+            self._sampler = None
+
+    def open(self, name, meta):
+        depth = getattr(_local, 'depth', 0)
+        value = rss()
+        record = {'name': name, 'depth': depth,
+                  'thread': threading.get_ident(),
+                  'start': time.perf_counter() - self.t0,
+                  'wall': None, 'cpu': time.process_time(),
+                  'rss_start': value, 'rss_end': None,
+                  'peak_rss': value or 0}
+        record.update(meta)
+        sampler = self._sampler
+        if sampler is not None:
+            with sampler.lock:
+                sampler.open.append(record)
+        return record
+
+    def close(self, record):
+        if record['wall'] is not None:
+            return  # Ya cerrada por stop
+        record['wall'] = time.perf_counter() - self.t0 - record['start']
+        record['cpu'] = time.process_time() - record['cpu']
+        record['rss_end'] = rss()
+        if record['rss_end'] is not None:
+            record['peak_rss'] = max(record['peak_rss'], record['rss_end'])
+        sampler = self._sampler
+        if sampler is not None:
+            with sampler.lock:
+                sampler.open[:] = [r for r in sampler.open
+                                   if r is not record]
+        with self._lock:
+            self.records.append(record)
+        for hook in self.hooks + _hooks:
+            hook(record)
+
+    def table(self):
+        """Una fila por etapa, en orden de término.
+
+        Returns
+        -------
+        pd.DataFrame
+          name, depth, thread, start, wall, cpu [s] y rss_start,
+          rss_end, peak_rss [bytes]
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.records)
+
+    def summary(self):
+        """Totales por nombre de etapa, ordenados por tiempo de pared.
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        df = self.table()
+        if df.empty:
+            return df
+        return df.groupby('name').agg(
+            calls=('wall', 'size'), wall=('wall', 'sum'),
+            cpu=('cpu', 'sum'), peak_rss=('peak_rss', 'max'),
+        ).sort_values('wall', ascending=False)
+
+    def to_chrome_trace(self, path=None):
+        """Registros en el formato Trace Event de Chrome (eventos
+        completos 'X' en microsegundos).
+
+        Parameters
+        ----------
+        path : str
+          Archivo donde guardar el trace. None para solo retornarlo
+
+        Returns
+        -------
+        dict
+        """
+        pid = os.getpid()
+        events = []
+        for r in self.records:
+            args = {k: v for k, v in r.items()
+                    if k not in {'name', 'thread', 'start', 'wall'}}
+            events.append({'name': r['name'], 'ph': 'X', 'pid': pid,
+                           'tid': r['thread'], 'ts': r['start'] * 1e6,
+                           'dur': r['wall'] * 1e6, 'args': args})
+            if r['peak_rss']:
+                events.append({'name': 'peak_rss', 'ph': 'C', 'pid': pid,
+                               'ts': r['start'] * 1e6,
+                               'args': {'MB': r['peak_rss'] / 2 ** 20}})
+        trace = {'traceEvents': sorted(events, key=lambda e: e['ts']),
+                 'displayTimeUnit': 'ms'}
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+
+@contextmanager
+def stage(name, **meta):
+    """Marca una etapa para los Profilers activos.
+
+    Parameters
+    ----------
+    name : str
+    meta
+      Datos extra que se guardan en el registro (e.g. n=len(data))
+    """
+    if not _active:
+        yield
+        return
+    profilers = list(_active)
+    records = [p.open(name, meta) for p in profilers]
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        for p, record in zip(profilers, records):
+            p.close(record)
+
+
+def profiled(name=None):
+    """Decorador que ejecuta la función dentro de stage.
+
+    Parameters
+    ----------
+    name : str
+      None usa el __qualname__ de la función (e.g. 'ProMap.predict')
+    """
+    def decorator(fn):
+        s_name = fn.__qualname__ if name is None else name
+
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            if not _active:
+                return fn(*args, **kwargs)
+            with stage(s_name):
+                return fn(*args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+if __name__ == '__main__':
+    pass
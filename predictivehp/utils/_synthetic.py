@@ -0,0 +1,202 @@
+"""
+_synthetic.py
+
+Generador de incidentes sintéticos con el formato de get_data, para
+probar y perfilar los modelos sin conexión a Socrata.
+
+Los incidentes provienen de un proceso de clusters espacio-temporal
+dentro de los polígonos del shapefile de councils: cada cluster tiene un
+centro, un peso y un día peak, y sus incidentes se distribuyen en torno
+a ellos con dispersiones gaussianas. Una fracción de fondo se distribuye
+uniformemente en la ciudad y en el año. Todo el muestreo es vectorizado,
+por lo que millones de incidentes se generan en segundos.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from predictivehp.utils._lazy import lazy_import
+
+gpd = lazy_import('geopandas')
+shapely = lazy_import('shapely')
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+COUNCILS = os.path.join(DATA_DIR, 'councils.shp')
+FIXTURE = os.path.join(DATA_DIR, 'synthetic_incidents.csv')
+
+
+def load_councils(shp=None, crs=2276):
+    """Polígonos donde se generan los incidentes, en el crs dado.
+
+    Parameters
+    ----------
+    shp : {None, str, gpd.GeoDataFrame}
+      None para el shapefile de councils del paquete
+    crs
+      crs de las coordenadas generadas. Se asume también para los
+      shapefiles que no traen crs
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+    """
+    if shp is None:
+        shp = COUNCILS
+    if isinstance(shp, str):
+        shp = gpd.read_file(shp)
+    if shp.crs is None:
+        shp = shp.set_crs(crs)
+    return shp.to_crs(crs)
+
+
+def sample_inside(region, sampler, n, rng, max_iter=100):
+    """Muestreo por rechazo: llama a sampler hasta tener n puntos dentro
+    de region.
+
+    Parameters
+    ----------
+    region : shapely.Geometry
+    sampler : callable
+      sampler(m) retorna (x, y, extra) con m puntos candidatos
+    n : int
+    rng : np.random.Generator
+    max_iter : int
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray, np.ndarray)
+    """
+    if n == 0:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    xs, ys, es, total = [], [], [], 0
+    for _ in range(max_iter):
+        if total >= n:
+            break
+        # Se sobremuestrea según la tasa de aceptación observada
+        rate = total / max(sum(x.size for x in xs), 1) if xs else 0.5
+        m = int((n - total) / max(rate, 0.05) * 1.1) + 16
+        x, y, e = sampler(m)
+        inside = shapely.contains_xy(region, x, y)
+        xs.append(x[inside])
+        ys.append(y[inside])
+        es.append(e[inside])
+        total += int(inside.sum())
+    else:
+        if total < n:
+            raise RuntimeError("Could not sample enough points inside "
+                               "the region")
+    return np.concatenate(xs)[:n], np.concatenate(ys)[:n], \
+        np.concatenate(es)[:n]
+
+
+def make_incidents(n, shp=None, year=2017, n_clusters=60,
+                   cluster_std=(800., 3000.), t_std=(7., 90.),
+                   background=0.2, offenses=None, crs=2276, seed=None):
+    """Genera n incidentes sintéticos con el formato de get_data.
+
+    Parameters
+    ----------
+    n : int
+    shp : {None, str, gpd.GeoDataFrame}
+      Polígonos de la ciudad, ver load_councils
+    year : int
+    n_clusters : int
+    cluster_std : tuple
+      Rango (min, max) de la dispersión espacial de los clusters, en
+      las unidades de crs (pies para EPSG:2276)
+    t_std : tuple
+      Rango (min, max) de la dispersión temporal de los clusters, en
+      días. Los clusters con t_std alto son hotspots persistentes
+    background : float
+      Fracción de incidentes uniformes en la ciudad y en el año
+    offenses : {None, list, dict}
+      Tipos de incidente. Con una lista o un dict {tipo: probabilidad}
+      se agrega la columna 'offincident', como get_data con varios
+      tipos
+    crs
+      crs de las coordenadas x, y
+    seed : int
+
+    Returns
+    -------
+    pd.DataFrame
+      Columnas x, y, date, month1, y_day (y offincident), ordenadas por
+      fecha
+    """
+    rng = np.random.default_rng(seed)
+    region = shapely.union_all(load_councils(shp, crs).geometry.values)
+    shapely.prepare(region)
+    x_min, y_min, x_max, y_max = region.bounds
+    n_days = 366 if pd.Timestamp(year=year, month=1, day=1).is_leap_year \
+        else 365
+
+    def uniform(m):
+        return rng.uniform(x_min, x_max, m), rng.uniform(y_min, y_max, m), \
+            np.zeros(m)
+
+    # Clusters: centro dentro de la ciudad, peso, dispersiones y día peak
+    c_x, c_y, _ = sample_inside(region, uniform, n_clusters, rng)
+    weights = rng.lognormal(0, 1, n_clusters)
+    weights /= weights.sum()
+    s_std = rng.uniform(*cluster_std, n_clusters)
+    d_std = rng.uniform(*t_std, n_clusters)
+    peak = rng.uniform(0, n_days, n_clusters)
+
+    n_bg = rng.binomial(n, background)
+
+    def clustered(m):
+        k = rng.choice(n_clusters, m, p=weights)
+        return c_x[k] + rng.normal(0, s_std[k]), \
+            c_y[k] + rng.normal(0, s_std[k]), k
+
+    x, y, k = sample_inside(region, clustered, n - n_bg, rng)
+    days = np.mod(np.rint(peak[k] + rng.normal(0, d_std[k])), n_days)
+
+    b_x, b_y, _ = sample_inside(region, uniform, n_bg, rng)
+    x, y = np.concatenate([x, b_x]), np.concatenate([y, b_y])
+    days = np.concatenate([days, rng.integers(0, n_days, n_bg)])
+
+    order = np.argsort(days, kind='stable')
+    dates = pd.Timestamp(year=year, month=1, day=1) + \
+        pd.to_timedelta(days[order], unit='D')
+    df = pd.DataFrame({
+        'x': x[order],
+        'y': y[order],
+        'date': dates.date,
+        'month1': pd.Series(dates.month_name(), dtype=object),
+        'y_day': dates.dayofyear.to_numpy(dtype=np.int64),
+    })
+    if offenses is not None:
+        if isinstance(offenses, dict):
+            names, p = list(offenses), np.asarray(list(offenses.values()),
+                                                 dtype=float)
+        else:
+            names, p = list(offenses), np.ones(len(offenses))
+        df.insert(4, 'offincident', np.asarray(names, dtype=object)[
+            rng.choice(len(names), len(df), p=p / p.sum())])
+    return df
+
+
+def load_incidents(path=FIXTURE):
+    """Lee una tabla de incidentes guardada con to_csv (e.g. el fixture
+    del paquete) y la deja con el formato de get_data.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    df = pd.read_csv(path)
+    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d').dt.date
+    df['month1'] = df['month1'].astype(object)
+    df['y_day'] = df['y_day'].astype(np.int64)
+    return df
+
+
+if __name__ == '__main__':
+    pass
@@ -1,5 +1,7 @@
 from ._plotter import Plotter
+from ._render import BatchRenderer
 
 __all__ = [
     'Plotter',
+    'BatchRenderer',
 ]
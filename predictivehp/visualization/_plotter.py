@@ -1,7 +1,8 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
 import predictivehp.utils as ut
+from predictivehp.utils._lazy import plt
+from ._render import BatchRenderer
 
 
 class Plotter:
@@ -48,10 +49,43 @@ class Plotter:
         pass
 
     def heatmap(self, c=None, ap=None, show_score=True, incidences=False,
-                savefig=False, verbose=False, show_axis=True, **kwargs):
+                savefig=False, verbose=False, show_axis=True, show=True,
+                **kwargs):
         for m in self.model.models:
             m.heatmap(c=c, ap=ap, show_score=show_score, incidences=incidences,
-                      savefig=savefig, verbose=verbose, colors=self.colors, show_axis=show_axis, **kwargs)
+                      savefig=savefig, verbose=verbose, colors=self.colors,
+                      show_axis=show_axis, show=show, **kwargs)
+
+    def render(self, c=None, ap=None, regions=None, incidences=False,
+               out_dir='.', n_jobs=None, verbose=False, **kwargs):
+        """Genera los heatmaps de todos los modelos como PNG sin abrir
+        ventanas, en paralelo. Ver BatchRenderer.
+
+        Parameters
+        ----------
+        c : {None, float, list}
+          Un frame por cada elemento; una tupla genera un heatmap
+          multinivel
+        ap : {None, float, list}
+        regions : {None, str, dict}
+          e.g. 'DISTRICT' para un frame por distrito
+        incidences : bool
+        out_dir : str
+        n_jobs : int
+        kwargs
+          Se entregan a BatchRenderer (figsize, dpi, streets_px, cmap)
+
+        Returns
+        -------
+        list
+          Rutas de las imágenes generadas
+        """
+        renderer = BatchRenderer(self.model.models, shps=self.model.shps,
+                                 out_dir=out_dir, colors=self.colors,
+                                 **kwargs)
+        return renderer.render(c=c, ap=ap, regions=regions,
+                               incidences=incidences, n_jobs=n_jobs,
+                               verbose=verbose)
 
     def hr(self):
         """Plotea la curva Hit Rate para el c o ap dado.
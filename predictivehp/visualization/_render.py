@@ -0,0 +1,306 @@
+"""
+_render.py
+
+Renderizado de heatmaps sin display (canvas Agg) para generar imágenes
+en batch, e.g. un PNG por modelo, threshold y distrito.
+
+El shapefile de calles se rasteriza una sola vez y se reutiliza como
+imagen de fondo; cada proceso worker crea una única figura y la
+actualiza frame a frame.
+"""
+
+import os
+
+import numpy as np
+
+import predictivehp.utils._aux_functions as af
+from predictivehp._config import apply_rc, get_config
+
+
+def rasterize_streets(streets, width=2048, color='w', lw=0.3, alpha=0.2):
+    """Dibuja las calles en un arreglo RGBA con fondo transparente.
+
+    Parameters
+    ----------
+    streets : gpd.GeoDataFrame
+    width : int
+      Ancho de la imagen en pixeles. El alto se calcula para mantener
+      la razón de aspecto de total_bounds
+    color : str
+    lw : float
+    alpha : float
+
+    Returns
+    -------
+    (np.ndarray, list)
+      Imagen (alto, ancho, 4) y su extent [x_min, x_max, y_min, y_max]
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    x_min, y_min, x_max, y_max = streets.total_bounds
+    height = max(int(round(width * (y_max - y_min) / (x_max - x_min))), 1)
+
+    fig = Figure(figsize=(width / 100, height / 100), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    fig.patch.set_alpha(0)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    streets.plot(ax=ax, color=color, lw=lw, alpha=alpha)
+    ax.set_xlim(x_min, x_max)
+    ax.set_ylim(y_min, y_max)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy(), \
+        [x_min, x_max, y_min, y_max]
+
+
+def render_frames(task):
+    """Renderiza una lista de frames reutilizando una misma figura. Se
+    ejecuta en los procesos worker.
+
+    Parameters
+    ----------
+    task : dict
+      frames, layers, streets y style, ver BatchRenderer.render
+
+    Returns
+    -------
+    list
+      Rutas de las imágenes generadas
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    apply_rc()
+    style, layers = task['style'], task['layers']
+
+    # Posiciones fijas: con un layout automático la imagen de cada frame
+    # dependería de los frames anteriores (el colorbar oculto conserva
+    # su posición previa)
+    fig = Figure(figsize=style['figsize'], dpi=style['dpi'])
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0.1, 0.07, 0.7, 0.86])
+    heat = ax.imshow(np.zeros((1, 1)), cmap=style['cmap'], vmin=0, vmax=1,
+                     interpolation='none', zorder=1)
+    if task['streets'] is not None:
+        img, s_extent = task['streets']
+        ax.imshow(img, extent=s_extent, interpolation='antialiased',
+                  zorder=2)
+    c_bar = fig.colorbar(heat, cax=fig.add_axes([0.84, 0.29, 0.02, 0.42]))
+    c_bar.ax.set_ylabel('Danger Score')
+
+    paths = []
+    for frame in task['frames']:
+        layer = layers[frame['model']]
+        z = af.score_levels(layer['z'], frame['c'])
+        heat.set_data(np.flipud(z.T))
+        heat.set_extent(layer['extent'])
+        heat.set_alpha(0.3 if frame['incidences'] else 1.0)
+        c_bar.ax.set_visible(frame['c'] is None)
+
+        bounds = frame['bounds']
+        if bounds is None:
+            bounds = layer['extent']
+        ax.set_xlim(bounds[0], bounds[1])
+        ax.set_ylim(bounds[2], bounds[3])
+        ax.set_title(frame['title'])
+
+        artists = []
+        if frame['incidences']:
+            x, y, s = layer['points']
+            for mask, color, label in af.incident_groups(s, frame['c'],
+                                                         style['colors']):
+                if mask.any():
+                    artists.append(ax.scatter(x[mask], y[mask], s=3,
+                                              color=color, marker='o',
+                                              zorder=3, label=label))
+            if artists:
+                artists.append(ax.legend())
+
+        canvas.print_figure(frame['path'], dpi=style['dpi'],
+                            facecolor=fig.get_facecolor())
+        paths.append(frame['path'])
+        for artist in artists:
+            artist.remove()
+    return paths
+
+
+def resolve_c(m, ap):
+    """Threshold(s) c del modelo m equivalentes al area percentage ap.
+
+    Parameters
+    ----------
+    m : {STKDE, RForestRegressor, ProMap}
+    ap : {float, list}
+
+    Returns
+    -------
+    {float, list}
+    """
+    if m.ap is None:
+        m.calculate_pai(np.linspace(0, 1, 1000))
+    if np.ndim(ap) == 0:
+        return float(af.find_c(m.ap, m.c_vector, ap))
+    c = sorted({float(af.find_c(m.ap, m.c_vector, i)) for i in ap})
+    return c[0] if len(c) == 1 else c
+
+
+class BatchRenderer:
+    def __init__(self, models, shps=None, out_dir='.', figsize=(6.75, 6.75),
+                 dpi=200, streets_px=2048, cmap='jet', colors=None):
+        """Genera los heatmaps de varios modelos sin abrir ventanas.
+
+        Parameters
+        ----------
+        models : list
+          Modelos ya ajustados (STKDE, RForestRegressor, ProMap)
+        shps : dict
+          Shapefiles de la ciudad. Se usan 'streets' como fondo y
+          'councils' para los regions por distrito
+        out_dir : str
+          Directorio donde se guardan las imágenes
+        figsize : tuple
+        dpi : int
+        streets_px : int
+          Ancho en pixeles de la imagen de calles
+        cmap : str
+        colors : dict
+          {nivel: color} para los incidentes en heatmaps multinivel
+        """
+        self.models = list(models)
+        self.shps = shps
+        self.out_dir = out_dir
+        self.figsize, self.dpi = tuple(figsize), dpi
+        self.streets_px = streets_px
+        self.cmap = cmap
+        self.colors = colors if colors is not None else \
+            {1: "blue", 2: "lime", 3: "red", 4: "green"}
+        self._streets = None
+
+    @property
+    def streets(self):
+        """Calles rasterizadas, se calculan una sola vez"""
+        if self._streets is None and self.shps is not None:
+            self._streets = rasterize_streets(self.shps['streets'],
+                                              width=self.streets_px)
+        return self._streets
+
+    def regions(self, regions=None):
+        """
+        Parameters
+        ----------
+        regions : {None, str, dict}
+          None para la ciudad completa, el nombre de una columna de
+          shps['councils'] para un frame por valor (e.g. 'DISTRICT') o
+          un dict {nombre: (x_min, y_min, x_max, y_max)}
+
+        Returns
+        -------
+        dict
+          {nombre: [x_min, x_max, y_min, y_max]}, {None: None} para la
+          ciudad completa
+        """
+        if regions is None:
+            return {None: None}
+        if isinstance(regions, str):
+            regions = {name: g.total_bounds for name, g in
+                       self.shps['councils'].groupby(regions)}
+        return {name: [b[0], b[2], b[1], b[3]]
+                for name, b in regions.items()}
+
+    def frames(self, c=None, ap=None, regions=None, incidences=False):
+        """Lista de frames a renderizar, uno por cada combinación de
+        modelo, threshold y región.
+
+        Parameters
+        ----------
+        c : {None, float, list}
+          Thresholds. Cada elemento de la lista genera un frame: un
+          float para un heatmap binario, una tupla de floats para uno
+          multinivel y None para el score continuo
+        ap : {None, float, list}
+          Ídem c, en area percentage. Se traducen a c con find_c
+        regions : {None, str, dict}
+          Ver BatchRenderer.regions
+        incidences : bool
+
+        Returns
+        -------
+        list
+        """
+        c = list(c) if isinstance(c, (list, np.ndarray)) else [c]
+        ap = [] if ap is None else \
+            list(ap) if isinstance(ap, (list, np.ndarray)) else [ap]
+        if ap and c == [None]:
+            c = []
+        specs = [('c', c_i) for c_i in c] + [('ap', ap_i) for ap_i in ap]
+
+        frames = []
+        for m in self.models:
+            for kind, value in specs:
+                c_m = value if kind == 'c' else resolve_c(m, value)
+                tag = 'score' if value is None else \
+                    f"{kind}{'-'.join(f'{v:.3f}' for v in np.ravel(value))}"
+                for name, bounds in self.regions(regions).items():
+                    suffix = '' if name is None else f'_{name}'
+                    frames.append({
+                        'model': m.name, 'c': c_m, 'bounds': bounds,
+                        'incidences': incidences,
+                        'title': m.name if name is None
+                        else f'{m.name} - {name}',
+                        'path': os.path.join(self.out_dir,
+                                             f'{m.name}_{tag}{suffix}.png'),
+                    })
+        return frames
+
+    def render(self, c=None, ap=None, regions=None, incidences=False,
+               n_jobs=None, verbose=False):
+        """Renderiza los frames en paralelo y los guarda como PNG.
+
+        Parameters
+        ----------
+        c : {None, float, list}
+        ap : {None, float, list}
+        regions : {None, str, dict}
+        incidences : bool
+          True para dibujar los incidentes de testeo
+        n_jobs : int
+          None usa get_config()['n_jobs']
+        verbose : bool
+
+        Returns
+        -------
+        list
+          Rutas de las imágenes generadas
+        """
+        frames = self.frames(c=c, ap=ap, regions=regions,
+                             incidences=incidences)
+        os.makedirs(self.out_dir, exist_ok=True)
+        print(f'\tRendering {len(frames)} frames...') if verbose else None
+
+        layers = {}
+        for m in self.models:
+            z, extent = m.score_grid()
+            layers[m.name] = {'z': np.asarray(z, dtype=float),
+                              'extent': list(extent)}
+            if incidences:
+                layers[m.name]['points'] = m.test_scores()
+
+        style = {'figsize': self.figsize, 'dpi': self.dpi,
+                 'cmap': self.cmap, 'colors': self.colors}
+        n_jobs = get_config()['n_jobs'] if n_jobs is None else n_jobs
+        n_chunks = max(min(n_jobs, len(frames)), 1)
+        tasks = []
+        for chunk in np.array_split(np.arange(len(frames)), n_chunks):
+            chunk_frames = [frames[i] for i in chunk]
+            names = {f['model'] for f in chunk_frames}
+            tasks.append({'frames': chunk_frames,
+                          'layers': {n: layers[n] for n in names},
+                          'streets': self.streets, 'style': style})
+
+        paths = af.parallel_map(render_frames, tasks, n_jobs=n_jobs)
+        return [p for chunk in paths for p in chunk]
+
+
+if __name__ == '__main__':
+    pass